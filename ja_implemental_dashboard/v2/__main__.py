@@ -1,5 +1,11 @@
 import os, sys, time
 
+# headless export of the indicators (see export): dispatched before
+# importing panel and loading the database with the file dialog
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "export":
+    from .export import main as export_main
+    sys.exit(export_main(sys.argv[2:]))
+
 import warnings
 # Suppress FutureWarning messages
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -18,13 +24,27 @@ from .header import Header
 from .footer import Footer
 from .loading import Loading
 from .main_selectors import DiseaseSelector, IndicatorTypeSelector, CohortSelector
-# database is loaded in the .database.database module, 
-# and imported in the .indicator.dispatcher module.
+# the database is opened and preprocessed by the session (see .database.session),
+# the .indicator.dispatcher module only gets a lazy connection to it.
+from .database.session import get_database_session, DATABASE_FILE_ENVIRONMENT_VARIABLE
 from .indicator.dispatcher import dispatcher_instance
+from .indicator.async_plot import plot_counter
+from .database.profiler import get_sql_profiler
+from .diagnostics import Diagnostics
 
 
 if __name__ == "__main__":
 
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m ja_implemental_dashboard.v2",
+        description="JA ImpleMENTAL dashboard (use 'export' as first argument for the headless export).",
+    )
+    parser.add_argument("--database", default=None, help=f"The original database (.sqlite3) or a ja database (.jasqlite3). By default the environment variable {DATABASE_FILE_ENVIRONMENT_VARIABLE}, else a file dialog is opened.")
+    args = parser.parse_args()
+    # prepare the database before opening the dashboard
+    get_database_session().open(args.database).prepare()
+
     language_selector_instance = LanguageSelector()
     header_instance = Header()
     disease_selector_instance = DiseaseSelector()
@@ -32,7 +52,6 @@ if __name__ == "__main__":
     cohort_selector_instance = CohortSelector()
     footer_instance = Footer()
     loading_animation_instance = Loading()
-    from .loading.loading import widg_increase, widg_decrease # useful just here to put it in the dashboard app
 
     APP = panel.Column(
         language_selector_instance.get_panel(),
@@ -47,7 +66,9 @@ if __name__ == "__main__":
                    cohort_selector_instance.widget
         ),
         panel.bind(footer_instance.get_panel, language_selector_instance.widget),
+        plot_counter.get_panel(),
+        *([] if get_sql_profiler() is None else [Diagnostics(get_sql_profiler()).get_panel()]),
         panel.pane.HTML("</br style='padding-top: 200px;'>"),
-        loading_animation_instance.get_panel(), widg_increase, widg_decrease
+        loading_animation_instance.get_panel()
     )
     APP.show()
\ No newline at end of file
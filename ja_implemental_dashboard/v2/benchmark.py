@@ -0,0 +1,201 @@
+"""
+Scale benchmarks of the preprocessing pipeline and of the indicators.
+
+Generates a synthetic original database (see database.synthetic) at the given scale and
+seed, runs the preprocessing pipeline on it from scratch, timing each stage
+(see database.pipeline), then computes each indicator for the standard widget state
+(all ages, genders, ...) for every disease, without the indicators cache.
+The results are appended, with the git commit of the code, to a JSON lines file,
+and compared with the previous run at the same scale and seed.
+
+The synthetic databases are kept in the work folder and reused (they depend only on the
+scale and the seed). The pipeline uses a cache folder inside the work folder
+(see caching.caching), so the cache of the dashboard is not touched.
+
+Usage (from the repository root):
+python -m ja_implemental_dashboard.v2.benchmark [--scale 10k] [--seed 0] [--workdir benchmarks]
+    [--results benchmarks/results.jsonl] [--label text] [--workers N] [--no-indicators]
+"""
+
+import os, sys, time
+import argparse
+import json
+import shutil
+import platform
+import subprocess
+import sqlite3
+
+from .caching.caching import CACHE_FOLDER_ENVIRONMENT_VARIABLE
+
+
+def get_git_commit() -> dict:
+    """ The commit of the code being benchmarked, and if it has uncommitted changes. """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=folder, capture_output=True, text=True, timeout=30).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no", "."], cwd=folder, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit if commit != "" else None, "dirty": status != ""}
+
+
+def benchmark_pipeline(database_file_path: str) -> tuple[sqlite3.Connection, dict]:
+    """ Run the preprocessing pipeline from scratch on database_file_path.
+    Returns the connection to the ja database and the time of each stage.
+    """
+    from .caching.database import get_cache_folder
+    from .database.pipeline import load_and_preprocess_database
+    # from scratch: no ja database, no manifests
+    ja_database_file_path = database_file_path.replace(".sqlite3", ".jasqlite3")
+    if os.path.exists(ja_database_file_path):
+        os.remove(ja_database_file_path)
+    shutil.rmtree(os.path.join(get_cache_folder(), "manifests"), ignore_errors=True)
+    stage_timings = {}
+    t0 = time.time()
+    connection = load_and_preprocess_database(database_file_path, stage_timings=stage_timings)
+    stage_timings["total"] = time.time() - t0
+    return connection, stage_timings
+
+def benchmark_indicators(connection: sqlite3.Connection, max_workers: int|None=None) -> dict:
+    """ Time of each indicator (all its years of inclusion) for the standard widget state,
+    for every disease (and cohort _a_ for the evaluation indicators), without the cache.
+    Returns {indicator: {disease: seconds}}.
+    """
+    from .database.database import DISEASE_CODE_TO_DB_CODE
+    from .database.parallel import map_years
+    from .caching.precompute import get_widget_states
+    from .indicator.widget_texts import AGE_WIDGET_INTERVALS
+    from .indicator.evaluation.engine import EVALUATION_INDICATORS_EVENTS, evaluate_indicator_json, get_years_of_inclusion
+    from .indicator.monitoring.engine import MONITORING_INDICATORS_FUNCTIONS
+    state = get_widget_states(max_depth=0)[0]
+    selection = {
+        "age": [AGE_WIDGET_INTERVALS[a] for a in state["age"]],
+        "gender": state["gender"],
+        "civil_status": state["civil_status"],
+        "job_condition": state["job_condition"],
+        "educational_level": state["educational_level"],
+    }
+    timings = {}
+    for disease_code, disease_db_code in DISEASE_CODE_TO_DB_CODE.items():
+        years = get_years_of_inclusion(connection, disease_db_code)
+        for indicator_code, function in MONITORING_INDICATORS_FUNCTIONS.items():
+            def evaluate_year_(connection_, year: int) -> dict:
+                return function(connection=connection_, cohorts_required=True, disease_db_code=disease_db_code, year_of_inclusion=year, **selection)
+            t0 = time.time()
+            map_years(connection, evaluate_year_, years, max_workers=max_workers)
+            timings.setdefault(indicator_code, {})[disease_code] = time.time() - t0
+        for indicator_code, events in EVALUATION_INDICATORS_EVENTS.items():
+            if events["disease_db_code"] is not None and events["disease_db_code"] != disease_db_code:
+                continue
+            t0 = time.time()
+            evaluate_indicator_json(indicator_code, connection, disease_code, "_a_", max_workers=max_workers, **selection)
+            timings.setdefault(indicator_code, {})[disease_code] = time.time() - t0
+    return timings
+
+
+def read_results(results_file_path: str) -> list[dict]:
+    if not os.path.exists(results_file_path):
+        return []
+    with open(results_file_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+def append_result(results_file_path: str, result: dict) -> None:
+    folder = os.path.dirname(os.path.abspath(results_file_path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(results_file_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+
+def print_comparison(result: dict, previous: dict|None) -> None:
+    """ Print the timings of result, and their ratio to the ones of previous. """
+    def line_(name: str, t: float, t_previous: float|None) -> str:
+        ratio = "" if t_previous is None or t <= 0 else f"  {t_previous / t:6.2f}x faster" if t < t_previous else f"  {t / t_previous:6.2f}x slower" if t_previous > 0 else ""
+        before = "" if t_previous is None else f"  (was {t_previous:8.3f} s)"
+        return f"\t{name:<32} {t:8.3f} s{before}{ratio}"
+    if previous is not None:
+        print(f"Compared with {previous['git']['commit']}{' (dirty)' if previous['git']['dirty'] else ''} {previous['label']} of {previous['date']}:")
+    print("Pipeline stages:")
+    for stage, t in result["stage_timings"].items():
+        print(line_(stage, t, None if previous is None else previous["stage_timings"].get(stage)))
+    if len(result["indicator_timings"]) > 0:
+        print("Indicators (all diseases):")
+    for indicator_code, by_disease in result["indicator_timings"].items():
+        t_previous = None
+        if previous is not None and indicator_code in previous["indicator_timings"]:
+            t_previous = sum(previous["indicator_timings"][indicator_code].values())
+        print(line_(indicator_code, sum(by_disease.values()), t_previous))
+
+
+def run_benchmark(scale: str, seed: int=0, workdir: str="benchmarks", results_file_path: str|None=None, label: str="", max_workers: int|None=None, indicators: bool=True) -> dict:
+    """ Run the benchmark (see module docstring), append the result to results_file_path
+    (by default results.jsonl in workdir) and return it.
+    """
+    workdir = os.path.abspath(workdir)
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    results_file_path = os.path.join(workdir, "results.jsonl") if results_file_path is None else results_file_path
+    # the cache of the pipeline must be set before it is first used
+    os.environ[CACHE_FOLDER_ENVIRONMENT_VARIABLE] = os.path.join(workdir, "cache")
+    from .database.synthetic import generate_synthetic_database
+    from .database.parallel import close_read_only_connection_pools, get_max_workers
+    # synthetic database, generated once for each scale and seed
+    database_file_path = os.path.join(workdir, f"synthetic_{scale}_seed{seed}.sqlite3")
+    generated_file_path = database_file_path.replace(".sqlite3", ".generated.sqlite3")
+    if not os.path.exists(generated_file_path):
+        print(f"Generating the synthetic database ({scale} subjects, seed {seed})...")
+        generate_synthetic_database(generated_file_path, int(scale) if scale.isdigit() else scale, seed=seed)
+    # the pipeline modifies the original database (e.g. the names of its tables): work on a copy
+    shutil.copyfile(generated_file_path, database_file_path)
+    print(f"Benchmarking the pipeline on {database_file_path}...")
+    connection, stage_timings = benchmark_pipeline(database_file_path)
+    indicator_timings = {}
+    if indicators:
+        print("Benchmarking the indicators...")
+        indicator_timings = benchmark_indicators(connection, max_workers=max_workers)
+    close_read_only_connection_pools()
+    connection.close()
+    result = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "label": label,
+        "git": get_git_commit(),
+        "scale": scale,
+        "seed": seed,
+        "max_workers": get_max_workers() if max_workers is None else max_workers,
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stage_timings": stage_timings,
+        "indicator_timings": indicator_timings,
+    }
+    previous = [r for r in read_results(results_file_path) if r["scale"] == scale and r["seed"] == seed]
+    print_comparison(result, previous[-1] if len(previous) > 0 else None)
+    append_result(results_file_path, result)
+    print(f"Result appended to {results_file_path}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m ja_implemental_dashboard.v2.benchmark",
+        description="Benchmark the preprocessing pipeline and the indicators on a synthetic database."
+    )
+    parser.add_argument("--scale", default="10k", help="Number of subjects: 10k, 100k, 1M, 5M or a number (default 10k).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic database (default 0).")
+    parser.add_argument("--workdir", default="benchmarks", help="Folder of the synthetic databases, the cache and the results (default: benchmarks).")
+    parser.add_argument("--results", default=None, help="JSON lines file of the results (default: results.jsonl in the work folder).")
+    parser.add_argument("--label", default="", help="Free text stored with the result.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parallel read-only connections for the indicators (default: number of CPUs).")
+    parser.add_argument("--no-indicators", action="store_true", help="Only benchmark the pipeline.")
+    args = parser.parse_args()
+    run_benchmark(
+        scale=args.scale,
+        seed=args.seed,
+        workdir=args.workdir,
+        results_file_path=args.results,
+        label=args.label,
+        max_workers=args.workers,
+        indicators=not args.no_indicators,
+    )
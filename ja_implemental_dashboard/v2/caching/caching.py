@@ -1,14 +1,18 @@
 import os
 
+# The cache folder can be moved with this environment variable, e.g. by the benchmarks,
+# which must not touch the cache of the dashboard.
+CACHE_FOLDER_ENVIRONMENT_VARIABLE = "JA_CACHE_FOLDER"
+
 def get_cache_folder() -> str:
     """ Get the path to the cache folder.
     Returns the path to the cache folder.
     """
     # this file is in "path_to_project/ja_implemental_dashboard/v_something/caching/caching.py"
     cache_folder = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "cache"))
+    cache_folder = os.environ.get(CACHE_FOLDER_ENVIRONMENT_VARIABLE, "") or cache_folder
     # create the folder if it does not exist
     if not os.path.exists(cache_folder):
         os.makedirs(cache_folder)
     return cache_folder
 
-
@@ -1,7 +1,34 @@
-import os
+import os, time, json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from .caching import get_cache_folder
 
+# Change detection of the original and ja (slim) database files.
+#
+# Hashing a multi-GB database file at every start takes minutes, so a cheap
+# fingerprint of the file is checked first: size and modification time of the file
+# (and of its -wal file, if any), plus the file change counter and schema cookie
+# stored by SQLite in the database header. The content hash (BLAKE2 of blocks hashed
+# in parallel) is computed only for the original database, when it is first processed
+# and when its fingerprint changed, to tell a real change from a file that was
+# just touched or copied.
+#
+# Each stage of the preprocessing pipeline (slim down, data types, indices, ...)
+# writes its own manifest in the cache folder when it completes. The manifest of the
+# slim down stage identifies the original database that the ja database was built from,
+# the manifest written last identifies the state of the ja database left by the pipeline.
+
+PIPELINE_STAGES = [
+    "slim_down",
+    "data_types",
+    "indices",
+    "datetimes",
+    "cohorts",
+    "age_stratification",
+]
+
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
 
 def get_original_database_file_path_cache_file() -> str:
     """ Get the path to the cache file that contains the path to the original database file.
@@ -26,102 +53,194 @@ def get_original_database_file_path() -> str:
         return None
     return str(path)
 
-def get_original_database_hash_file_path() -> str:
-    """ Get the path to the file that contains the hash of the original database file.
-    Returns the path to the file.
+def get_slim_database_filepath() -> str:
+    """ Get the path to the slim database file.
+    Returns the path to the slim database file.
     """
-    fname = "db_hash_original.cache"
-    path = os.path.normpath(
-        os.path.join(get_cache_folder(), fname)
+    return os.path.normpath(
+        os.path.join(
+            os.path.dirname(get_original_database_file_path()),
+            f"{os.path.basename(get_original_database_file_path()).replace('.sqlite3', '.jasqlite3')}"
+        )
     )
-    return path
 
-def get_slim_database_hash_file_path() -> str:
-    """ Get the path to the file that contains the hash of the slim database file.
-    Returns the path to the file.
+def get_database_fingerprint(file_path: str) -> dict|None:
+    """ Cheap fingerprint of a database file, which does not read its content.
+    Returns None if the file does not exist.
     """
-    fname = "db_hash_slim.cache"
-    path = os.path.normpath(
-        os.path.join(get_cache_folder(), fname)
-    )
-    return path
+    if file_path is None or not os.path.exists(file_path):
+        return None
+    stat = os.stat(file_path)
+    fingerprint = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    # SQLite header: file change counter (offset 24) and schema cookie (offset 40),
+    # both 4-bytes big-endian integers, updated by every write transaction
+    # (in rollback journal mode; in WAL mode the changes are in the -wal file)
+    with open(file_path, "rb") as f:
+        header = f.read(100)
+    if len(header) == 100 and header.startswith(b"SQLite format 3\x00"):
+        fingerprint["change_counter"] = int.from_bytes(header[24:28], "big")
+        fingerprint["schema_cookie"] = int.from_bytes(header[40:44], "big")
+    wal_file_path = file_path + "-wal"
+    if os.path.exists(wal_file_path):
+        wal_stat = os.stat(wal_file_path)
+        fingerprint["wal_size"] = wal_stat.st_size
+        fingerprint["wal_mtime_ns"] = wal_stat.st_mtime_ns
+    return fingerprint
 
-def hash_database_file(file_path: str) -> str:
+def hash_database_file(file_path: str, block_size: int=HASH_BLOCK_SIZE, max_workers: int|None=None) -> str:
     """ Compute the hash of the database file.
+    The file is split in blocks that are hashed in parallel (BLAKE2b, which releases the GIL)
+    and the result is the hash of the concatenated block hashes.
     file_path: str
         The path to the database file.
     Returns the hash of the file.
     """
-    md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(1048576), b""):
-            md5.update(byte_block)
-    return md5.hexdigest()
+    file_size = os.path.getsize(file_path)
+    n_blocks = max(1, -(-file_size // block_size))
+    def hash_block(i: int) -> bytes:
+        with open(file_path, "rb") as f:
+            f.seek(i * block_size)
+            return hashlib.blake2b(f.read(block_size), digest_size=32).digest()
+    if max_workers is None:
+        max_workers = min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        block_hashes = list(executor.map(hash_block, range(n_blocks)))
+    h = hashlib.blake2b(digest_size=32)
+    h.update(file_size.to_bytes(8, "big"))
+    for block_hash in block_hashes:
+        h.update(block_hash)
+    return h.hexdigest()
+
+def get_stage_manifest_file_path(stage: str) -> str:
+    """ Get the path to the manifest file of a preprocessing pipeline stage.
+    """
+    if stage not in PIPELINE_STAGES:
+        raise ValueError(f"Unknown pipeline stage '{stage}', must be one of {PIPELINE_STAGES}")
+    manifests_folder = os.path.join(get_cache_folder(), "manifests")
+    if not os.path.exists(manifests_folder):
+        os.makedirs(manifests_folder)
+    return os.path.normpath(os.path.join(manifests_folder, f"{stage}.manifest.json"))
+
+def read_stage_manifest(stage: str) -> dict|None:
+    """ Read the manifest of a pipeline stage, None if the stage never completed.
+    """
+    manifest_file = get_stage_manifest_file_path(stage)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_stage_manifest(stage: str, original_database_hash: str|None=None) -> None:
+    """ Write the manifest of a pipeline stage, to be called when the stage completed
+    (after its changes to the ja database have been committed).
+    stage: str
+        One of PIPELINE_STAGES.
+    original_database_hash: str|None
+        Only for the slim_down stage: the hash of the original database the ja database
+        is built from (computed if not given). Writing the slim_down manifest starts
+        a new build, which all the other stages' manifests must refer to.
+    """
+    original_database_file = get_original_database_file_path()
+    manifest = {
+        "stage": stage,
+        "written_at": time.time(),
+        "original_database_file": original_database_file,
+        "slim_fingerprint": get_database_fingerprint(get_slim_database_filepath()),
+    }
+    if stage == "slim_down":
+        if original_database_hash is None:
+            original_database_hash = hash_database_file(original_database_file)
+        manifest["build_id"] = f"{time.time_ns():x}"
+        manifest["original_fingerprint"] = get_database_fingerprint(original_database_file)
+        manifest["original_hash"] = original_database_hash
+    else:
+        slim_down_manifest = read_stage_manifest("slim_down")
+        manifest["build_id"] = None if slim_down_manifest is None else slim_down_manifest["build_id"]
+    with open(get_stage_manifest_file_path(stage), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+def update_original_database_manifest(original_database_hash: str|None=None) -> None:
+    """ Record, in the slim_down manifest, that the ja database is now in sync with the current
+    original database (e.g. after new records were appended incrementally),
+    without starting a new build.
+    """
+    manifest = read_stage_manifest("slim_down")
+    if manifest is None:
+        write_stage_manifest("slim_down", original_database_hash=original_database_hash)
+        return
+    original_database_file = get_original_database_file_path()
+    if original_database_hash is None:
+        original_database_hash = hash_database_file(original_database_file)
+    manifest["written_at"] = time.time()
+    manifest["original_database_file"] = original_database_file
+    manifest["original_fingerprint"] = get_database_fingerprint(original_database_file)
+    manifest["original_hash"] = original_database_hash
+    manifest["slim_fingerprint"] = get_database_fingerprint(get_slim_database_filepath())
+    with open(get_stage_manifest_file_path("slim_down"), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+def get_latest_stage_manifest() -> dict|None:
+    """ Get the manifest written last, by any stage of the current build.
+    """
+    slim_down_manifest = read_stage_manifest("slim_down")
+    if slim_down_manifest is None:
+        return None
+    manifests = [read_stage_manifest(stage) for stage in PIPELINE_STAGES]
+    manifests = [m for m in manifests if m is not None and m.get("build_id") == slim_down_manifest["build_id"]]
+    return max(manifests, key=lambda m: m["written_at"])
 
 def detect_original_database_has_changed() -> bool:
     """ Detect if the database file has changed since the last preprocessing.
     Returns True if the database file has changed, False otherwise.
+    The file is hashed only if its fingerprint changed.
     """
-    hash_folder = get_cache_folder()
-    if not os.path.exists(hash_folder):
+    manifest = read_stage_manifest("slim_down")
+    if manifest is None:
         return True
-    cache_file = get_original_database_hash_file_path()
-    if not os.path.exists(cache_file):
+    original_database_file = get_original_database_file_path()
+    if manifest.get("original_database_file") != original_database_file:
         return True
-    with open(cache_file, "r") as f:
-        old_hash = f.read()
-    database_file_hash = hash_database_file(get_original_database_file_path())
-    return old_hash != database_file_hash
-
-def get_slim_database_filepath() -> str:
-    """ Get the path to the slim database file.
-    Returns the path to the slim database file.
-    """
-    return os.path.normpath(
-        os.path.join(
-            os.path.dirname(get_original_database_file_path()),
-            f"{os.path.basename(get_original_database_file_path()).replace('.sqlite3', '.jasqlite3')}"
-        )
-    )
+    fingerprint = get_database_fingerprint(original_database_file)
+    if fingerprint is None:
+        return True
+    if fingerprint == manifest["original_fingerprint"]:
+        return False
+    if hash_database_file(original_database_file) != manifest["original_hash"]:
+        return True
+    # same content (the file was touched or copied): remember the new fingerprint
+    manifest["original_fingerprint"] = fingerprint
+    with open(get_stage_manifest_file_path("slim_down"), "w") as f:
+        json.dump(manifest, f, indent=4)
+    return False
 
 def detect_slim_database_has_changed() -> bool:
     """ Detect if the slim database file has changed since the last preprocessing.
     Returns True if the slim database file has changed, False otherwise.
+    The slim database is written only by the preprocessing pipeline, so its fingerprint
+    is compared with the one recorded by the last completed stage (no hashing).
     """
-    hash_folder = get_cache_folder()
-    if not os.path.exists(hash_folder):
-        return True
-    cache_file = get_slim_database_hash_file_path()
-    if not os.path.exists(cache_file):
+    manifest = get_latest_stage_manifest()
+    if manifest is None:
         return True
-    with open(cache_file, "r") as f:
-        old_hash = f.read()
-    slim_database_file = get_slim_database_filepath()
-    if not os.path.exists(slim_database_file):
+    fingerprint = get_database_fingerprint(get_slim_database_filepath())
+    if fingerprint is None:
         return True
-    slim_database_file_hash = hash_database_file(slim_database_file)
-    return old_hash != slim_database_file_hash
+    return fingerprint != manifest["slim_fingerprint"]
 
-def write_to_original_database_hash_file(hash_: str) -> None:
-    """ Write the hash of the database file to a file in the cache folder.
-    hash_: str
-        The hash of the database file.
-    """
-    hash_folder = get_cache_folder()
-    if not os.path.exists(hash_folder):
-        os.makedirs(hash_folder)
-    cache_file = get_original_database_hash_file_path()
-    with open(cache_file, "w") as f:
-        f.write(hash_)
-
-def write_to_slim_database_hash_file(hash_: str) -> None:
-    """ Write the hash of the slim database file to a file in the cache folder.
-    hash_: str
-        The hash of the slim database file.
+def is_stage_up_to_date(stage: str) -> bool:
+    """ True if the stage completed on the current build of the ja database,
+    and neither the original nor the ja database changed since.
     """
-    hash_folder = get_cache_folder()
-    if not os.path.exists(hash_folder):
-        os.makedirs(hash_folder)
-    cache_file = get_slim_database_hash_file_path()
-    with open(cache_file, "w") as f:
-        f.write(hash_)
+    manifest = read_stage_manifest(stage)
+    slim_down_manifest = read_stage_manifest("slim_down")
+    if manifest is None or slim_down_manifest is None:
+        return False
+    if manifest.get("build_id") != slim_down_manifest["build_id"]:
+        return False
+    return not detect_original_database_has_changed() and not detect_slim_database_has_changed()
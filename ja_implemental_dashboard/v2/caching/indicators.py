@@ -1,8 +1,17 @@
-import os
+import os, sys, time
 import sqlite3
 import json
+import atexit
+import threading
+from collections import OrderedDict
 from .caching import get_cache_folder
-from ..database.database import get_all_tables
+from ..database.database import get_all_tables, DISEASE_CODE_TO_DB_CODE
+
+# Version of the format of the cached results, stored as the user_version of the
+# cache database: a cache written with another version is emptied at initialization.
+# - 1: per-patient distributions as lists of values
+# - 2: per-patient distributions of the evaluation indicators as histograms
+INDICATORS_CACHE_FORMAT_VERSION = 2
 
 def get_indicators_cache_database_file() -> str:
     """ Get the path to the cache file that is a database file for indicators
@@ -19,7 +28,15 @@ def initialize_indicators_cache_database(force:bool=False) -> None:
     """
     cache_file = get_indicators_cache_database_file()
     if os.path.exists(cache_file) and not force:
-        return
+        conn = sqlite3.connect(cache_file)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+        if version == INDICATORS_CACHE_FORMAT_VERSION:
+            return
+        print(f"Indicators cache format changed (version {version}, current {INDICATORS_CACHE_FORMAT_VERSION}), emptying the cache.")
+    if _indicators_cache_client is not None:
+        # the buffered entries were computed on the previous database
+        _indicators_cache_client.reset()
     conn = sqlite3.connect(cache_file)
     tables = get_all_tables(conn)
     c = conn.cursor()
@@ -37,6 +54,7 @@ def initialize_indicators_cache_database(force:bool=False) -> None:
         )
         """
     )
+    c.execute(f"PRAGMA user_version = {INDICATORS_CACHE_FORMAT_VERSION}")
     conn.commit()
     conn.close()
 
@@ -56,20 +74,10 @@ def get_table_name_for_indicator(indicator_name:str, create_if_not_exist:bool=Fa
     # get the table name
     table_name = f"indicator_{indicator_name}"
     if create_if_not_exist:
-        cache_file = get_indicators_cache_database_file()
-        conn = sqlite3.connect(cache_file)
-        c = conn.cursor()
-        c.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                call_signature TEXT PRIMARY KEY,
-                x_json TEXT,
-                y_json TEXT
-            )
-            """
-        )
-        conn.commit()
-        conn.close
+        client = get_indicators_cache_client()
+        with client._lock:
+            with client._get_connection() as connection:
+                client._create_table_if_not_exists(connection, table_name)
     return table_name
 
 def get_call_signature_text(
@@ -110,12 +118,10 @@ def is_call_in_cache(
     cohort:str|None=None,
 ) -> bool:
     """ Check if the call is in the cache.
+    Prefer IndicatorsCacheClient.get_or_compute, which looks up the cache only once.
     """
-    cache_file = get_indicators_cache_database_file()
-    if not os.path.exists(cache_file):
-        initialize_indicators_cache_database(force=True)
-    table_name = get_table_name_for_indicator(indicator_name, create_if_not_exist=True)
-    call_signature = get_call_signature_text(
+    return get_indicators_cache_client().get(
+        indicator_name=indicator_name,
         disease_code=disease_code,
         age_interval=age_interval,
         gender=gender,
@@ -123,17 +129,7 @@ def is_call_in_cache(
         job_condition=job_condition,
         educational_level=educational_level,
         cohort=cohort
-    )
-    conn = sqlite3.connect(cache_file)
-    c = conn.cursor()
-    c.execute(
-        f"SELECT COUNT(*) FROM {table_name} WHERE call_signature = ?",
-        (call_signature,)
-    )
-    count = int(c.fetchone()[0])
-    conn.commit()
-    conn.close()
-    return count > 0
+    ) is not None
 
 def retrieve_cached_json(indicator_name:str,
     disease_code:str,
@@ -152,13 +148,8 @@ def retrieve_cached_json(indicator_name:str,
     Returns:
         x_json, y_json
     """
-    cache_file = get_indicators_cache_database_file()
-    if not os.path.exists(cache_file):
-        initialize_indicators_cache_database(force=True)
-    conn = sqlite3.connect(cache_file)
-    c = conn.cursor()
-    table_name = get_table_name_for_indicator(indicator_name)
-    call_signature = get_call_signature_text(
+    cached = get_indicators_cache_client().get(
+        indicator_name=indicator_name,
         disease_code=disease_code,
         age_interval=age_interval,
         gender=gender,
@@ -167,14 +158,9 @@ def retrieve_cached_json(indicator_name:str,
         educational_level=educational_level,
         cohort=cohort
     )
-    c.execute(
-        # there should not be more than one row with the same call signature
-        f"SELECT x_json, y_json FROM {table_name} WHERE call_signature = ? LIMIT 1",
-        (call_signature,)
-    )
-    x_json, y_json = c.fetchone()
-    conn.close()
-    return x_json, y_json
+    if cached is None:
+        raise ValueError(f"The call to {indicator_name} for {disease_code} is not in the cache.")
+    return cached
 
 def cache_json(
     indicator_name:str,
@@ -190,25 +176,488 @@ def cache_json(
 ) -> None:
     """ Cache the JSON data.
     """
-    cache_file = get_indicators_cache_database_file()
-    if not os.path.exists(cache_file):
-        initialize_indicators_cache_database(force=True)
-    conn = sqlite3.connect(cache_file)
-    c = conn.cursor()
-    table_name = get_table_name_for_indicator(indicator_name, create_if_not_exist=True)
-    call_signature = get_call_signature_text(
+    get_indicators_cache_client().put(
+        indicator_name=indicator_name,
         disease_code=disease_code,
         age_interval=age_interval,
         gender=gender,
         civil_status=civil_status,
         job_condition=job_condition,
         educational_level=educational_level,
+        x_json=x_json,
+        y_json=y_json,
         cohort=cohort
     )
-    c.execute(
-        f"INSERT INTO {table_name} (call_signature, x_json, y_json) VALUES (?, ?, ?)",
-        (call_signature, str(x_json), str(y_json))
-    )
+
+
+def estimate_decoded_size(obj) -> int:
+    """ Estimate the memory used by a decoded JSON value, counting 8 bytes
+    for each number (as in a numpy array) and 1 byte for each character.
+    """
+    if isinstance(obj, dict):
+        return sum(estimate_decoded_size(k) + estimate_decoded_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        if len(obj) > 0 and not isinstance(obj[0], (dict, list, tuple, str)):
+            # flat array of numbers (e.g. a per-patient distribution)
+            return 8 * len(obj)
+        return sum(estimate_decoded_size(v) for v in obj)
+    if isinstance(obj, str):
+        return len(obj)
+    return 8
+
+class IndicatorsCacheClient(object):
+    """ Long-lived client of the indicators cache database.
+
+    Every thread gets its own connection to the cache database (sqlite3
+    connections must not be used by more threads at once), opened once and
+    kept open, so that the statements compiled by the sqlite3 module stay in
+    the statement cache of the connection and are reused by the next lookups.
+    The database is in WAL mode, so that lookups are not blocked while
+    another thread commits new entries.
+    New entries are buffered and written in a single transaction every
+    write_batch_size entries, on flush() and when the interpreter exits;
+    buffered entries are already returned by get().
+
+    In front of the database there is an in-memory LRU of decoded results
+    (see get_or_compute_decoded), bounded by the estimated size of the
+    decoded arrays: the tabs of an indicator share the same call, so switching
+    tab or going back to a previous selection of the widgets needs neither
+    a query nor JSON parsing. The decoded results are shared and must not
+    be modified by the caller.
+
+    cache_file: str|None
+        The cache database file, by default get_indicators_cache_database_file().
+    write_batch_size: int
+        Number of buffered entries that triggers a write to the database.
+    memory_max_bytes: int
+        Maximum estimated size of the decoded results kept in memory,
+        0 disables the memory tier.
+    """
+    def __init__(self, cache_file:str|None=None, write_batch_size:int=8, memory_max_bytes:int=256*1024*1024):
+        if write_batch_size < 1:
+            raise ValueError(f"write_batch_size must be at least 1, got {write_batch_size}")
+        if memory_max_bytes < 0:
+            raise ValueError(f"memory_max_bytes must not be negative, got {memory_max_bytes}")
+        self._cache_file = cache_file if cache_file is not None else get_indicators_cache_database_file()
+        self._write_batch_size = write_batch_size
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._connections = []
+        self._existing_tables = set()
+        self._pending = {}
+        self._memory_max_bytes = memory_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_hits = 0
+        self._memory_misses = 0
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        if not os.path.exists(self._cache_file):
+            if self._cache_file == get_indicators_cache_database_file():
+                initialize_indicators_cache_database(force=True)
+        # check_same_thread=False only to allow close() from any thread,
+        # each connection is used by the thread that opened it
+        connection = sqlite3.connect(self._cache_file, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        self._local.connection = connection
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def _create_table_if_not_exists(self, connection:sqlite3.Connection, table_name:str) -> None:
+        # CREATE TABLE IF NOT EXISTS is run once per table, not at every write
+        if table_name in self._existing_tables:
+            return
+        connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                call_signature TEXT PRIMARY KEY,
+                x_json TEXT,
+                y_json TEXT
+            )
+            """
+        )
+        self._existing_tables.add(table_name)
+
+    def get(self,
+        indicator_name:str,
+        disease_code:str,
+        age_interval:list[tuple[int,int]],
+        gender:str,
+        civil_status:str,
+        job_condition:str,
+        educational_level:str,
+        cohort:str|None=None,
+    ) -> tuple[str,str]|None:
+        """ Look up a call in the cache with a single query.
+        Returns (x_json, y_json), or None if the call is not in the cache.
+        """
+        table_name = get_table_name_for_indicator(indicator_name)
+        call_signature = get_call_signature_text(
+            disease_code=disease_code,
+            age_interval=age_interval,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level,
+            cohort=cohort
+        )
+        with self._lock:
+            pending = self._pending.get((table_name, call_signature), None)
+        if pending is not None:
+            return pending
+        try:
+            row = self._get_connection().execute(
+                f"SELECT x_json, y_json FROM {table_name} WHERE call_signature = ? LIMIT 1",
+                (call_signature,)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            # the table of the indicator is created with its first entry
+            if "no such table" in str(e):
+                return None
+            raise
+        if row is None:
+            return None
+        return str(row[0]), str(row[1])
+
+    def put(self,
+        indicator_name:str,
+        disease_code:str,
+        age_interval:list[tuple[int,int]],
+        gender:str,
+        civil_status:str,
+        job_condition:str,
+        educational_level:str,
+        x_json:str,
+        y_json:str,
+        cohort:str|None=None,
+    ) -> None:
+        """ Add a call to the cache. The entry is written to the database
+        together with the next ones (see write_batch_size).
+        """
+        table_name = get_table_name_for_indicator(indicator_name)
+        call_signature = get_call_signature_text(
+            disease_code=disease_code,
+            age_interval=age_interval,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level,
+            cohort=cohort
+        )
+        with self._lock:
+            self._pending[(table_name, call_signature)] = (str(x_json), str(y_json))
+            n_pending = len(self._pending)
+        if n_pending >= self._write_batch_size:
+            self.flush()
+
+    def get_or_compute(self,
+        indicator_name:str,
+        compute,
+        disease_code:str,
+        age_interval:list[tuple[int,int]],
+        gender:str,
+        civil_status:str,
+        job_condition:str,
+        educational_level:str,
+        cohort:str|None=None,
+    ) -> tuple[str,str]:
+        """ Get the cached (x_json, y_json) of a call, or compute and cache it.
+        compute: callable
+            Called without arguments on a cache miss, must return (x_json, y_json).
+        """
+        call = dict(
+            indicator_name=indicator_name,
+            disease_code=disease_code,
+            age_interval=age_interval,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level,
+            cohort=cohort
+        )
+        cached = self.get(**call)
+        if cached is not None:
+            return cached
+        x_json, y_json = compute()
+        self.put(x_json=x_json, y_json=y_json, **call)
+        return str(x_json), str(y_json)
+
+    def get_or_compute_decoded(self,
+        indicator_name:str,
+        compute,
+        disease_code:str,
+        age_interval:list[tuple[int,int]],
+        gender:str,
+        civil_status:str,
+        job_condition:str,
+        educational_level:str,
+        cohort:str|None=None,
+    ) -> tuple[list,object]:
+        """ Same as get_or_compute, but returns the decoded (x, y), looked up
+        first in the memory tier, then in the cache database.
+        The returned objects are shared with the next calls: do not modify them.
+        """
+        call = dict(
+            indicator_name=indicator_name,
+            disease_code=disease_code,
+            age_interval=age_interval,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level,
+            cohort=cohort
+        )
+        key = (
+            get_table_name_for_indicator(indicator_name),
+            get_call_signature_text(**{k: v for k, v in call.items() if k != "indicator_name"})
+        )
+        with self._lock:
+            entry = self._memory.get(key, None)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return entry[0], entry[1]
+            self._memory_misses += 1
+        x_json, y_json = self.get_or_compute(compute=compute, **call)
+        x, y = json.loads(x_json), json.loads(y_json)
+        self._memory_put(key, x, y)
+        return x, y
+
+    def _memory_put(self, key:tuple[str,str], x:list, y:object) -> None:
+        size = estimate_decoded_size(x) + estimate_decoded_size(y)
+        if size > self._memory_max_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[2]
+            self._memory[key] = (x, y, size)
+            self._memory_bytes += size
+            # evict the least recently used results
+            while self._memory_bytes > self._memory_max_bytes:
+                _, (_, _, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def clear_memory(self) -> None:
+        """ Drop all the decoded results kept in memory.
+        """
+        with self._lock:
+            self._memory = OrderedDict()
+            self._memory_bytes = 0
+
+    def get_memory_usage(self) -> dict:
+        """ Number of entries, estimated bytes, hits and misses of the memory tier.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "max_bytes": self._memory_max_bytes,
+                "hits": self._memory_hits,
+                "misses": self._memory_misses,
+            }
+
+    def flush(self) -> None:
+        """ Write the buffered entries to the cache database, in one transaction.
+        """
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            pending = self._pending
+            connection = self._get_connection()
+            rows_per_table = {}
+            for (table_name, call_signature), (x_json, y_json) in pending.items():
+                rows_per_table.setdefault(table_name, []).append((call_signature, x_json, y_json))
+            with connection:
+                for table_name, rows in rows_per_table.items():
+                    self._create_table_if_not_exists(connection, table_name)
+                    connection.executemany(
+                        f"INSERT OR REPLACE INTO {table_name} (call_signature, x_json, y_json) VALUES (?, ?, ?)",
+                        rows
+                    )
+            self._pending = {}
+
+    def reset(self) -> None:
+        """ Discard the buffered entries and forget the tables known to exist,
+        to be called when the cache database is emptied.
+        """
+        with self._lock:
+            self._pending = {}
+            self._existing_tables = set()
+        self.clear_memory()
+
+    def close(self) -> None:
+        """ Write the buffered entries and close all the connections.
+        """
+        self.flush()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._local = threading.local()
+
+_indicators_cache_client = None
+_indicators_cache_client_lock = threading.Lock()
+
+def get_indicators_cache_client() -> IndicatorsCacheClient:
+    """ Get the indicators cache client shared by the whole application.
+    """
+    global _indicators_cache_client
+    with _indicators_cache_client_lock:
+        if _indicators_cache_client is None:
+            _indicators_cache_client = IndicatorsCacheClient()
+            atexit.register(_indicators_cache_client.close)
+    return _indicators_cache_client
+
+# Indicators whose values of a disease also depend on the cohorts of the other diseases
+# (the "all" series of the monitoring indicators count the subjects of every cohort,
+# see indicator/monitoring/engine.py): the years affected for any disease are affected for all.
+INDICATORS_DEPENDING_ON_ALL_DISEASES = ["MA1", "MA2", "MA3"]
+
+def invalidate_cached_indicators(affected_years: dict[str, set[int]|None]) -> int:
+    """ Delete the cached indicators that may have changed after an incremental
+    update of the database (see database/incremental.py).
+
+    affected_years: dict
+        For each disease database code (e.g. 'SCHIZO'), the set of years whose
+        indicator values may have changed, or None if all years changed.
+        The cached entries of the other diseases, and the ones that do not
+        span any affected year, are kept, except for the indicators of
+        INDICATORS_DEPENDING_ON_ALL_DISEASES, whose entries of all the diseases
+        are deleted if they span a year affected for any disease.
+
+    Returns the number of deleted cache entries.
+    """
+    cache_file = get_indicators_cache_database_file()
+    if not os.path.exists(cache_file):
+        return 0
+    # the call signature of the cached entries starts with the disease code
+    affected_disease_codes = {
+        disease_code: affected_years[db_code]
+        for disease_code, db_code in DISEASE_CODE_TO_DB_CODE.items()
+        if db_code in affected_years
+    }
+    if len(affected_disease_codes) == 0:
+        return 0
+    # union of the affected years of all the diseases
+    all_affected_years = set()
+    for years in affected_disease_codes.values():
+        if years is None:
+            all_affected_years = None
+            break
+        all_affected_years.update(years)
+    all_affected_disease_codes = {disease_code: all_affected_years for disease_code in DISEASE_CODE_TO_DB_CODE.keys()}
+    all_diseases_tables = [get_table_name_for_indicator(i) for i in INDICATORS_DEPENDING_ON_ALL_DISEASES]
+    client = get_indicators_cache_client()
+    client.flush()
+    client.clear_memory()
+    conn = client._get_connection()
+    c = conn.cursor()
+    n_deleted = 0
+    for table_name in get_all_tables(conn):
+        if not table_name.startswith("indicator_"):
+            continue
+        table_affected_disease_codes = all_affected_disease_codes if table_name in all_diseases_tables else affected_disease_codes
+        to_delete = []
+        for call_signature, x_json in c.execute(f"SELECT call_signature, x_json FROM {table_name}").fetchall():
+            for disease_code, years in table_affected_disease_codes.items():
+                if not call_signature.startswith(disease_code + "_"):
+                    continue
+                if years is None or len(years.intersection([int(x) for x in json.loads(x_json)])) > 0:
+                    to_delete.append((call_signature,))
+                break
+        c.executemany(f"DELETE FROM {table_name} WHERE call_signature = ?", to_delete)
+        n_deleted += len(to_delete)
     conn.commit()
-    conn.close()
-    
+    c.close()
+    return n_deleted
+
+
+if __name__ == "__main__":
+    # Micro-benchmark of the lookup latency of the indicators cache:
+    # previous per-call connections (existence check, then fetch) against the cache client
+    # and its in-memory tier of decoded results.
+    # Runs on a temporary cache file, the cache of the dashboard is not touched.
+    # python -m ja_implemental_dashboard.v2.caching.indicators [n_lookups]
+    import tempfile
+    n_lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    calls = [
+        dict(
+            indicator_name=indicator_name,
+            disease_code=disease_code,
+            cohort=cohort,
+            age_interval=[(14, 150)],
+            gender="A",
+            civil_status="A",
+            job_condition="A",
+            educational_level="A"
+        )
+        for indicator_name in ["EA1", "EA2", "EA3", "EA4", "EA5", "EA6-0", "EA6-1", "EA6-2"]
+        for disease_code in DISEASE_CODE_TO_DB_CODE.keys()
+        for cohort in ["_a_", "_b_", "_c_"]
+    ]
+    # a tab 0 value and the per-patient distributions of tabs 1 and 2, for 15 years
+    x_json = json.dumps(list(range(2010, 2025)))
+    y_json = json.dumps({"percentage": [0.5] * 15, "distribution": [list(range(2000)) for _ in range(15)]})
+
+    def per_call_connection_lookup(cache_file: str, call: dict) -> tuple[str,str]|None:
+        # what is_call_in_cache followed by retrieve_cached_json used to do
+        table_name = get_table_name_for_indicator(call["indicator_name"])
+        call_signature = get_call_signature_text(**{k: v for k, v in call.items() if k != "indicator_name"})
+        conn = sqlite3.connect(cache_file)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (call_signature TEXT PRIMARY KEY, x_json TEXT, y_json TEXT)")
+        conn.commit()
+        conn.close()
+        conn = sqlite3.connect(cache_file)
+        count = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE call_signature = ?", (call_signature,)).fetchone()[0]
+        conn.close()
+        if count == 0:
+            return None
+        conn = sqlite3.connect(cache_file)
+        row = conn.execute(f"SELECT x_json, y_json FROM {table_name} WHERE call_signature = ? LIMIT 1", (call_signature,)).fetchone()
+        conn.close()
+        return row
+
+    with tempfile.TemporaryDirectory() as folder:
+        cache_file = os.path.join(folder, "indicators.cache.sqlite3")
+        client = IndicatorsCacheClient(cache_file=cache_file, write_batch_size=64)
+        t0 = time.perf_counter()
+        for call in calls:
+            client.put(x_json=x_json, y_json=y_json, **call)
+        client.flush()
+        t_write = time.perf_counter() - t0
+        print(f"Cache entries: {len(calls)}, written in {1000*t_write:.1f} ms")
+        results = {}
+        t0 = time.perf_counter()
+        for i in range(n_lookups):
+            assert per_call_connection_lookup(cache_file, calls[i % len(calls)]) is not None
+        results["per-call connections, check then fetch"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for i in range(n_lookups):
+            assert client.get(**calls[i % len(calls)]) is not None
+        results["cache client, hit"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for i in range(n_lookups):
+            call = dict(calls[i % len(calls)], gender="M")
+            assert client.get(**call) is None
+        results["cache client, miss"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for i in range(n_lookups):
+            x_json_, y_json_ = client.get(**calls[i % len(calls)])
+            x_, y_ = json.loads(x_json_), json.loads(y_json_)
+        results["cache client, hit + JSON decoding"] = time.perf_counter() - t0
+        for call in calls:
+            client.get_or_compute_decoded(compute=None, **call)
+        t0 = time.perf_counter()
+        for i in range(n_lookups):
+            x_, y_ = client.get_or_compute_decoded(compute=None, **calls[i % len(calls)])
+        results["memory tier, hit (decoded)"] = time.perf_counter() - t0
+        print(f"Memory tier: {client.get_memory_usage()}")
+        client.close()
+    print(f"Lookup latency ({n_lookups} lookups):")
+    for name, t in results.items():
+        print(f"- {name}: {1e6*t/n_lookups:.1f} us per lookup")
@@ -0,0 +1,240 @@
+"""
+Precomputation of the indicators cache.
+
+Right after the database is preprocessed, the indicators cache is empty and the
+first user to look at each disease, cohort and widget selection waits for the
+indicator to be computed. This command fills the cache in advance, for the evaluation
+indicators (the ones with cohorts), on the grid of all the states of the indicator widget:
+diseases x cohorts x age intervals (any subset) x gender x civil status x job condition x
+educational level.
+
+The grid is traversed by popularity: the depth of a widget state is the number of
+selectors that are not in their default "All" state (for the age, the number of selected
+intervals), and shallower states are computed first. The grid can be limited with
+--max-depth and the run with a time budget (--time-budget).
+
+The work is spread over a pool of processes, each with its own read-only connection
+to the ja database. The results are written to the indicators cache by this process only.
+The run can be interrupted and resumed: the calls already in the cache are skipped.
+
+Usage (from the repository root, after the dashboard preprocessed the database):
+python -m ja_implemental_dashboard.v2.caching.precompute [--max-depth 1] [--time-budget 3600] [--workers 4]
+"""
+
+import os, sys, time
+import argparse
+import itertools
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .database import get_original_database_file_path, get_slim_database_filepath, is_stage_up_to_date
+from .indicators import initialize_indicators_cache_database, get_indicators_cache_client
+from ..database.database import DISEASE_CODE_TO_DB_CODE
+from ..indicator.widget_texts import (
+    AGE_WIDGET_INTERVALS,
+    WIDGET_GENDER_OPTIONS_LANGDICT, WIDGET_CIVIL_STATUS_OPTIONS_LANGDICT,
+    WIDGET_JOB_CONDITION_OPTIONS_LANGDICT, WIDGET_EDUCATIONAL_LEVEL_OPTIONS_LANGDICT
+)
+from ..indicator.evaluation.engine import EVALUATION_INDICATORS_EVENTS, evaluate_indicator_json
+
+PRECOMPUTE_COHORT_CODES = ["_a_", "_b_", "_c_"]
+
+# default value of each selector of the indicator widget (see indicator.widget.indicator_widget)
+PRECOMPUTE_WIDGET_DEFAULTS = {
+    "gender": "A",
+    "civil_status": "All",
+    "job_condition": "All",
+    "educational_level": "All",
+}
+
+
+def get_widget_states(max_depth: int|None=None) -> list[dict]:
+    """ All the states of the indicator widget, sorted by depth (most popular first).
+    The depth of a state is the number of selected age intervals (0 if all ages are selected)
+    plus the number of the other selectors that are not in their default state.
+    Each state is a dict with the age intervals names (as in AGE_WIDGET_INTERVALS),
+    the other selectors values, and the depth.
+    """
+    age_all = list(AGE_WIDGET_INTERVALS.keys())[0]
+    age_intervals = list(AGE_WIDGET_INTERVALS.keys())[1:]
+    # selecting all intervals is the same as selecting "All" (see indicator.widget.age_widget)
+    age_states = [[age_all]] + [
+        list(c)
+        for n in range(1, len(age_intervals))
+        for c in itertools.combinations(age_intervals, n)
+    ]
+    options = {
+        "gender": list(WIDGET_GENDER_OPTIONS_LANGDICT["en"].keys()),
+        "civil_status": list(WIDGET_CIVIL_STATUS_OPTIONS_LANGDICT["en"].keys()),
+        "job_condition": list(WIDGET_JOB_CONDITION_OPTIONS_LANGDICT["en"].keys()),
+        "educational_level": list(WIDGET_EDUCATIONAL_LEVEL_OPTIONS_LANGDICT["en"].keys()),
+    }
+    states = []
+    for age in age_states:
+        age_depth = 0 if age == [age_all] else len(age)
+        if max_depth is not None and age_depth > max_depth:
+            continue
+        for values in itertools.product(*options.values()):
+            state = dict(zip(options.keys(), values))
+            depth = age_depth + sum([1 for k, v in state.items() if v != PRECOMPUTE_WIDGET_DEFAULTS[k]])
+            if max_depth is not None and depth > max_depth:
+                continue
+            state["age"] = age
+            state["depth"] = depth
+            states.append(state)
+    # stable sort: at the same depth, the enumeration order is kept
+    return sorted(states, key=lambda s: s["depth"])
+
+def iter_precompute_tasks(states: list[dict], indicator_codes: list[str], disease_codes: list[str]):
+    """ The calls to precompute, most popular first: for every widget state
+    (see get_widget_states), all diseases, cohorts and indicators.
+    """
+    for code in indicator_codes:
+        if code not in EVALUATION_INDICATORS_EVENTS:
+            raise ValueError(f"Unknown indicator {code}, must be one of {list(EVALUATION_INDICATORS_EVENTS.keys())}")
+    for code in disease_codes:
+        if code not in DISEASE_CODE_TO_DB_CODE:
+            raise ValueError(f"Unknown disease {code}, must be one of {list(DISEASE_CODE_TO_DB_CODE.keys())}")
+    for state in states:
+        for disease_code in disease_codes:
+            for cohort_code in PRECOMPUTE_COHORT_CODES:
+                for indicator_code in indicator_codes:
+                    yield {
+                        "indicator_name": indicator_code,
+                        "disease_code": disease_code,
+                        "cohort": cohort_code,
+                        "age_interval": [AGE_WIDGET_INTERVALS[a] for a in state["age"]],
+                        "gender": state["gender"],
+                        "civil_status": state["civil_status"],
+                        "job_condition": state["job_condition"],
+                        "educational_level": state["educational_level"],
+                    }
+
+
+# worker processes: one read-only connection each
+_worker_connection = None
+
+def _initialize_worker(database_file_path: str) -> None:
+    global _worker_connection
+    _worker_connection = sqlite3.connect(f"file:{database_file_path}?mode=ro", uri=True)
+
+def _compute_task(task: dict) -> tuple[dict, str, str]:
+    x_json, y_json = evaluate_indicator_json(
+        indicator_code=task["indicator_name"],
+        connection=_worker_connection,
+        disease_code=task["disease_code"],
+        cohort_code=task["cohort"],
+        age=task["age_interval"],
+        gender=task["gender"],
+        civil_status=task["civil_status"],
+        job_condition=task["job_condition"],
+        educational_level=task["educational_level"],
+        # the pool already uses all the cores
+        max_workers=1
+    )
+    return task, x_json, y_json
+
+
+def precompute_indicators_cache(database_file_path: str, max_depth: int|None=1, time_budget: float|None=None, max_workers: int|None=None, indicator_codes: list[str]|None=None, disease_codes: list[str]|None=None) -> dict:
+    """ Compute the evaluation indicators on the widget grid and store them in the indicators cache.
+    database_file_path: str
+        The ja database (.jasqlite3), opened read-only by the workers.
+    max_depth: int|None
+        Maximum depth of the widget states (see get_widget_states), None for the whole grid.
+    time_budget: float|None
+        Seconds after which no more calls are started (the running ones are completed).
+    max_workers: int|None
+        Number of worker processes, by default the number of CPUs.
+    Returns a dict with the number of calls in the grid, already cached, computed and
+    left to compute, and the time taken.
+    """
+    t0 = time.time()
+    if not os.path.exists(database_file_path):
+        raise ValueError(f"Database file not found: {database_file_path}")
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    indicator_codes = list(EVALUATION_INDICATORS_EVENTS.keys()) if indicator_codes is None else indicator_codes
+    disease_codes = list(DISEASE_CODE_TO_DB_CODE.keys()) if disease_codes is None else disease_codes
+    initialize_indicators_cache_database()
+    client = get_indicators_cache_client()
+    states = get_widget_states(max_depth)
+    n_calls = len(states) * len(disease_codes) * len(PRECOMPUTE_COHORT_CODES) * len(indicator_codes)
+    tasks = iter_precompute_tasks(states, indicator_codes, disease_codes)
+    print(f"Precomputing indicators: {n_calls:,d} calls in the grid, with {max_workers} processes.")
+    n_visited = 0
+    n_already_cached = 0
+    n_computed = 0
+    stopped_by_budget = False
+    t_print = time.time()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_initialize_worker, initargs=(database_file_path,)) as executor:
+        running = set()
+        try:
+            while True:
+                # keep a few calls per worker in flight, in order of popularity,
+                # skipping the calls already in the cache (resume)
+                while len(running) < 2 * max_workers and n_visited < n_calls:
+                    if time_budget is not None and time.time() - t0 > time_budget:
+                        stopped_by_budget = True
+                        break
+                    task = next(tasks)
+                    n_visited += 1
+                    if client.get(**task) is not None:
+                        n_already_cached += 1
+                        continue
+                    running.add(executor.submit(_compute_task, task))
+                if len(running) == 0:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, x_json, y_json = future.result()
+                    client.put(x_json=x_json, y_json=y_json, **task)
+                    n_computed += 1
+                if time.time() - t_print > 1:
+                    t_print = time.time()
+                    print(f"Precomputing indicators: {n_visited:,d}/{n_calls:,d} calls, {n_already_cached:,d} already cached, {n_computed:,d} computed ({t_print - t0:.0f} s)", end="\r")
+        except KeyboardInterrupt:
+            for future in running:
+                future.cancel()
+            print("\nPrecomputation interrupted, run the command again to resume.")
+        finally:
+            client.flush()
+    dt = time.time() - t0
+    print(f"\nPrecomputing indicators: {n_already_cached:,d} calls already cached, {n_computed:,d} computed in {dt:.1f} s" + (", time budget reached." if stopped_by_budget else "."))
+    return {
+        "n_calls": n_calls,
+        "n_already_cached": n_already_cached,
+        "n_computed": n_computed,
+        "n_left": n_calls - n_already_cached - n_computed,
+        "time": dt,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the evaluation indicators cache of the dashboard.",
+        epilog="The run can be interrupted and resumed, the calls already cached are skipped."
+    )
+    parser.add_argument("--database", default=None, help="The ja database (.jasqlite3), by default the one last preprocessed by the dashboard.")
+    parser.add_argument("--max-depth", type=int, default=1, help="Maximum number of widget selectors changed from 'All' (default 1, -1 for the whole grid).")
+    parser.add_argument("--time-budget", type=float, default=None, help="Time budget in seconds.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument("--indicators", default=None, help=f"Comma separated indicators (default: all of {','.join(EVALUATION_INDICATORS_EVENTS.keys())}).")
+    parser.add_argument("--diseases", default=None, help=f"Comma separated diseases (default: all of {','.join(DISEASE_CODE_TO_DB_CODE.keys())}).")
+    args = parser.parse_args()
+    database_file_path = args.database
+    if database_file_path is None:
+        if get_original_database_file_path() is None:
+            print("No database was preprocessed yet: start the dashboard once or pass --database.")
+            sys.exit(1)
+        database_file_path = get_slim_database_filepath()
+        if not is_stage_up_to_date("age_stratification"):
+            print("The database changed since it was last preprocessed: start the dashboard once to preprocess it.")
+            sys.exit(1)
+    precompute_indicators_cache(
+        database_file_path=database_file_path,
+        max_depth=None if args.max_depth < 0 else args.max_depth,
+        time_budget=args.time_budget,
+        max_workers=args.workers,
+        indicator_codes=None if args.indicators is None else args.indicators.split(","),
+        disease_codes=None if args.diseases is None else args.diseases.split(","),
+    )
@@ -0,0 +1,272 @@
+import sqlite3
+
+# Classification of the diagnosis and prescription codes.
+#
+# The codes related to mental health are listed once, here, by prefix, each with the
+# class it belongs to: the disorder of a diagnosis (ICD9 and ICD10 codes), or the drug
+# class of a prescription (ATC codes). The class of a code is the one of its longest
+# matching prefix (e.g. N05AN lithium within N05A antipsychotics), 0 if no prefix matches.
+#
+# The lists are stored in the code_classification table of the ja database, and
+# slim_down_database classifies the records once, while copying them (each distinct code
+# is looked up in the table, see create_classified_records_table): the class is stored
+# in the DISORDER_CLASS column of diagnoses and in the DRUG_CLASS column of pharma,
+# and the records of class 0 (not related to mental health) are not copied.
+# The cohorts and the indicators then select the records by (indexed) integer class,
+# instead of comparing the codes with substr(...) IN (...) or LIKE on every record.
+#
+# Matching rules, the same as the code conditions used before the classification:
+# - diagnosis codes are compared as they are (as TEXT, case sensitive), within their CODING_SYSTEM;
+# - ATC codes are compared in upper case (as LIKE did).
+
+CODE_CLASSIFICATION_TABLE = "code_classification"
+
+# no class: the record is not related to mental health
+CODE_CLASS_NONE = 0
+
+# classes of the diagnoses (the first three are the disorders of the cohorts, see database.COHORTS_DEFINITIONS)
+DISORDER_CLASSES = {
+    "SCHIZO": 1, # Schizophrenic Disorder
+    "DEPRE": 2, # Depression
+    "BIPO": 3, # Bipolar Disorder
+    "PERSONALITY": 4, # Personality Disorder
+    "ANXIETY": 5, # Anxiety Disorders
+    "SUICIDAL": 6, # Suicidal Behaviour
+}
+
+# classes of the prescriptions
+DRUG_CLASSES = {
+    "ANTIPSYCHOTIC": 1, # Antipsycotics Agents (I and II generations), lithium excluded
+    "ANTIDEPRESSANT": 2, # Antidepressants
+    "LITHIUM": 3,
+    "LAMOTRIGINE": 4,
+    "VALPROIC_ACID": 5,
+    "CARBAMAZEPINE": 6,
+}
+
+# (CODING_SYSTEM, CODE_PREFIX, class)
+DIAGNOSES_CODE_PREFIXES = [
+    ("ICD9", p, "SCHIZO") for p in ["295", "297", "2982", "2983", "2984", "2988", "2989"]
+] + [
+    ("ICD9", p, "DEPRE") for p in ["311", "2962", "2963", "2980", "3004", "3090", "3091"]
+] + [
+    ("ICD9", p, "BIPO") for p in ["2960", "2961", "2964", "2965", "2966", "2967", "2981", "29680", "29681", "29689", "29699"]
+] + [
+    ("ICD9", p, "PERSONALITY") for p in ["301"]
+] + [
+    ("ICD9", p, "ANXIETY") for p in ["3000", "3001", "3003", "3098", "3083"]
+] + [
+    ("ICD9", p, "SUICIDAL") for p in ["E950", "E951", "E952", "E953", "E954", "E955", "E956", "E957", "E958", "E959", "V6284"]
+] + [
+    ("ICD10", p, "SCHIZO") for p in ["F20", "F21", "F22", "F23", "F24", "F25", "F28", "F29"]
+] + [
+    ("ICD10", p, "DEPRE") for p in ["F32", "F33", "F39", "F341", "F348", "F349", "F381", "F388", "F431", "F432"]
+] + [
+    ("ICD10", p, "BIPO") for p in ["F30", "F31", "F340", "F380"]
+] + [
+    ("ICD10", p, "PERSONALITY") for p in ["F60", "F61"]
+] + [
+    # F431 is also an anxiety disorder, but it is classified as depression (see above)
+    ("ICD10", p, "ANXIETY") for p in ["F40", "F41", "F42", "F930", "F931", "F932", "F430", "F438", "F439"]
+] + [
+    ("ICD10", f"X{n}", "SUICIDAL") for n in range(60, 85)
+] + [
+    ("ICD10", f"Y{n}", "SUICIDAL") for n in range(10, 35)
+]
+
+# (CODING_SYSTEM, CODE_PREFIX, class)
+PHARMA_CODE_PREFIXES = [
+    ("ATC", "N05A", "ANTIPSYCHOTIC"),
+    ("ATC", "N05AN", "LITHIUM"),
+    ("ATC", "N06A", "ANTIDEPRESSANT"),
+    ("ATC", "N03AX09", "LAMOTRIGINE"),
+    ("ATC", "N03AG01", "VALPROIC_ACID"),
+    ("ATC", "N03AF01", "CARBAMAZEPINE"),
+]
+
+# for each classified table: the class column, the classes, the code prefixes and
+# the SQL expressions of the coding system and of the code of a record (alias r)
+CLASSIFIED_TABLES = {
+    "diagnoses": {
+        "class_column": "DISORDER_CLASS",
+        "classes": DISORDER_CLASSES,
+        "prefixes": DIAGNOSES_CODE_PREFIXES,
+        "coding_system": "CAST(r.CODING_SYSTEM AS TEXT)",
+        "code": "CAST(r.DIAGNOSIS AS TEXT)",
+    },
+    "pharma": {
+        "class_column": "DRUG_CLASS",
+        "classes": DRUG_CLASSES,
+        "prefixes": PHARMA_CODE_PREFIXES,
+        "coding_system": "'ATC'",
+        "code": "upper(CAST(r.ATC_CHAR AS TEXT))",
+    },
+}
+
+
+def get_class_column_name(table: str) -> str:
+    """ The class column of a classified table (e.g. diagnoses -> DISORDER_CLASS). """
+    return CLASSIFIED_TABLES[table]["class_column"]
+
+def get_class_condition(table: str, class_names: list[str], alias: str|None=None) -> str:
+    """ SQL condition on the records of a classified table (already classified)
+    that belong to one of the classes, e.g. get_class_condition("pharma", ["LITHIUM"])
+    -> 'DRUG_CLASS = 3'.
+    """
+    classes = CLASSIFIED_TABLES[table]["classes"]
+    for c in class_names:
+        if c not in classes:
+            raise ValueError(f"Unknown class {c} of table {table}, the classes are {list(classes.keys())}.")
+    column = get_class_column_name(table) if alias is None else f"{alias}.{get_class_column_name(table)}"
+    if len(class_names) == 1:
+        return f"{column} = {classes[class_names[0]]}"
+    return f"{column} IN ({', '.join([str(classes[c]) for c in class_names])})"
+
+def get_code_classification_rows() -> list[tuple[str, str, str, int, str]]:
+    """ The rows of the code_classification table:
+    (TABLE_NAME, CODING_SYSTEM, CODE_PREFIX, CLASS, CLASS_NAME), sorted.
+    """
+    return sorted([
+        (table, system, prefix, classification["classes"][name], name)
+        for table, classification in CLASSIFIED_TABLES.items()
+        for system, prefix, name in classification["prefixes"]
+    ])
+
+def code_classification_table_is_current(connection: sqlite3.Connection, schema: str="main") -> bool:
+    """ True if the code_classification table in the schema exists and has the code prefixes
+    of this file: if not, the records were classified with other prefixes and must be classified again.
+    """
+    tables = [t for (t,) in connection.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type='table'").fetchall()]
+    if CODE_CLASSIFICATION_TABLE not in tables:
+        return False
+    rows = connection.execute(f"SELECT TABLE_NAME, CODING_SYSTEM, CODE_PREFIX, CLASS, CLASS_NAME FROM {schema}.{CODE_CLASSIFICATION_TABLE}").fetchall()
+    return sorted(rows) == get_code_classification_rows()
+
+def create_code_classification_table(cursor: sqlite3.Cursor, schema: str="main") -> None:
+    """ (Re)create the code_classification table in the schema (e.g. 'main', 'temp'),
+    with the code prefixes of all the classified tables. Does not commit.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.{CODE_CLASSIFICATION_TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {schema}.{CODE_CLASSIFICATION_TABLE} (
+            TABLE_NAME TEXT NOT NULL,
+            CODING_SYSTEM TEXT NOT NULL,
+            CODE_PREFIX TEXT NOT NULL,
+            CLASS INTEGER NOT NULL,
+            CLASS_NAME TEXT NOT NULL,
+            PRIMARY KEY (TABLE_NAME, CODING_SYSTEM, CODE_PREFIX)
+        ) WITHOUT ROWID
+    """)
+    cursor.executemany(f"INSERT INTO {schema}.{CODE_CLASSIFICATION_TABLE} VALUES (?, ?, ?, ?, ?)", get_code_classification_rows())
+
+def get_code_class_expression(table: str, coding_system: str, code: str, classification_table: str=CODE_CLASSIFICATION_TABLE) -> str:
+    """ SQL expression of the class of a code of the diagnoses or pharma table, given the SQL
+    expressions of its coding system and of the code (as TEXT, see CLASSIFIED_TABLES):
+    the class of the longest prefix of the code in the classification table
+    (see create_code_classification_table), or 0.
+    Each code looks up only its own prefixes, with the primary key.
+    """
+    prefixes_string = ", ".join([
+        f"substr({code}, 1, {n})"
+        for n in sorted(set([len(p) for _, p, _ in CLASSIFIED_TABLES[table]["prefixes"]]))
+    ])
+    return f"""COALESCE((
+        SELECT k.CLASS
+        FROM {classification_table} k
+        WHERE
+            k.TABLE_NAME = '{table}'
+            AND
+            k.CODING_SYSTEM = {coding_system}
+            AND
+            k.CODE_PREFIX IN ({prefixes_string})
+        ORDER BY length(k.CODE_PREFIX) DESC
+        LIMIT 1
+    ), {CODE_CLASS_NONE})"""
+
+def create_classified_records_table(cursor: sqlite3.Cursor, table: str, source_table: str, target_table: str, condition: str="1", classification_table: str=CODE_CLASSIFICATION_TABLE) -> None:
+    """ Create the temporary table target_table with the records of source_table (the table of
+    the original database) that satisfy the condition and are related to mental health,
+    with their class column (see the module comments). Tables that are not classified are not filtered.
+    The condition is on the columns of the source table, without alias (e.g. on the rowid).
+
+    The codes are few with respect to the records: the distinct codes are classified first,
+    with the classification table, then each record gets the class of its code by primary key.
+    The records that are not related to mental health (class 0) are discarded by the
+    prefixes condition before (see get_mental_health_condition).
+    """
+    if table not in CLASSIFIED_TABLES:
+        cursor.execute(f"CREATE TEMP TABLE {target_table} AS SELECT * FROM {source_table} WHERE {condition}")
+        return
+    classification = CLASSIFIED_TABLES[table]
+    coding_system = classification["coding_system"].replace("r.", "")
+    code = classification["code"].replace("r.", "")
+    cursor.execute("DROP TABLE IF EXISTS temp.t_code_classes")
+    cursor.execute("""
+        CREATE TEMP TABLE t_code_classes (
+            CODING_SYSTEM TEXT,
+            CODE TEXT,
+            CLASS INTEGER,
+            PRIMARY KEY (CODING_SYSTEM, CODE)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(f"""
+        INSERT INTO t_code_classes (CODING_SYSTEM, CODE, CLASS)
+        SELECT CODING_SYSTEM, CODE, {get_code_class_expression(table, "CODING_SYSTEM", "CODE", classification_table)}
+        FROM (
+            SELECT DISTINCT {coding_system} AS CODING_SYSTEM, {code} AS CODE
+            FROM {source_table}
+            WHERE ({condition}) AND {get_mental_health_condition(table)}
+        )
+    """)
+    # CROSS JOIN: the records are read in the order of the source table
+    class_column = classification["class_column"]
+    cursor.execute(f"""
+        CREATE TEMP TABLE {target_table} AS
+        SELECT r.*, k.CLASS AS {class_column}
+        FROM (
+            SELECT * FROM {source_table}
+            WHERE ({condition}) AND {get_mental_health_condition(table)}
+        ) r
+        CROSS JOIN temp.t_code_classes k
+        WHERE
+            k.CODING_SYSTEM = {classification["coding_system"]}
+            AND
+            k.CODE = {classification["code"]}
+            AND
+            k.CLASS != {CODE_CLASS_NONE}
+    """)
+    cursor.execute("DROP TABLE IF EXISTS temp.t_code_classes")
+
+def get_mental_health_condition(table: str) -> str:
+    """ SQL condition, true for the records of the diagnoses or pharma table related to mental health
+    (of class != 0), which does not need the classification table (e.g. to filter the records
+    while converting the original database, see converter/from_sas).
+    """
+    classification = CLASSIFIED_TABLES[table]
+    code = classification["code"].replace("r.", "")
+    coding_system = classification["coding_system"].replace("r.", "")
+    conditions = []
+    for system in sorted(set([s for s, _, _ in classification["prefixes"]])):
+        # the prefixes that extend a shorter one (e.g. N05AN of N05A) are already matched by it
+        prefixes = [p for s, p, _ in classification["prefixes"] if s == system]
+        prefixes = [p for p in prefixes if not any([p != q and p.startswith(q) for q in prefixes])]
+        by_length = " OR ".join([
+            f"substr({code}, 1, {n}) IN ({', '.join([repr(p) for p in prefixes if len(p) == n])})"
+            for n in sorted(set([len(p) for p in prefixes]))
+        ])
+        if coding_system.startswith("'"):
+            # a single coding system (e.g. ATC), no need to check it
+            conditions.append(f"({by_length})")
+        else:
+            conditions.append(f"({coding_system} = '{system}' AND ({by_length}))")
+    return "(" + " OR ".join(conditions) + ")"
+
+if __name__ == "__main__":
+    # print the classification table
+    connection_ = sqlite3.connect(":memory:")
+    cursor_ = connection_.cursor()
+    create_code_classification_table(cursor_)
+    for row_ in cursor_.execute(f"SELECT * FROM {CODE_CLASSIFICATION_TABLE} ORDER BY TABLE_NAME, CLASS, CODING_SYSTEM, CODE_PREFIX"):
+        print(row_)
+    print(get_mental_health_condition("pharma"))
+    connection_.close()
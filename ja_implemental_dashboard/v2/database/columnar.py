@@ -0,0 +1,273 @@
+"""Columnar, in-memory stratification of the patients of the internal ja database.
+
+The demographics and cohorts tables are small enough to fit in memory.
+Instead of creating temporary tables for every stratification (see database.stratify_demographics),
+they can be loaded once into NumPy arrays, with integer-coded categorical variables,
+and any stratification is then evaluated as vectorized boolean masks over the subjects.
+
+Usage:
+
+    columnar = ColumnarDemographics(connection)
+    indices = columnar.stratify(year_of_inclusion=2015, age=[(1, 150)], gender="A", ...)
+    ids = columnar.subject_ids[indices]
+
+The returned subject-index arrays can be passed to the indicators evaluation engine
+(see indicator.evaluation.engine, kwarg 'columnar').
+"""
+import time
+import sqlite3
+import numpy
+
+from .database import DISEASE_CODE_TO_DB_CODE, check_database_has_tables
+from ..indicator.widget_texts import AGE_WIDGET_INTERVALS
+
+# Integer coding of the categorical variables of demographics.
+# 0 is always the code of NULL values, values not listed here
+# (which should not be present in a standardized database) get the last code.
+GENDER_CODES = {None: 0, "M": 1, "F": 2}
+CIVIL_STATUS_CODES = {None: 0, "Unmarried": 1, "Married": 2, "Married_no_long": 3, "Other": 4}
+JOB_CONDITION_CODES = {None: 0, "Employed": 1, "Unemployed": 2, "Pension": 3}
+# educational level is already an integer (ISCED level), NULL is coded as -1
+EDUCATIONAL_LEVEL_NULL_CODE = -1
+# birth and death years that can never satisfy the age/alive conditions
+_NEVER_YEAR = -1_000_000
+_ALWAYS_YEAR = 1_000_000
+
+
+def _encode_categorical(values: list, codes: dict) -> numpy.ndarray:
+    other_code = max(codes.values()) + 1
+    return numpy.array([codes.get(v, other_code) for v in values], dtype=numpy.int8)
+
+def _encode_educational_level(values: list) -> numpy.ndarray:
+    out = numpy.full(len(values), EDUCATIONAL_LEVEL_NULL_CODE, dtype=numpy.int8)
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        try:
+            out[i] = int(v)
+        except ValueError:
+            pass
+    return out
+
+
+class ColumnarDemographics(object):
+    """ In-memory columnar copy of the demographics and cohorts tables of the internal ja database.
+
+    Subjects are sorted by ID_SUBJECT (the integer key of the subjects table)
+    and identified by their index in subject_ids.
+    If a subject appears more than once in demographics, only its first record is kept.
+    """
+    def __init__(self, connection: sqlite3.Connection):
+        has_tables, missing_tables = check_database_has_tables(connection, cohorts_required=True)
+        if not has_tables:
+            raise ValueError(f"The database is missing the following tables: {missing_tables}")
+        cursor = connection.cursor()
+        # demographics
+        rows = cursor.execute("""
+            SELECT
+                ID_SUBJECT,
+                DT_BIRTH_YEAR,
+                DT_DEATH_YEAR,
+                DT_DEATH IS NULL,
+                GENDER,
+                CIVIL_STATUS,
+                JOB_COND,
+                EDU_LEVEL
+            FROM demographics
+            ORDER BY ID_SUBJECT, rowid
+        """).fetchall()
+        ids_, first_ = numpy.unique(numpy.array([r[0] for r in rows], dtype=numpy.int64), return_index=True)
+        rows = [rows[i] for i in first_]
+        self.subject_ids: numpy.ndarray = ids_
+        self.birth_year = numpy.array([_NEVER_YEAR if r[1] is None else r[1] for r in rows], dtype=numpy.int32)
+        self.death_year = numpy.array([(_ALWAYS_YEAR if r[3] else _NEVER_YEAR) if r[2] is None else r[2] for r in rows], dtype=numpy.int32)
+        self.gender = _encode_categorical([r[4] for r in rows], GENDER_CODES)
+        self.civil_status = _encode_categorical([r[5] for r in rows], CIVIL_STATUS_CODES)
+        self.job_condition = _encode_categorical([r[6] for r in rows], JOB_CONDITION_CODES)
+        self.educational_level = _encode_educational_level([r[7] for r in rows])
+        # cohorts
+        rows = cursor.execute("SELECT ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET FROM cohorts").fetchall()
+        cursor.close()
+        cohort_subject_index = self.get_subject_indices([r[0] for r in rows])
+        is_known_ = cohort_subject_index >= 0
+        self.in_cohorts = numpy.zeros(self.n_subjects, dtype=bool)
+        self.in_cohorts[cohort_subject_index[is_known_]] = True
+        # for every disorder, the (subject index, year of onset) pairs
+        disorder_ = numpy.array([r[1] for r in rows], dtype=object)
+        year_of_onset_ = numpy.array([r[2] for r in rows], dtype=numpy.int32)
+        self.cohorts: dict[str: tuple[numpy.ndarray, numpy.ndarray]] = {}
+        for disease_db_code in DISEASE_CODE_TO_DB_CODE.values():
+            m_ = is_known_ & (disorder_ == disease_db_code)
+            self.cohorts[disease_db_code] = (cohort_subject_index[m_], year_of_onset_[m_])
+
+    @property
+    def n_subjects(self) -> int:
+        return len(self.subject_ids)
+
+    def get_subject_indices(self, ids: list) -> numpy.ndarray:
+        """ Index of each ID_SUBJECT in subject_ids, -1 if not found.
+        """
+        ids = numpy.array(ids, dtype=numpy.int64)
+        if len(ids) == 0 or self.n_subjects == 0:
+            return numpy.full(len(ids), -1, dtype=numpy.int64)
+        pos_ = numpy.searchsorted(self.subject_ids, ids)
+        pos_ = numpy.clip(pos_, 0, self.n_subjects - 1)
+        return numpy.where(self.subject_ids[pos_] == ids, pos_, -1).astype(numpy.int64)
+
+    # masks
+
+    def age_mask(self, year_of_inclusion: int, age_intervals: list[tuple[int, int]]) -> numpy.ndarray:
+        """ Subjects alive at the year of inclusion, whose age falls in any of the (inclusive) age intervals,
+        and that appear in cohorts (same definition as the age_stratification table).
+        """
+        age_ = year_of_inclusion - self.birth_year
+        mask = numpy.zeros(self.n_subjects, dtype=bool)
+        for a, b in age_intervals:
+            mask |= (age_ >= a) & (age_ <= b)
+        mask &= self.death_year > year_of_inclusion
+        mask &= self.in_cohorts
+        return mask
+
+    def demographics_mask(self, gender: str, civil_status: str, job_condition: str, educational_level: str) -> numpy.ndarray:
+        """ Same conditions as database.get_demographics_selector_string.
+        """
+        mask = numpy.ones(self.n_subjects, dtype=bool)
+        if gender == "A-U":
+            mask &= self.gender != GENDER_CODES[None]
+        elif gender == "U":
+            mask &= self.gender == GENDER_CODES[None]
+        elif gender != "A":
+            mask &= self.gender == GENDER_CODES.get(gender, -1)
+        if civil_status == "All-Other":
+            mask &= (self.civil_status != CIVIL_STATUS_CODES[None]) & (self.civil_status != CIVIL_STATUS_CODES["Other"])
+        elif civil_status != "All":
+            mask &= self.civil_status == CIVIL_STATUS_CODES.get(civil_status, -1)
+        if job_condition == "All-Unknown":
+            mask &= self.job_condition != JOB_CONDITION_CODES[None]
+        elif job_condition == "Unknown":
+            mask &= self.job_condition == JOB_CONDITION_CODES[None]
+        elif job_condition != "All":
+            mask &= self.job_condition == JOB_CONDITION_CODES.get(job_condition, -1)
+        if educational_level == "All-Unknown":
+            mask &= (self.educational_level != EDUCATIONAL_LEVEL_NULL_CODE) & (self.educational_level != 9)
+        elif educational_level == "Unknown" or educational_level == "9":
+            # 9 is the ISCED level for Unknown
+            mask &= (self.educational_level == EDUCATIONAL_LEVEL_NULL_CODE) | (self.educational_level == 9)
+        elif educational_level != "All":
+            mask &= self.educational_level == int(educational_level)
+        return mask
+
+    def cohort_mask(self, disease_db_code: str, cohort_code: str, year_of_inclusion: int) -> numpy.ndarray:
+        """ Subjects of the cohort (PREVALENT: _a_, INCIDENT: _b_, INCIDENT_1825: _c_) of the disease
+        at the year of inclusion.
+        """
+        if disease_db_code not in self.cohorts:
+            raise ValueError(f"disease_db_code must be in {list(self.cohorts.keys())}")
+        subject_index_, year_of_onset_ = self.cohorts[disease_db_code]
+        if cohort_code == "_a_":
+            selected_ = year_of_onset_ <= year_of_inclusion
+        elif cohort_code in ["_b_", "_c_"]:
+            selected_ = year_of_onset_ == year_of_inclusion
+        else:
+            raise ValueError("cohort_code must be in ['_a_', '_b_', '_c_'] corresponding to ['PREVALENT', 'INCIDENT', 'INCIDENT_1825']")
+        mask = numpy.zeros(self.n_subjects, dtype=bool)
+        mask[subject_index_[selected_]] = True
+        if cohort_code == "_c_":
+            mask &= self.age_mask(year_of_inclusion, [(18, 25)])
+        return mask
+
+    # stratification
+
+    def stratify(self, **kwargs) -> numpy.ndarray:
+        """ Columnar version of database.stratify_demographics.
+        Returns the sorted array of the indices (in subject_ids) of the patients that satisfy the conditions.
+
+        kwargs: the same of database.stratify_demographics (year_of_inclusion, age, gender,
+        civil_status, job_condition, educational_level), plus, optionally:
+        - disease_db_code: str
+            in ["SCHIZO", "DEPRE", "BIPO"], if provided together with cohort_code,
+            only the patients in the cohort are returned.
+        - cohort_code: str
+            in ["_a_", "_b_", "_c_"]
+        """
+        year_of_inclusion = int(kwargs.get("year_of_inclusion", time.localtime().tm_year))
+        age_intervals_list = kwargs.get("age", None)
+        if not isinstance(age_intervals_list, list) or len(age_intervals_list) == 0:
+            raise ValueError(f"age must be a non-empty list. Found {age_intervals_list}")
+        for age_interval in age_intervals_list:
+            if age_interval not in AGE_WIDGET_INTERVALS.values():
+                raise ValueError(f"age must be a list of tuples[int, int] (inclusive) choosing from {AGE_WIDGET_INTERVALS.values()}. Found {age_interval}")
+        _available = {
+            "gender": ["A", "A-U", "M", "F", "U"],
+            "civil_status": ["All", "All-Other", "Unmarried", "Married", "Married_no_long", "Other"],
+            "job_condition": ["All", "All-Unknown", "Employed", "Unemployed", "Pension", "Unknown"],
+            "educational_level": ["All", "All-Unknown", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "Unknown"],
+        }
+        for k, v in _available.items():
+            if kwargs.get(k, None) not in v:
+                raise ValueError(f"{k} must be provided choosing from {v}")
+        mask = self.age_mask(year_of_inclusion, age_intervals_list)
+        mask &= self.demographics_mask(
+            gender=kwargs["gender"],
+            civil_status=kwargs["civil_status"],
+            job_condition=kwargs["job_condition"],
+            educational_level=kwargs["educational_level"]
+        )
+        disease_db_code = kwargs.get("disease_db_code", None)
+        cohort_code = kwargs.get("cohort_code", None)
+        if disease_db_code is not None and cohort_code is not None:
+            mask &= self.cohort_mask(disease_db_code, cohort_code, year_of_inclusion)
+        return numpy.flatnonzero(mask)
+
+
+if __name__ == "__main__":
+    # Benchmark: columnar stratification against the SQL (temporary tables) one.
+    # usage: python -m ja_implemental_dashboard.v2.database.columnar <path/to/internal/database.jasqlite3>
+    import sys
+    from .database import stratify_demographics, get_all_years_of_inclusion
+    from ..indicator.evaluation.engine import evaluate_indicator_all_years
+    if len(sys.argv) < 2:
+        print("Please provide the path to an internal (slimmed and preprocessed) database file.")
+        exit()
+    connection = sqlite3.connect(sys.argv[1])
+    years = get_all_years_of_inclusion(connection)
+    strata = [
+        {"age": [(1, 150)], "gender": "A", "civil_status": "All", "job_condition": "All", "educational_level": "All"},
+        {"age": [(15, 25), (26, 40)], "gender": "F", "civil_status": "All-Other", "job_condition": "All-Unknown", "educational_level": "All-Unknown"},
+        {"age": [(65, 150)], "gender": "U", "civil_status": "Married", "job_condition": "Unknown", "educational_level": "Unknown"},
+    ]
+    # - stratification only
+    t0 = time.time()
+    sql_results = []
+    cursor = connection.cursor()
+    for s in strata:
+        for y in years:
+            table_name = stratify_demographics(connection, year_of_inclusion=y, **s)
+            sql_results.append(set(r[0] for r in cursor.execute(f"SELECT ID_SUBJECT FROM {table_name}").fetchall()))
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cursor.close()
+    t_sql = time.time() - t0
+    t0 = time.time()
+    columnar = ColumnarDemographics(connection)
+    t_load = time.time() - t0
+    t0 = time.time()
+    columnar_results = []
+    for s in strata:
+        for y in years:
+            columnar_results.append(columnar.stratify(year_of_inclusion=y, **s))
+    t_columnar = time.time() - t0
+    n_equal = sum([a == set(columnar.subject_ids[b]) for a, b in zip(sql_results, columnar_results)])
+    print(f"Stratifications: {len(sql_results)} ({len(strata)} strata x {len(years)} years), identical results: {n_equal}")
+    print(f"- SQL temporary tables: {t_sql:.3f} s")
+    print(f"- columnar: {t_columnar:.3f} s (+ {t_load:.3f} s to load the arrays once)")
+    # - full indicator evaluation
+    for cohort_code in ["_a_", "_b_", "_c_"]:
+        kw = dict(connection=connection, disease_db_code="DEPRE", cohort_code=cohort_code, years_of_inclusion=years, **strata[0])
+        t0 = time.time()
+        out_sql = evaluate_indicator_all_years("EA1", **kw)
+        t_sql = time.time() - t0
+        t0 = time.time()
+        out_columnar = evaluate_indicator_all_years("EA1", columnar=columnar, **kw)
+        t_columnar = time.time() - t0
+        print(f"EA1, cohort {cohort_code}, {len(years)} years: SQL {t_sql:.3f} s, columnar {t_columnar:.3f} s, identical results: {out_sql == out_columnar}")
+    connection.close()
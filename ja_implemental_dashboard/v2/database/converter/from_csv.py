@@ -0,0 +1,178 @@
+import os, sys, time
+import ast
+import csv
+import sqlite3
+
+from ..database import (
+    DATABSE_RECORD_LAYOUT_DATA_TYPES,
+    DATETIME_COLUMNS_REQUIRED,
+    DATETIME_COLUMNS_NOT_REQUIRED,
+)
+from .from_sas import open_bulk_load_database, filter_rows
+
+# Import of the CSV files of the QUADIM export (e.g. ExampleData/Dati QUADIM - Standardizzati - Sicilia restricted)
+# into the original SQLite3 database of the dashboard, without going through pandas.
+#
+# These files were written by pandas from the SAS datasets, so:
+# - the first column is the unnamed index of the data frame, which is dropped;
+# - the strings that were bytes in the SAS dataset are written as python byte literals,
+#   padded with spaces, e.g. b'     200' or b'ICD10': they are decoded and stripped;
+# - missing dates are written as 1800-01-01, which becomes NULL;
+# - EDU_LEVEL is a range of years of education ('0-5', '6-8', ...), which becomes the ISCED
+#   level the dashboard expects, as in the fix-up of the databases converted from SAS (see from_sas);
+# - the numbers of the INTEGER columns are parsed as integers, never through a float, so that
+#   long values keep all their digits ('2.0', as pandas writes the integers of a column
+#   with missing values, is 2), and the values that are not integers are kept as text;
+#   the original ID_SUBJECT is TEXT in the record layout and is kept as it is, leading zeros
+#   included (converted to numbers, distinct subjects could get the same ID).
+# The files are read line by line and written in batches, so the memory used does not
+# depend on the size of the files. The tables have the columns of the record layout
+# (see DATABSE_RECORD_LAYOUT_DATA_TYPES), with their data types, and if filter_mental_health
+# only the records of pharma and diagnoses that slim_down_database keeps (see from_sas).
+# The tables without a file are created empty, so that the database has all the tables.
+
+CSV_BATCH_SIZE = 100000
+MISSING_DATE_SENTINELS = ["1800-01-01"]
+EDU_LEVEL_MISSING_ISCED = 9 # no educational level
+EDU_LEVEL_RANGES_TO_ISCED = {
+    "Unknown": EDU_LEVEL_MISSING_ISCED,
+    "0-5": 1, # primary education
+    "6-8": 2, # lower secondary education
+    "9-13": 3, # upper secondary education
+    ">=14": 5, # after upper secondary education, could be 4, 6, 7, or 8
+}
+
+
+def decode_byte_literal(value: str) -> str:
+    """ "b'     200'" -> "     200", other values are returned as they are. """
+    if len(value) < 3 or value[0] != "b" or value[1] not in ["'", '"'] or value[-1] != value[1]:
+        return value
+    if "\\" not in value:
+        return value[2:-1]
+    try:
+        decoded = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value[2:-1]
+    try:
+        return decoded.decode("utf-8")
+    except UnicodeDecodeError:
+        return decoded.decode("latin-1")
+
+def get_layout_columns(table_name: str) -> list[tuple[str, str]]:
+    """ The columns (name, data type) of the table in the record layout of the original database. """
+    return list(DATABSE_RECORD_LAYOUT_DATA_TYPES[table_name].items())
+
+def _convert_value(value: str|None, sqlite_type: str, is_date: bool, is_edu_level: bool):
+    """ A value of the CSV file as the python value to insert (see the module comments). """
+    if value is not None:
+        value = decode_byte_literal(value).strip()
+        if value == "" or (is_date and value in MISSING_DATE_SENTINELS):
+            value = None
+    if is_edu_level:
+        if value is None:
+            return EDU_LEVEL_MISSING_ISCED
+        value = EDU_LEVEL_RANGES_TO_ISCED.get(value, value)
+    if value is None or sqlite_type not in ["INTEGER", "REAL"] or not isinstance(value, str):
+        return value
+    # numbers, values that are not numbers are kept as text
+    if sqlite_type == "INTEGER":
+        integer_part, _, decimals = value.partition(".")
+        if decimals.strip("0") != "":
+            return value
+        try:
+            integer = int(integer_part)
+        except ValueError:
+            return value
+        # out of the range of the SQLite3 integers
+        return integer if -2**63 <= integer < 2**63 else value
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def convert_quadim_csv_files_to_sqlite3_db(files_folder: str, output_db_file: str, file_name_to_table_name_dict: dict[str:str]|None=None, filter_mental_health: bool=True, batch_size: int=CSV_BATCH_SIZE) -> dict:
+    """ Import the CSV files of the QUADIM export in the folder to a single SQLite3 database file
+    (see the module comments). The output database file is overwritten if it exists.
+    file_name_to_table_name_dict: dict|None
+        The files of the tables, as table_name : file_name (not whole path, with or without extension).
+        By default, the files are named as the tables (demographics.csv, diagnoses.csv, ...).
+    filter_mental_health: bool
+        If True, only the mental health related records of pharma and diagnoses are kept,
+        as slim_down_database does.
+    Returns {table_name: {"read": records read, "kept": records written}, ..., "time": seconds}.
+    """
+    t0 = time.time()
+    if file_name_to_table_name_dict is None:
+        file_name_to_table_name_dict = {t: t + ".csv" for t in DATABSE_RECORD_LAYOUT_DATA_TYPES.keys()}
+    for table_name in file_name_to_table_name_dict.keys():
+        if table_name not in DATABSE_RECORD_LAYOUT_DATA_TYPES and "cohort" not in table_name.lower():
+            raise ValueError(f"Unknown table {table_name}, the tables are {list(DATABSE_RECORD_LAYOUT_DATA_TYPES.keys())}.")
+    conn = open_bulk_load_database(output_db_file)
+    filter_connection = sqlite3.connect(":memory:")
+    counts = {}
+    try:
+        for table_name in DATABSE_RECORD_LAYOUT_DATA_TYPES.keys():
+            columns = get_layout_columns(table_name)
+            column_definitions = ", ".join([f'"{c}" {t}' for c, t in columns])
+            conn.execute(f'CREATE TABLE "{table_name}" ({column_definitions})')
+            counts[table_name] = {"read": 0, "kept": 0}
+            file_name = file_name_to_table_name_dict.get(table_name)
+            f = None if file_name is None else os.path.join(files_folder, os.path.splitext(file_name)[0] + ".csv")
+            if f is None or not os.path.exists(f):
+                print("Table:", table_name, "no file, created empty")
+                continue
+            print("Reading file: ", os.path.basename(f), "->", table_name)
+            date_columns = DATETIME_COLUMNS_REQUIRED[table_name] + DATETIME_COLUMNS_NOT_REQUIRED[table_name]
+            insert_statement = f'INSERT INTO "{table_name}" VALUES ({", ".join(["?"] * len(columns))})'
+            with open(f, "r", newline="", encoding="utf-8", errors="replace") as csv_file:
+                reader = csv.reader(csv_file)
+                header = [decode_byte_literal(h).strip() for h in next(reader)]
+                # position of each column of the layout in the file (None if missing),
+                # the unnamed index and the columns not in the layout are not imported
+                positions = [header.index(c) if c in header else None for c, _ in columns]
+                converters = [(c == "EDU_LEVEL" and table_name == "demographics", c in date_columns, t) for c, t in columns]
+                missing_columns = [c for (c, _), p in zip(columns, positions) if p is None]
+                if len(missing_columns) > 0:
+                    print("Table:", table_name, "columns not in the file, set to NULL:", missing_columns)
+                batch = []
+                def write_batch_():
+                    rows = filter_rows(table_name, columns, batch, filter_connection) if filter_mental_health else batch
+                    conn.executemany(insert_statement, rows)
+                    conn.commit()
+                    counts[table_name]["read"] += len(batch)
+                    counts[table_name]["kept"] += len(rows)
+                    print("Table:", table_name, "records read", counts[table_name]["read"], "kept", counts[table_name]["kept"], "               ", end="\r")
+                for line in reader:
+                    if len(line) == 0:
+                        continue
+                    batch.append(tuple([
+                        _convert_value(None if p is None or p >= len(line) else line[p], t, is_date, is_edu_level)
+                        for p, (is_edu_level, is_date, t) in zip(positions, converters)
+                    ]))
+                    if len(batch) >= batch_size:
+                        write_batch_()
+                        batch = []
+                if len(batch) > 0:
+                    write_batch_()
+            print(f"Table: {table_name} done, {counts[table_name]['read']} records read, {counts[table_name]['kept']} kept ({time.time() - t0:.1f} s)               ")
+        conn.commit()
+    finally:
+        filter_connection.close()
+        conn.close()
+    counts["time"] = time.time() - t0
+    print(f"Imported the CSV files in {counts['time']:.1f} s: {output_db_file}")
+    return counts
+
+
+if __name__ == "__main__":
+    # e.g.
+    # python -m ja_implemental_dashboard.v2.database.converter.from_csv "ExampleData/Dati QUADIM - Standardizzati - Sicilia restricted" DATABASE.sqlite3
+    if len(sys.argv) < 3:
+        print("Usage: python -m ja_implemental_dashboard.v2.database.converter.from_csv path/to/csv/folder path/to/database.sqlite3 [--no-filter]")
+        sys.exit(1)
+    convert_quadim_csv_files_to_sqlite3_db(
+        files_folder=sys.argv[1],
+        output_db_file=sys.argv[2],
+        filter_mental_health="--no-filter" not in sys.argv[3:],
+    )
@@ -1,40 +1,304 @@
 import os, sys, time, datetime
+import queue
+import multiprocessing
+import numpy
 import pandas
 import sqlite3
 
-def convert_sas_datasets_to_sqlite3_db(files_folder: str, file_name_to_table_name_dict: dict[str:str], output_db_file: str, sas_file_ext:str=".sas7bdat"):
+from ..database import (
+    DATABSE_RECORD_LAYOUT_DATA_TYPES,
+    DATETIME_COLUMNS_REQUIRED,
+    DATETIME_COLUMNS_NOT_REQUIRED,
+    SLIM_PHARMA_CONDITION,
+    SLIM_DIAGNOSES_CONDITION,
+)
+
+# Conversion of the SAS datasets to the original SQLite3 database of the dashboard.
+#
+# Each file is read in chunks by a reader process (one process per file, at most
+# max_workers at the same time), which converts the chunk into rows ready to be
+# inserted, and sends them to the main process through a bounded queue.
+# The main process is the only writer: it inserts the rows in large transactions,
+# with the bulk-load pragmas (no journal, no sync), so writing is not the bottleneck.
+#
+# While reading, the readers:
+# - give the columns of the record layout (see DATABSE_RECORD_LAYOUT_DATA_TYPES)
+#   their data type: codes as integers (SAS stores every number as a float),
+#   dates as 'YYYY-MM-DD' text, strings as text instead of blobs;
+#   the original ID_SUBJECT is TEXT in the record layout and is never converted to a number
+#   (long IDs would be rounded and leading zeros dropped, merging distinct subjects);
+#   integers are parsed as such, not through a float, so that they keep all their digits;
+#   values that do not fit the type (e.g. EDU_LEVEL as '0-5') are kept as text;
+# - if filter_mental_health, keep only the pharma and diagnoses records that
+#   slim_down_database would keep (same conditions, SLIM_PHARMA_CONDITION and
+#   SLIM_DIAGNOSES_CONDITION), which are a small part of those tables.
+#   The other tables are not filtered: which subjects to keep depends on all the tables.
+# The rows of each table are written in the order of its file.
+
+SAS_READ_CHUNKSIZE = 100000
+WRITER_TRANSACTION_ROWS = 1000000
+INGESTION_FILTER_CONDITIONS = {
+    "pharma": SLIM_PHARMA_CONDITION,
+    "diagnoses": SLIM_DIAGNOSES_CONDITION,
+}
+
+
+def _get_sqlite_type(table_name: str, column: str, values: pandas.Series) -> str:
+    """ Data type of the column in the converted table: the one of the record layout,
+    or the one of the values for the columns not in the record layout. """
+    layout = DATABSE_RECORD_LAYOUT_DATA_TYPES.get(table_name.lower(), {})
+    if column in layout:
+        return layout[column]
+    if pandas.api.types.is_integer_dtype(values.dtype) or pandas.api.types.is_bool_dtype(values.dtype):
+        return "INTEGER"
+    if pandas.api.types.is_float_dtype(values.dtype):
+        return "REAL"
+    return "TEXT"
+
+def _to_text(values: pandas.Series, date_format: str) -> pandas.Series:
+    """ Values as strings (None where missing). """
+    if pandas.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.dt.strftime(date_format).astype(object).where(values.notna(), None)
+    if pandas.api.types.is_float_dtype(values.dtype):
+        # integer codes stored by SAS as floats: 2962.0 -> '2962'
+        notna = values.notna()
+        integral = notna & (values == numpy.floor(values))
+        text = values.astype(object).where(notna, None)
+        text[integral] = values[integral].astype("int64").astype(str)
+        text[notna & ~integral] = values[notna & ~integral].astype(str)
+        return text
+    values = values.astype(object)
+    notna = values.notna()
+    text = values.where(notna, None)
+    text[notna] = [
+        (v.decode("utf-8", errors="replace") if isinstance(v, bytes) else str(v)).strip()
+        for v in values[notna]
+    ]
+    # empty strings are missing values for SAS
+    return text.where(text != "", None)
+
+def _parse_integer(value: str) -> int|None:
+    """ '123' -> 123, '2962.0' -> 2962, None if the value is not an integer
+    (or out of the range of the SQLite3 integers).
+    Integer strings are parsed with int, so that long values keep all their digits. """
+    try:
+        integer = int(value)
+        return integer if -2**63 <= integer < 2**63 else None
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() and abs(number) < 2**53 else None
+
+def _to_number(values: pandas.Series, sqlite_type: str) -> pandas.Series:
+    """ Values as int or float (None where missing). If some values are not numbers,
+    the column is returned as text, so that no value is lost. """
+    if pandas.api.types.is_datetime64_any_dtype(values.dtype):
+        return _to_text(values, "%Y-%m-%d %H:%M:%S")
+    if pandas.api.types.is_integer_dtype(values.dtype) or pandas.api.types.is_bool_dtype(values.dtype):
+        # not through float64, which cannot hold integers above 2^53
+        return values.astype(object).where(values.notna(), None)
+    if pandas.api.types.is_numeric_dtype(values.dtype):
+        numbers = values
+    else:
+        text = _to_text(values, "%Y-%m-%d %H:%M:%S")
+        if sqlite_type == "INTEGER":
+            integers = [None if v is None else _parse_integer(v) for v in text]
+            if all([i is not None for v, i in zip(text, integers) if v is not None]):
+                return pandas.Series(integers, index=text.index, dtype=object)
+            # integers out of the range of the SQLite3 integers would lose digits as floats
+            if any([i is None and v.strip().lstrip("+-").isdigit() for v, i in zip(text, integers) if v is not None]):
+                return text
+        numbers = pandas.to_numeric(text, errors="coerce")
+        if numbers.isna().sum() != text.isna().sum():
+            return text
+    numbers = numbers.astype("float64")
+    notna = numbers.notna()
+    result = numbers.astype(object).where(notna, None)
+    if sqlite_type == "INTEGER" and (numbers[notna] == numpy.floor(numbers[notna])).all() and (numbers[notna].abs() < 2**53).all():
+        result[notna] = numbers[notna].astype("int64").astype(object)
+    return result
+
+def get_typed_rows(table_name: str, chunk: pandas.DataFrame) -> tuple[list[tuple[str, str]], list[tuple]]:
+    """ The columns (name, data type) and the rows, as tuples of python values,
+    of a chunk read from a SAS file (see the module comments).
+    """
+    date_columns = DATETIME_COLUMNS_REQUIRED.get(table_name.lower(), []) + DATETIME_COLUMNS_NOT_REQUIRED.get(table_name.lower(), [])
+    columns = []
+    values = []
+    for column in chunk.columns:
+        sqlite_type = _get_sqlite_type(table_name, column, chunk[column])
+        if sqlite_type in ["INTEGER", "REAL"]:
+            v = _to_number(chunk[column], sqlite_type)
+        else:
+            v = _to_text(chunk[column], "%Y-%m-%d" if column in date_columns else "%Y-%m-%d %H:%M:%S")
+        columns.append((column, sqlite_type))
+        values.append(v.tolist())
+    return columns, list(zip(*values))
+
+def filter_rows(table_name: str, columns: list[tuple[str, str]], rows: list[tuple], filter_connection: sqlite3.Connection) -> list[tuple]:
+    """ The rows of the table that slim_down_database keeps (see INGESTION_FILTER_CONDITIONS),
+    selected with an in-memory SQLite3 table, so the conditions are exactly the same.
+    Tables without conditions are not filtered.
+    """
+    condition = INGESTION_FILTER_CONDITIONS.get(table_name.lower())
+    if condition is None or len(rows) == 0:
+        return rows
+    column_names = ", ".join([f'"{c}" {t}' for c, t in columns])
+    filter_connection.execute("DROP TABLE IF EXISTS temp.ingestion_chunk")
+    filter_connection.execute(f"CREATE TEMP TABLE ingestion_chunk ({column_names})")
+    filter_connection.executemany(f"INSERT INTO temp.ingestion_chunk VALUES ({', '.join(['?'] * len(columns))})", rows)
+    try:
+        return filter_connection.execute(f"SELECT * FROM temp.ingestion_chunk WHERE {condition} ORDER BY rowid").fetchall()
+    except sqlite3.OperationalError as e:
+        raise ValueError(f"Cannot filter the records of table {table_name} (columns: {[c for c, _ in columns]}): {e}")
+
+
+def open_bulk_load_database(output_db_file: str) -> sqlite3.Connection:
+    """ Create the empty database file (overwriting it) and connect to it with the bulk-load
+    pragmas: no journal, no sync, exclusive lock. The file is not usable if the
+    process is interrupted while writing, which is fine for a conversion from scratch.
+    """
+    if os.path.exists(output_db_file):
+        os.remove(output_db_file)
+    conn = sqlite3.connect(output_db_file)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")
+    return conn
+
+
+def _read_sas_files(tasks: multiprocessing.Queue, messages: multiprocessing.Queue, chunksize: int, filter_mental_health: bool) -> None:
+    """ Reader process: reads the files of the tasks (table_name, file path) until None,
+    and sends to the writer, for each file:
+    ("columns", table_name, columns), ("rows", table_name, rows, n_read)..., ("done", table_name, n_read, n_kept)
+    or ("error", table_name, message).
+    """
+    filter_connection = sqlite3.connect(":memory:")
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        table_name, file_path = task
+        try:
+            n_read = 0
+            n_kept = 0
+            columns = None
+            with pandas.read_sas(file_path, chunksize=chunksize, encoding="infer") as reader:
+                for chunk in reader:
+                    chunk_columns, rows = get_typed_rows(table_name, chunk)
+                    if columns is None:
+                        columns = chunk_columns
+                        messages.put(("columns", table_name, columns))
+                    elif [c for c, _ in chunk_columns] != [c for c, _ in columns]:
+                        raise ValueError(f"The columns of {file_path} change between chunks.")
+                    n_read += len(rows)
+                    if filter_mental_health:
+                        rows = filter_rows(table_name, columns, rows, filter_connection)
+                    n_kept += len(rows)
+                    messages.put(("rows", table_name, rows, len(chunk)))
+            if columns is None:
+                raise ValueError(f"The file {file_path} has no records.")
+            messages.put(("done", table_name, n_read, n_kept))
+        except Exception as e:
+            messages.put(("error", table_name, f"{type(e).__name__}: {e}"))
+    filter_connection.close()
+
+
+def convert_sas_datasets_to_sqlite3_db(files_folder: str, file_name_to_table_name_dict: dict[str:str], output_db_file: str, sas_file_ext:str=".sas7bdat", filter_mental_health: bool=True, max_workers: int|None=None, chunksize: int=SAS_READ_CHUNKSIZE) -> dict:
     """ Convert all the SAS7BDAT files in the folder to a single SQLite3 database file.
     The output database file is created if it does not exist, otherwise it is overwritten.
     The tables are named following the schema provided in the file_name_to_table_name_dict dictionary,
     composed as table_name : file_name (not whole path, with or without extension).
-    The tables are created with the same column names as the SAS7BDAT files.
+    The tables are created with the same column names as the SAS7BDAT files,
+    with the data types of the record layout (see the module comments).
+    filter_mental_health: bool
+        If True, only the mental health related records of pharma and diagnoses are kept,
+        as slim_down_database does. Set to False to have all the records of the files.
+    max_workers: int|None
+        Number of files read at the same time, each in its own process (default: number of CPUs).
+    Returns {table_name: {"read": records read, "kept": records written}, ..., "time": seconds}.
     """
-    # create the empty database file
-    if os.path.exists(output_db_file):
-        os.remove(output_db_file)
-    conn = sqlite3.connect(output_db_file)
+    t0 = time.time()
     # fix files extensions
-    for k, v in file_name_to_table_name_dict.items():
-        if not v.endswith(sas_file_ext):
-            f_without_ext = os.path.splitext(v)[0]
-            file_name_to_table_name_dict[k] = f_without_ext + sas_file_ext
-    # load the tables with pandas in chunks
+    tasks_list = []
     for table_name, file_name in file_name_to_table_name_dict.items():
         if "cohort" in table_name.lower():
             continue
+        if not file_name.endswith(sas_file_ext):
+            file_name = os.path.splitext(file_name)[0] + sas_file_ext
         # keys are the new tables names, values the files names
         f = os.path.join(files_folder, file_name)
         if not os.path.exists(f):
             raise FileNotFoundError(f"{f}")
-        print("Reading file: ", os.path.basename(f))
-        with pandas.read_sas(f, chunksize=10000) as reader:
-            for ic, chunk in enumerate(reader):
-                print("Table:", table_name, "chunk", ic, "  |  DB size:", os.path.getsize(output_db_file) / 1024 / 1024, "MB               ", end="\r")
-                # append the chunk to the table
-                chunk.to_sql(table_name, conn, if_exists='append', index=False)
-                conn.commit()
-    # close the connection
-    conn.close()
+        tasks_list.append((table_name, f))
+    # create the empty database file
+    conn = open_bulk_load_database(output_db_file)
+    # readers
+    n_workers = max(1, min(len(tasks_list), max_workers if max_workers is not None else (os.cpu_count() or 1)))
+    tasks = multiprocessing.Queue()
+    for task in tasks_list:
+        tasks.put(task)
+    for _ in range(n_workers):
+        tasks.put(None)
+    messages = multiprocessing.Queue(maxsize=4 * n_workers)
+    readers = [
+        multiprocessing.Process(target=_read_sas_files, args=(tasks, messages, chunksize, filter_mental_health), daemon=True)
+        for _ in range(n_workers)
+    ]
+    for reader in readers:
+        reader.start()
+    for table_name, f in tasks_list:
+        print("Reading file: ", os.path.basename(f), "->", table_name)
+    # single writer
+    counts = {}
+    insert_statements = {}
+    n_uncommitted = 0
+    n_done = 0
+    try:
+        while n_done < len(tasks_list):
+            try:
+                message = messages.get(timeout=5)
+            except queue.Empty:
+                if not any([reader.is_alive() for reader in readers]):
+                    raise ValueError("The SAS reader processes ended unexpectedly.")
+                continue
+            kind, table_name = message[0], message[1]
+            if kind == "error":
+                raise ValueError(f"Cannot convert the file of table {table_name}: {message[2]}")
+            elif kind == "columns":
+                columns = message[2]
+                column_definitions = ", ".join([f'"{c}" {t}' for c, t in columns])
+                conn.execute(f'CREATE TABLE "{table_name}" ({column_definitions})')
+                insert_statements[table_name] = f'INSERT INTO "{table_name}" VALUES ({", ".join(["?"] * len(columns))})'
+                counts[table_name] = {"read": 0, "kept": 0}
+            elif kind == "rows":
+                rows = message[2]
+                conn.executemany(insert_statements[table_name], rows)
+                counts[table_name]["read"] += message[3]
+                counts[table_name]["kept"] += len(rows)
+                n_uncommitted += len(rows)
+                if n_uncommitted >= WRITER_TRANSACTION_ROWS:
+                    conn.commit()
+                    n_uncommitted = 0
+                print("Table:", table_name, "records read", counts[table_name]["read"], "kept", counts[table_name]["kept"], "               ", end="\r")
+            elif kind == "done":
+                n_done += 1
+                print(f"Table: {table_name} done, {message[2]} records read, {message[3]} kept ({time.time() - t0:.1f} s)               ")
+        conn.commit()
+    finally:
+        for reader in readers:
+            if reader.is_alive():
+                reader.terminate()
+            reader.join()
+        conn.close()
+    counts["time"] = time.time() - t0
+    print(f"Converted {len(tasks_list)} files in {counts['time']:.1f} s: {output_db_file}")
+    return counts
 
 
 # load the tables in the mysql database (create the tables if they do not exist)
@@ -1,17 +1,24 @@
 import os, time, datetime
 import hashlib
-import bokeh.palettes
 import sqlite3
 
 from ..caching.database import (
     hash_database_file,
     get_original_database_file_path,
-    write_to_original_database_hash_file,
     get_slim_database_filepath,
-    write_to_slim_database_hash_file,
     detect_original_database_has_changed,
     detect_slim_database_has_changed,
-    
+    write_stage_manifest,
+    is_stage_up_to_date,
+)
+from .classification import (
+    CODE_CLASSIFICATION_TABLE,
+    CLASSIFIED_TABLES,
+    create_code_classification_table,
+    code_classification_table_is_current,
+    create_classified_records_table,
+    get_class_condition,
+    get_mental_health_condition,
 )
 
 # This file contains all the functions to load, preprocess
@@ -83,6 +90,47 @@ DATABSE_RECORD_LAYOUT_DATA_TYPES = {
     }
 }
 
+# Columns added to the tables of the ja database by the preprocessing
+# (not in the original database, see get_ja_database_layout)
+PREPROCESSING_ADDED_COLUMNS = {
+    "demographics": {
+        # added by preprocess_database_datetimes
+        "DT_BIRTH_YEAR": "INTEGER",
+        "DT_DEATH_YEAR": "INTEGER",
+        "DT_START_ASSIST_YEAR": "INTEGER",
+        "DT_END_ASSIST_YEAR": "INTEGER"
+    },
+    "diagnoses": {
+        # added by slim_down_database (see classification.py)
+        "DISORDER_CLASS": "INTEGER",
+        # added by preprocess_database_datetimes
+        "DATE_DIAG_YEAR": "INTEGER",
+        "DATE_DIAG_END_YEAR": "INTEGER",
+        "DATE_ADMISSION_YEAR": "INTEGER",
+        "DATE_DISCHARGE_YEAR": "INTEGER"
+    },
+    "pharma": {
+        # added by slim_down_database (see classification.py)
+        "DRUG_CLASS": "INTEGER",
+        # added by preprocess_database_datetimes
+        "DT_PRESCR_YEAR": "INTEGER"
+    },
+    "interventions": {
+        # added by preprocess_database_datetimes
+        "DT_INT_YEAR": "INTEGER"
+    },
+    "physical_exams": {
+        # added by preprocess_database_datetimes
+        "DT_INT_YEAR": "INTEGER"
+    }
+}
+
+# In the original database the subjects are identified by their original ID_SUBJECT
+# (TEXT in the record layout above, possibly padded or with leading zeros).
+# slim_down_database replaces it with a dense integer key (see the subjects table),
+# so ID_SUBJECT is INTEGER in the tables of the ja database (see get_ja_database_layout).
+JA_DATABASE_SUBJECT_KEY_DATA_TYPE = "INTEGER"
+
 DISEASE_CODE_TO_DB_CODE = {
     "_schizophrenia_": "SCHIZO",
     "_depression_": "DEPRE",
@@ -590,16 +638,17 @@ INTERVENTIONS_CODES_LANGDICT_MAP = {
     }
 }
 
+# colors of bokeh.palettes.Muted8 (not imported, to keep this module free of plotting libraries)
 INTERVENTIONS_CODES_COLOR_DICT = {
     "All": "#a0a0a0ff",
-    1: bokeh.palettes.Muted8[0],
-    2: bokeh.palettes.Muted8[1],
-    3: bokeh.palettes.Muted8[2],
-    4: bokeh.palettes.Muted8[3],
-    5: bokeh.palettes.Muted8[4],
-    6: bokeh.palettes.Muted8[5],
-    7: bokeh.palettes.Muted8[6],
-    9: bokeh.palettes.Muted8[7]
+    1: "#CC6677",
+    2: "#332288",
+    3: "#DDCC77",
+    4: "#117733",
+    5: "#88CCEE",
+    6: "#882255",
+    7: "#44AA99",
+    9: "#999933"
 }
 
 ####################
@@ -742,6 +791,17 @@ def standardize_table_names(connection: sqlite3.Connection) -> None:
             cursor.execute(f"ALTER TABLE {intermediate_name} RENAME TO {new_table}")
     cursor.close()
 
+# Table of the ja database that stores, for each table of the original database,
+# the last rowid and the number of records already processed
+INGESTION_STATE_TABLE = "ingestion_state"
+
+# Conditions on the records of the original database that are kept in the ja database
+# by slim_down_database (mental health related prescriptions and diagnoses), generated
+# from the code prefixes of classification.py; they do not need the code_classification
+# table (e.g. to filter the records while converting the original database)
+SLIM_PHARMA_CONDITION = get_mental_health_condition("pharma")
+SLIM_DIAGNOSES_CONDITION = get_mental_health_condition("diagnoses")
+
 def slim_down_database(connection: sqlite3.Connection) -> tuple[str, bool]:
     """To be run before the preprocessing of the database,
     to slim down the database and make it faster to process
@@ -771,11 +831,22 @@ def slim_down_database(connection: sqlite3.Connection) -> tuple[str, bool]:
     condition_2 = not detect_original_database_has_changed()
     # - the slim database file has changed
     condition_3 = not detect_slim_database_has_changed()
+    # - the slim database file has the subjects dictionary table and the classified records
+    #   (slim databases created by older versions use the original TEXT ID_SUBJECT,
+    #   or do not have the class columns, or classified the records with other code prefixes)
+    condition_4 = False
+    if condition_1:
+        conn_ = sqlite3.connect(new_db_file)
+        tables_ = get_tables(conn_)
+        condition_4 = "subjects" in tables_ and code_classification_table_is_current(conn_) and all([
+            c["class_column"] in get_column_names(conn_, t) for t, c in CLASSIFIED_TABLES.items() if t in tables_
+        ])
+        conn_.close()
     # - decide
-    if condition_1 and condition_2 and condition_3:
+    if condition_1 and condition_2 and condition_3 and condition_4:
         print("none found!")
         return new_db_file, False
-    if condition_1:
+    if not condition_1:
         s_ = "ja database not found"
     elif not condition_2 and not condition_3:
         s_ = "both databases changed"
@@ -783,156 +854,163 @@ def slim_down_database(connection: sqlite3.Connection) -> tuple[str, bool]:
         s_ = "original database changed"
     elif not condition_3:
         s_ = "ja database changed"
+    elif not condition_4:
+        s_ = "ja database outdated"
     print(f"changes found! ({s_}) Processing...", end=" ")
     # apply the process
     cursor = connection.cursor()
-    # save the hash of the original database file for next time
-    write_to_original_database_hash_file(hash_database_file(get_original_database_file_path()))
+    # hash the original database file as it is now, it will be saved in the manifest for next time
+    original_database_hash = hash_database_file(get_original_database_file_path())
     # permanently delete the slim database file if it exists
     if os.path.exists(new_db_file):
         os.remove(new_db_file)
     # create the new slim database file
     cursor.execute(f"ATTACH DATABASE '{new_db_file}' AS slim")
-    # slim down the pharma table
-    cursor.execute("""
-        CREATE TABLE slim.pharma AS
-        SELECT *
-        FROM pharma
-        WHERE
-            ATC_CHAR LIKE 'N06A%' /* Antidepressants */
-            OR
-            ATC_CHAR LIKE 'N05A%' /* Antipsycotics Agents (I and II generations) and Lithium (N05AN%) */
-            OR
-            ATC_CHAR = 'N03AX09' /* Lamotrigine */
-            OR
-            ATC_CHAR = 'N03AG01' /* Valproic acid */
-            OR
-            ATC_CHAR = 'N03AF01' /* Carbamazepine */
-            /* Here, casting is not necessary because pattern-matching with LIKE also */
-            /* works wether ATC_CHAR is BLOB or TEXT independently */
-    """)
-    # slim down the diagnoses table
-    cursor.execute("""
-        CREATE TABLE slim.diagnoses AS
-        SELECT *
-        FROM diagnoses
-        WHERE
-            (
-                cast(CODING_SYSTEM AS TEXT) = 'ICD9'
-                AND
-                (
-                    substr(cast(DIAGNOSIS AS TEXT),1,3) IN (
-                                                '311', /* Depression */
-                                                '295', '297', /* Schizophrenic Disorder */
-                                                /* Bipolar Disorder */
-                                                '301' /* Personality Disorder */
-                                                /* Anxiety Disorders */
-                                                /* Suicidal Behaviour */
-                                            )
-                    OR
-                    substr(cast(DIAGNOSIS AS TEXT),1,4) IN (
-                                                '2962', '2963', '2980', '3004', '3090', '3091', /* Depression */
-                                                '2982', '2983', '2984', '2988', '2989', /* Schizophrenic Disorder */
-                                                '2960', '2961', '2964', '2965', '2966', '2967', '2981', /* Bipolar Disorder */
-                                                /* Personality Disorder */
-                                                '3000', '3001', '3003', '3098', '3083', /* Anxiety Disorders */
-                                                'E950', 'E951', 'E952', 'E953', 'E954', 'E955', 'E956', 'E957', 'E958', 'E959' /* Suicidal Behaviour */
-                                            )
-                    OR
-                    substr(cast(DIAGNOSIS AS TEXT),1,5) IN (
-                                                /* Depression */
-                                                /* Schizophrenic Disorder */
-                                                '29680', '29681', '29689', '29699', /* Bipolar Disorder */
-                                                /* Personality Disorder */
-                                                /* Anxiety Disorders */
-                                                'V6284' /* Suicidal Behaviour */
-                                            )
-                )
-            )
-            OR
-            (
-                cast(CODING_SYSTEM AS TEXT) = 'ICD10'
-                AND
-                (
-                   substr(cast(DIAGNOSIS AS TEXT),1,3) IN (
-                                                'F32', 'F33', 'F39', /* Depression */
-                                                'F20', 'F21', 'F22', 'F23', 'F24', 'F25', 'F28', 'F29', /* Schizophrenic Disorder */
-                                                'F30', 'F31', /* Bipolar Disorder */
-                                                'F60', 'F61', /* Personality Disorder */
-                                                'F40', 'F41', 'F42', /* Anxiety Disorders */
-                                                'X60', 'X61', 'X62', 'X63', 'X64', 'X65', 'X66', 'X67', 'X68', 'X69', 'X70', 'X71', 'X72', 'X73', 'X74', 'X75', 'X76', 'X77', 'X78', 'X79', 'X80', 'X81', 'X82', 'X83', 'X84', 'Y10', 'Y11', 'Y12', 'Y13', 'Y14', 'Y15', 'Y16', 'Y17', 'Y18', 'Y19', 'Y20', 'Y21', 'Y22', 'Y23', 'Y24', 'Y25', 'Y26', 'Y27', 'Y28', 'Y29', 'Y30', 'Y31', 'Y32', 'Y33', 'Y34' /* Suicidal Behaviour */
-                                            )
-                    OR
-                    substr(cast(DIAGNOSIS AS TEXT),1,4) IN (
-                                                'F341', 'F348', 'F349', 'F381', 'F388', 'F431', 'F432', /* Depression */
-                                                /* Schizophrenic Disorder */
-                                                'F340', 'F380', /* Bipolar Disorder */
-                                                /* Personality Disorder */
-                                                'F930', 'F931', 'F932', 'F430', 'F431', 'F438', 'F439' /* Anxiety Disorders */
-                                                /* Suicidal Behaviour */
-                                            )
-                )
-            )
-    """)
+    # classification of the diagnosis and ATC codes (see classification.py),
+    # kept in the slim database for the records appended later (see database/incremental.py)
+    create_code_classification_table(cursor, "slim")
+    # slim down the pharma and diagnoses tables: each record is classified once,
+    # only the mental health related ones (class != 0) are kept, with their
+    # DRUG_CLASS and DISORDER_CLASS
+    for t in ["pharma", "diagnoses"]:
+        cursor.execute(f"DROP TABLE IF EXISTS temp.slim_{t}")
+        create_classified_records_table(cursor, t, f"main.{t}", f"slim_{t}", classification_table=f"slim.{CODE_CLASSIFICATION_TABLE}")
     # tables 'interventions' is by construction already fine
-    cursor.execute("CREATE TABLE slim.interventions AS SELECT * FROM interventions")
+    cursor.execute("DROP TABLE IF EXISTS temp.slim_interventions")
+    cursor.execute("CREATE TEMP TABLE slim_interventions AS SELECT * FROM interventions")
     # slim down the demographics table
     # to do so, find all the subjects that are in the slimmed down pharma and diagnoses tables
     # as well as in the interventions and physical_exams tables
     # create a unique set of subjects
     # then, create a new demographics table with only the subjects that appear in the unique set
+    cursor.execute("DROP TABLE IF EXISTS temp.slim_demographics")
     cursor.execute("""
-        CREATE TABLE slim.demographics AS
+        CREATE TEMP TABLE slim_demographics AS
         SELECT *
         FROM demographics
-        WHERE ID_SUBJECT IN (
+        WHERE trim(CAST(ID_SUBJECT AS TEXT)) IN (
             /* I want to keep every subject that has something
                either in the pharma, diagnoses, interventions tables 
+               (IDs are compared without padding, whether they are stored as TEXT or BLOB)
             */
-            SELECT ID_SUBJECT FROM slim.pharma
+            SELECT trim(CAST(ID_SUBJECT AS TEXT)) FROM temp.slim_pharma
             UNION
-            SELECT ID_SUBJECT FROM slim.diagnoses
+            SELECT trim(CAST(ID_SUBJECT AS TEXT)) FROM temp.slim_diagnoses
             UNION
-            SELECT ID_SUBJECT FROM slim.interventions
+            SELECT trim(CAST(ID_SUBJECT AS TEXT)) FROM temp.slim_interventions
         )
     """)
     # slim down the physical_exams table from the unique set of subjects in the demographics table
+    cursor.execute("DROP TABLE IF EXISTS temp.slim_physical_exams")
     cursor.execute("""
-        CREATE TABLE slim.physical_exams AS
+        CREATE TEMP TABLE slim_physical_exams AS
         SELECT *
         FROM physical_exams
-        WHERE ID_SUBJECT IN (
-            SELECT ID_SUBJECT FROM slim.demographics
+        WHERE trim(CAST(ID_SUBJECT AS TEXT)) IN (
+            SELECT trim(CAST(ID_SUBJECT AS TEXT)) FROM temp.slim_demographics
+        )
+    """)
+    # subjects dictionary: map each original ID_SUBJECT (TEXT, possibly padded with spaces
+    # or stored as BLOB) to a dense INTEGER key, assigned in the order of the original IDs.
+    # The original ID is kept only in this table (e.g. for exports),
+    # every other table of the slim database uses the integer key as ID_SUBJECT.
+    slim_tables = ["demographics", "diagnoses", "pharma", "interventions", "physical_exams"]
+    cursor.execute("""
+        CREATE TABLE slim.subjects (
+            ID_SUBJECT INTEGER PRIMARY KEY,
+            ORIGINAL_ID_SUBJECT TEXT NOT NULL UNIQUE
+        )
+    """)
+    original_ids_string = " UNION ".join(
+        [f"SELECT trim(CAST(ID_SUBJECT AS TEXT)) AS ORIGINAL_ID_SUBJECT FROM temp.slim_{t}" for t in slim_tables]
+    )
+    cursor.execute(f"""
+        INSERT INTO slim.subjects (ORIGINAL_ID_SUBJECT)
+        SELECT ORIGINAL_ID_SUBJECT
+        FROM ({original_ids_string})
+        WHERE ORIGINAL_ID_SUBJECT IS NOT NULL
+        ORDER BY ORIGINAL_ID_SUBJECT
+    """)
+    # write the slim tables with the integer key, ordered by subject so that
+    # all the records of a subject are stored next to each other
+    for t in slim_tables:
+        # the columns of the temporary table (with the class columns of pharma and diagnoses)
+        columns_ = [d[0] for d in cursor.execute(f"SELECT * FROM temp.slim_{t} LIMIT 0").description]
+        other_columns_string = "".join([f", t.{c}" for c in columns_ if c != "ID_SUBJECT"])
+        cursor.execute(f"""
+            CREATE TABLE slim.{t} AS
+            SELECT s.ID_SUBJECT AS ID_SUBJECT{other_columns_string}
+            FROM temp.slim_{t} t
+            JOIN slim.subjects s ON s.ORIGINAL_ID_SUBJECT = trim(CAST(t.ID_SUBJECT AS TEXT))
+            ORDER BY s.ID_SUBJECT
+        """)
+        cursor.execute(f"DROP TABLE IF EXISTS temp.slim_{t}")
+    # remember up to which record each table of the original database has been processed,
+    # so that records appended later can be processed alone (see database/incremental.py)
+    cursor.execute(f"""
+        CREATE TABLE slim.{INGESTION_STATE_TABLE} (
+            TABLE_NAME TEXT PRIMARY KEY,
+            MAX_ROWID INTEGER,
+            N_ROWS INTEGER
         )
     """)
+    for t in slim_tables:
+        cursor.execute(f"""
+            INSERT INTO slim.{INGESTION_STATE_TABLE} (TABLE_NAME, MAX_ROWID, N_ROWS)
+            SELECT '{t}', COALESCE(MAX(rowid), 0), COUNT(*) FROM main.{t}
+        """)
     # commit changes and close
     connection.commit()
     cursor.close()
-    # save the hash of the slim database file for next time
-    write_to_slim_database_hash_file(hash_database_file(new_db_file))
+    # save the fingerprints of both database files for next time
+    write_stage_manifest("slim_down", original_database_hash=original_database_hash)
     print("done!")
     return new_db_file, True
 
+def get_original_subject_ids(connection: sqlite3.Connection, subject_ids: list[int]) -> list[str|None]:
+    """ Map the integer ID_SUBJECT keys of the ja database back to the original IDs
+    of the user database, as stored in the subjects table by slim_down_database.
+    Unknown keys are mapped to None.
+    """
+    cursor = connection.cursor()
+    id_map = dict(cursor.execute("SELECT ID_SUBJECT, ORIGINAL_ID_SUBJECT FROM subjects").fetchall())
+    cursor.close()
+    return [id_map.get(int(i), None) for i in subject_ids]
+
 def create_indices_on_ja_database(connection: sqlite3.Connection, force=False) -> None:
     """ Create indices on the tables of the ja dashboard database.
-    Runs only if force is True.
+    Runs only if force is True, or if this stage did not complete on the current ja database.
     """
-    if not force:
+    if not force and is_stage_up_to_date("indices"):
         return
     cursor = connection.cursor()
-    cursor.execute("CREATE INDEX idx_demographics_id_subject ON demographics(ID_SUBJECT)")
-    cursor.execute("CREATE INDEX idx_diagnoses_id_subject ON diagnoses(ID_SUBJECT)")
-    cursor.execute("CREATE INDEX idx_interventions_id_subject ON interventions(ID_SUBJECT)")
-    cursor.execute("CREATE INDEX idx_pharma_id_subject ON pharma(ID_SUBJECT)")
-    cursor.execute("CREATE INDEX idx_physical_exams_id_subject ON physical_exams(ID_SUBJECT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_demographics_id_subject ON demographics(ID_SUBJECT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_diagnoses_id_subject ON diagnoses(ID_SUBJECT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_interventions_id_subject ON interventions(ID_SUBJECT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pharma_id_subject ON pharma(ID_SUBJECT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_physical_exams_id_subject ON physical_exams(ID_SUBJECT)")
     # done
     connection.commit()
     cursor.close()
-    write_to_slim_database_hash_file(hash_database_file(get_slim_database_filepath()))
+    write_stage_manifest("indices")
+
+def get_ja_database_layout(table: str) -> dict[str, str]:
+    """ The data types of the columns of a table of the ja database: the ones of the record layout
+    of the original database, with the integer subject key (see JA_DATABASE_SUBJECT_KEY_DATA_TYPE),
+    and the ones of the columns added by the preprocessing (see PREPROCESSING_ADDED_COLUMNS).
+    Empty for the tables that are not in the record layout.
+    """
+    if table not in DATABSE_RECORD_LAYOUT_DATA_TYPES:
+        return {}
+    return {
+        **DATABSE_RECORD_LAYOUT_DATA_TYPES[table],
+        "ID_SUBJECT": JA_DATABASE_SUBJECT_KEY_DATA_TYPE,
+        **PREPROCESSING_ADDED_COLUMNS[table],
+    }
 
 def preprocess_database_data_types(connection: sqlite3.Connection, force: bool=False) -> None:
-    _dbg = False
-    # Note: this function depends of the global variable DATABSE_RECORD_LAYOUT_DATA_TYPES
+    # Note: this function depends of the global variables DATABSE_RECORD_LAYOUT_DATA_TYPES
+    #       and PREPROCESSING_ADDED_COLUMNS (see get_ja_database_layout)
     #       From experiments it came out that the current configuration takes up
     #       much more space than the "original", unprocessed database.
     #       I think this might be due to the use of TEXT data types instead of BLOB
@@ -962,152 +1040,349 @@ def preprocess_database_data_types(connection: sqlite3.Connection, force: bool=F
     if not force:
         print("Detecting changes in the internal database, please wait...", end=" ")
         # conditions to not apply this preprocessing (to exit this function):
-        # - the original database file must not have changed since the last preprocessing
-        condition_1 = not detect_original_database_has_changed()
-        # - the slim database file must not have changed since the last preprocessing
-        #   (this condition can be misleading as the hash file is saved after the slimming
-        #    down process, that is why it is necessary to force execution if the slimming
-        #    down process was applied)
-        condition_2 = not detect_slim_database_has_changed()
-        # - decide
-        if condition_1 and condition_2:
+        # this stage completed on the current ja database, and neither the original
+        # database file nor the slim database file have changed since
+        # (see the stage manifests in caching.database)
+        if is_stage_up_to_date("data_types"):
             print("None found!")
             return
     print("Fixing internal database data types...", end=" ")
-    # get the tables names
-    tables = get_tables(connection)
-    # make sure that no column with the _new suffix exist in any table of the database
-    for table in tables:
-        column_names = get_column_names(connection, table)
-        for cn in column_names:
-            if cn.endswith("_new"):
-                # remove the _new column
-                query = f"""
-                    ALTER TABLE {table}
-                    DROP COLUMN {cn}
-                """
-                cursor.execute(query)
-    # for each table, get the columns names and types
-    tables = get_tables(connection)
-    for table in tables:
-        column_names = get_column_names(connection, table)
-        column_types = get_column_types(connection, table)
-        for cn, ct in zip(column_names, column_types):
-            if _dbg:
-                n_entries_ = get_table_num_rows(connection, table)
-                print(f"{table}: {cn} - {ct} ({n_entries_:,d} entries) -> {DATABSE_RECORD_LAYOUT_DATA_TYPES[table][cn]}")
-            if table in DATABSE_RECORD_LAYOUT_DATA_TYPES and cn in DATABSE_RECORD_LAYOUT_DATA_TYPES[table]:
-                if _dbg:
-                    print("\tupdating...", end="\r")
-                # we need to copy the data in a new column with the correct type
-                # and then drop the old column and rename the new column
-                # create a new column with the correct type
-                query = f"""
-                    ALTER TABLE {table}
-                    ADD COLUMN {cn}_new {DATABSE_RECORD_LAYOUT_DATA_TYPES[table][cn]}
-                """
-                cursor.execute(query)
-                # copy the data from the old column to the new column
-                query = f"""
-                    UPDATE {table}
-                    SET {cn}_new = CAST({cn} as {DATABSE_RECORD_LAYOUT_DATA_TYPES[table][cn]})
-                """
-                cursor.execute(query)
-                # drop the old column
-                query = f"""
-                    ALTER TABLE {table}
-                    DROP COLUMN {cn}
-                """
-                cursor.execute(query)
-                # rename the new column
-                query = f"""
-                    ALTER TABLE {table}
-                    RENAME COLUMN {cn}_new TO {cn}
-                """ 
-                cursor.execute(query)
-            else:
-                print(f"Table '{table}' has column '{cn}' with type '{ct}' which is not in the record layout.\nRecord Layout:\n{DATABSE_RECORD_LAYOUT_DATA_TYPES}")
-    # be sure that no columns with the suffix _new exists
-    tables = get_tables(connection)
-    for table in tables:
-        column_names = get_column_names(connection, table)
-        for cn in column_names:
-            if cn.endswith("_new"):
-                # remove the _new column
-                query = f"""
-                    ALTER TABLE {table}
-                    DROP COLUMN {cn}
-                """
-                cursor.execute(query)
-    # commit changes and close
-    connection.commit()
+    t0 = time.time()
+    n_statements = 0
+    # each table is rebuilt once with the data types of the record layout:
+    # CREATE TABLE (typed) ; INSERT INTO ... SELECT CAST(...) ; DROP ; RENAME,
+    # all the tables in one transaction. The columns not in the record layout are
+    # kept as they are, before the ones of the record layout (as the previous
+    # per-column ADD/UPDATE/DROP/RENAME left them), and the rowids are kept.
+    if connection.in_transaction:
+        connection.commit()
+    cursor.execute("BEGIN")
+    try:
+        for table in get_tables(connection):
+            if table in ["subjects", INGESTION_STATE_TABLE, CODE_CLASSIFICATION_TABLE]:
+                # the subjects dictionary, ingestion state and code classification tables
+                # are created by slim_down_database with their final data types
+                continue
+            # the columns with the _new suffix are leftovers of an interrupted
+            # preprocessing (per column) and are not copied
+            column_names = [cn for cn in get_column_names(connection, table) if not cn.endswith("_new")]
+            column_types = dict(zip(get_column_names(connection, table), get_column_types(connection, table)))
+            layout = get_ja_database_layout(table)
+            for cn in column_names:
+                if cn not in layout:
+                    print(f"Table '{table}' has column '{cn}' with type '{column_types[cn]}' which is not in the record layout.\nRecord Layout:\n{layout}")
+            other_columns = [cn for cn in column_names if cn not in layout]
+            layout_columns = [cn for cn in column_names if cn in layout]
+            if len(layout_columns) == 0:
+                continue
+            definitions = [f"{cn} {column_types[cn]}".strip() for cn in other_columns] + [f"{cn} {layout[cn]}" for cn in layout_columns]
+            selections = other_columns + [f"CAST({cn} as {layout[cn]})" for cn in layout_columns]
+            indices = cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name='{table}' AND sql IS NOT NULL").fetchall()
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+            cursor.execute(f"CREATE TABLE {table}_new ({', '.join(definitions)})")
+            cursor.execute(f"""
+                INSERT INTO {table}_new (rowid, {', '.join(other_columns + layout_columns)})
+                SELECT rowid, {', '.join(selections)}
+                FROM {table}
+            """)
+            cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            n_statements += 5
+            for (index_sql,) in indices:
+                cursor.execute(index_sql)
+                n_statements += 1
+        # commit changes and close
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
     cursor.close()
-    # save the hash of the database file
-    write_to_slim_database_hash_file(hash_database_file(get_slim_database_filepath()))
-    print("Database preprocessed.")
+    # save the fingerprint of the database file
+    write_stage_manifest("data_types")
+    print(f"Database preprocessed ({n_statements} statements, {time.time() - t0:.1f} s).")
     # done
 
+DATETIME_COLUMNS_REQUIRED = {
+    "demographics": ["DT_BIRTH"],
+    "diagnoses": ["DATE_DIAG"],
+    "interventions": ["DT_INT"],
+    "pharma": ["DT_PRESCR"],
+    "physical_exams": ["DT_INT"]
+}
+DATETIME_COLUMNS_NOT_REQUIRED = {
+    "demographics": ["DT_DEATH", "DT_START_ASSIST", "DT_END_ASSIST"],
+    "diagnoses": ["DATE_DIAG_END", "DATE_ADMISSION", "DATE_DISCHARGE"],
+    "interventions": [],
+    "pharma": [],
+    "physical_exams": []
+}
+
+# Indices on the materialized year columns, used by the cohorts, age stratification
+# and indicator queries to filter/join events by (subject, year) without
+# parsing the date strings of every row, and on the code classes
+# (DISORDER_CLASS, DRUG_CLASS, see classification.py) to select the events by class
+YEAR_COLUMNS_INDICES = {
+    "idx_demographics_birth_year": ("demographics", ["DT_BIRTH_YEAR"]),
+    "idx_diagnoses_subject_year": ("diagnoses", ["ID_SUBJECT", "DATE_DIAG_YEAR"]),
+    "idx_interventions_subject_year": ("interventions", ["ID_SUBJECT", "DT_INT_YEAR"]),
+    "idx_interventions_year_type": ("interventions", ["DT_INT_YEAR", "TYPE_INT"]),
+    "idx_pharma_subject_year": ("pharma", ["ID_SUBJECT", "DT_PRESCR_YEAR"]),
+    "idx_diagnoses_class_subject_year": ("diagnoses", ["DISORDER_CLASS", "ID_SUBJECT", "DATE_DIAG_YEAR"]),
+    "idx_pharma_year_class": ("pharma", ["DT_PRESCR_YEAR", "DRUG_CLASS"]),
+    "idx_physical_exams_subject_year": ("physical_exams", ["ID_SUBJECT", "DT_INT_YEAR"])
+}
+
+def get_year_column_name(datetime_column: str) -> str:
+    """ Returns the name of the materialized INTEGER year column of a date column,
+    for example DT_PRESCR -> DT_PRESCR_YEAR.
+    """
+    return f"{datetime_column}_YEAR"
+
+def database_has_year_columns(connection: sqlite3.Connection) -> bool:
+    """ Returns True if all the required date columns of the database have their
+    materialized year column (see preprocess_database_datetimes).
+    """
+    for table, columns in DATETIME_COLUMNS_REQUIRED.items():
+        column_names = get_column_names(connection, table)
+        for column in columns:
+            if get_year_column_name(column) not in column_names:
+                return False
+    return True
+
+def get_normalized_date_expression(column: str) -> str:
+    """ SQL expression of the value of a date column in ISO 8601 ('YYYY-MM-DD'),
+    NULL if the format is not one of:
+    - ISO 8601 format: 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DD'
+    - YYMMDD10 format: 'YYYY/MM/DD'
+    - wrong YYMMDD10 formats: 'DD/MM/YYYY' or 'YYYYMMDD'
+    """
+    return f"""(
+        CASE
+            /* Shorten datetime to date */
+            WHEN ({column} GLOB '????-??-??*' AND LENGTH({column} > 10)) THEN substr({column},1,10)
+            /* Convert correct YYMMDD10 to ISO 8601 */
+            WHEN {column} GLOB '????/??/??*' THEN substr({column},1,4) ||'-'|| substr({column},6,2) ||'-'|| substr({column},9,2)
+            /* Convert wrong YYMMDD10 to ISO 8601 */
+            WHEN {column} GLOB '??/??/????*' THEN substr({column},7,4) ||'-'|| substr({column},4,2) ||'-'|| substr({column},1,2)
+            /* Convert YYYYMMDD to ISO 8601 (or DDMMYYYY but it will get it wrong) */
+            WHEN {column} GLOB '????????*' THEN substr({column},1,4) ||'-'|| substr({column},5,2) ||'-'|| substr({column},7,2)
+            /* 'YYMMDD' or 'YYMMDD10' cannot be addressed: how do you know if 19YY or 20YY? */
+            ELSE NULL
+        END
+    )"""
+
+def normalize_datetime_columns(connection: sqlite3.Connection, table: str, target_table: str|None=None) -> None:
+    """ Normalize the date columns of one of the ja database tables to ISO 8601 ('YYYY-MM-DD'),
+    fill the <COLUMN>_YEAR columns and delete the records missing a required date.
+    All the date columns of the table are done together, in two UPDATE statements. Does not commit.
+
+    table: str
+        The name of the table in the record layout (e.g. 'pharma').
+    target_table: str|None
+        The table to work on, if it is not the table itself: for example a temporary table
+        with the same columns holding only the records to be appended.
+    """
+    if target_table is None:
+        target_table = table
+    columns = [(c, True) for c in DATETIME_COLUMNS_REQUIRED[table]]
+    columns.extend([(c, False) for c in DATETIME_COLUMNS_NOT_REQUIRED[table]])
+    cursor = connection.cursor()
+    # the materialized year of the dates in their own integer columns
+    # (in the order of the record layout)
+    column_names = get_column_names(connection, target_table)
+    for column, _ in columns:
+        if get_year_column_name(column) not in column_names:
+            cursor.execute(f"ALTER TABLE {target_table} ADD COLUMN {get_year_column_name(column)} INTEGER")
+    # normalize all the date columns in one pass, then (after removing the records
+    # without a required date) fill the years from the normalized dates
+    # in a second pass (parsing each date once is faster than repeating the
+    # normalization expression in the same UPDATE)
+    cursor.execute(f"""
+        UPDATE {target_table}
+        SET {', '.join([f'{column} = {get_normalized_date_expression(column)}' for column, _ in columns])}
+    """)
+    # remove rows with NULL values in the required columns
+    required_columns = [c for c, required in columns if required]
+    if len(required_columns) > 0:
+        cursor.execute(f"""
+            DELETE FROM {target_table}
+            WHERE {' OR '.join([f'{c} IS NULL' for c in required_columns])}
+        """)
+    assignments = [f"{get_year_column_name(column)} = CAST(strftime('%Y', {column}) AS INTEGER)" for column, _ in columns]
+    cursor.execute(f"""
+        UPDATE {target_table}
+        SET {', '.join(assignments)}
+    """)
+    cursor.close()
+
 def preprocess_database_datetimes(connection: sqlite3.Connection, force: bool=False) -> None:
     """ Perform preprocessing on all the datetime columns of the ja dashboard database.
+
+    Every date column is normalized to ISO 8601 ('YYYY-MM-DD') and a companion
+    INTEGER column named <COLUMN>_YEAR is filled with the year of the date, so that
+    queries can compare years as integers (and use indices) instead of calling
+    strftime('%Y', ...) on each row. The date columns of each table are
+    normalized together, not one by one.
     
-    This runs only if force is True.
+    This runs only if force is True, if this stage did not complete on the current
+    ja database, or if the year columns are missing (database preprocessed by an older
+    version of the dashboard).
     """
-    if not force:
+    if not force and database_has_year_columns(connection) and is_stage_up_to_date("datetimes"):
         return
     print("Preprocessing date-time columns of the internal database...", end=" ")
-    DATETIME_COLUMNS_REQUIRED = {
-        "demographics": ["DT_BIRTH"],
-        "diagnoses": ["DATE_DIAG"],
-        "interventions": ["DT_INT"],
-        "pharma": ["DT_PRESCR"],
-        "physical_exams": ["DT_INT"]
-    }
-    DATETIME_COLUMNS_NOT_REQUIRED = {
-        "demographics": ["DT_DEATH", "DT_START_ASSIST", "DT_END_ASSIST"],
-        "diagnoses": ["DATE_DIAG_END", "DATE_ADMISSION", "DATE_DISCHARGE"],
-        "interventions": [],
-        "pharma": [],
-        "physical_exams": []
-    }
-    pairs = [(k, v, True) for k, v in DATETIME_COLUMNS_REQUIRED.items()]
-    pairs.extend([(k, v, False) for k, v in DATETIME_COLUMNS_NOT_REQUIRED.items()])
+    for table in DATETIME_COLUMNS_REQUIRED.keys():
+        normalize_datetime_columns(connection, table)
     cursor = connection.cursor()
-    for table, columns, required in pairs:
-        for column in columns:
-            # first, drop rows that are not compliant with either:
-            # - ISO 8601 format: 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DD'
-            # - YYMMDD10 format: 'YYYY/MM/DD'
-            # - wrong YYMMDD10 formats: 'DD/MM/YYYY' or 'YYMMDD' or 'YYMMDD10'
-            cursor.execute(f"""
-                UPDATE {table}
-                SET {column} = (
-                    CASE
-                        /* Shorten datetime to date */
-                        WHEN ({column} GLOB '????-??-??*' AND LENGTH({column} > 10)) THEN substr({column},1,10)
-                        /* Convert correct YYMMDD10 to ISO 8601 */
-                        WHEN {column} GLOB '????/??/??*' THEN substr({column},1,4) ||'-'|| substr({column},6,2) ||'-'|| substr({column},9,2)
-                        /* Convert wrong YYMMDD10 to ISO 8601 */
-                        WHEN {column} GLOB '??/??/????*' THEN substr({column},7,4) ||'-'|| substr({column},4,2) ||'-'|| substr({column},1,2)
-                        /* Convert YYYYMMDD to ISO 8601 (or DDMMYYYY but it will get it wrong) */
-                        WHEN {column} GLOB '????????*' THEN substr({column},1,4) ||'-'|| substr({column},5,2) ||'-'|| substr({column},7,2)
-                        /* 'YYMMDD' or 'YYMMDD10' cannot be addressed: how do you know if 19YY or 20YY? */
-                        ELSE NULL
-                    END
-                )
-            """)
-            # remove rows with NULL values in column
-            if required:
-                cursor.execute(f"""
-                    DELETE FROM {table}
-                    WHERE {column} IS NULL
-                """)
+    # index the year columns
+    for index_name, (table, columns) in YEAR_COLUMNS_INDICES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table}({', '.join(columns)})")
+    cursor.execute("ANALYZE")
     # commit changes and close
     connection.commit()
     cursor.close()
-    # save the hash of the database file
-    write_to_slim_database_hash_file(hash_database_file(get_slim_database_filepath()))
+    # save the fingerprint of the database file
+    write_stage_manifest("datetimes")
     print("done!")
 
+# Definition of the cohorts of each disorder (see add_cohorts_table):
+# - diagnoses: condition on the diagnoses table records that identify the disorder
+#              (the conditions of the different disorders must not overlap), on the
+#              DISORDER_CLASS of the records (see classification.py for the codes of each class)
+# - pharma: condition on the pharma table records that can anticipate the onset
+#           of the disorder in the washout years before the first diagnosis
+COHORTS_DEFINITIONS = {
+    "SCHIZO": {
+        # ICD9 295, 297, 2982, 2983, 2984, 2988, 2989 ; ICD10 F20-F25, F28, F29
+        "diagnoses": get_class_condition("diagnoses", ["SCHIZO"]),
+        # antipsycotics (N05A), lithium (N05AN) excluded
+        "pharma": get_class_condition("pharma", ["ANTIPSYCHOTIC"], alias="p")
+    },
+    "DEPRE": {
+        # ICD9 311, 2962, 2963, 2980, 3004, 3090, 3091 ; ICD10 F32, F33, F39, F341, F348, F349, F381, F388, F431, F432
+        "diagnoses": get_class_condition("diagnoses", ["DEPRE"]),
+        # antidepressants (N06A)
+        "pharma": get_class_condition("pharma", ["ANTIDEPRESSANT"], alias="p")
+    },
+    "BIPO": {
+        # ICD9 2960, 2961, 2964-2967, 2981, 29680, 29681, 29689, 29699 ; ICD10 F30, F31, F340, F380
+        "diagnoses": get_class_condition("diagnoses", ["BIPO"]),
+        # Bipolar has no contraints on the pharma, except it must be a mental health related pharma.
+        # Since pharma is already filtered for mental health, no need to filter further
+        "pharma": "1"
+    }
+}
+COHORTS_WASHOUT_YEARS: int = 3
+
+def fill_cohorts_table(cursor: sqlite3.Cursor, subjects_table: str|None=None) -> dict[str, float]:
+    """ (Re)create the cohorts table from the diagnoses, pharma and interventions tables
+    (see add_cohorts_table), without committing.
+    Returns the time in seconds taken by each step, for reporting.
+
+    subjects_table: str|None
+        If given, the name of a table with an ID_SUBJECT column: the cohorts table
+        is kept and only the rows of these subjects are computed anew.
+    """
+    if subjects_table is None:
+        # create the cohorts table
+        cursor.execute("DROP TABLE IF EXISTS cohorts")
+        cursor.execute("""
+            CREATE TABLE cohorts (
+                ID_SUBJECT INTEGER,
+                ID_DISORDER TEXT,
+                YEAR_OF_ONSET INTEGER /* Not the year of the diagnosis, but the year of the first doubt which is afterward confirmed by a diagnosis */
+            )
+        """)
+        subjects_condition = "1"
+    else:
+        cursor.execute(f"DELETE FROM cohorts WHERE ID_SUBJECT IN (SELECT ID_SUBJECT FROM {subjects_table})")
+        subjects_condition = f"ID_SUBJECT IN (SELECT ID_SUBJECT FROM {subjects_table})"
+    # tables needed for the calculations:
+    # - t_diagnoses: first year of a diagnosis of each disorder, for each subject
+    # - t_onset_events: first year of a related pharma prescription or intervention
+    #   in the washout window before (and including) the year of the first diagnosis
+    cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
+    cursor.execute("DROP TABLE IF EXISTS temp.t_onset_events")
+    cursor.execute("""
+        CREATE TEMP TABLE t_diagnoses (
+            ID_SUBJECT INTEGER,
+            ID_DISORDER TEXT,
+            MIN_YEAR INTEGER,
+            PRIMARY KEY (ID_SUBJECT, ID_DISORDER)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE TEMP TABLE t_onset_events (ID_SUBJECT INTEGER, ID_DISORDER TEXT, MIN_YEAR INTEGER)")
+    timings_ = {}
+    t_ = time.time()
+    # one pass over diagnoses: each record is assigned to (at most) one disorder
+    diagnoses_case = "CASE\n" + "\n".join([
+        f"WHEN {definition['diagnoses']} THEN '{disorder}'" for disorder, definition in COHORTS_DEFINITIONS.items()
+    ]) + "\nELSE NULL END"
+    cursor.execute(f"""
+        INSERT INTO t_diagnoses (ID_SUBJECT, ID_DISORDER, MIN_YEAR)
+        SELECT ID_SUBJECT, ID_DISORDER, MIN(DATE_DIAG_YEAR)
+        FROM (
+            SELECT ID_SUBJECT, ({diagnoses_case}) AS ID_DISORDER, DATE_DIAG_YEAR
+            FROM diagnoses
+            WHERE {subjects_condition}
+        )
+        WHERE ID_DISORDER IS NOT NULL
+        GROUP BY ID_SUBJECT, ID_DISORDER
+    """)
+    timings_["diagnoses"] = time.time() - t_
+    # one pass over pharma for all disorders: the prescription must be related to the disorder
+    # and fall in the washout window of the first diagnosis of that disorder
+    t_ = time.time()
+    pharma_condition = "(" + " OR ".join([
+        f"(d.ID_DISORDER = '{disorder}' AND {definition['pharma']})" for disorder, definition in COHORTS_DEFINITIONS.items()
+    ]) + ")"
+    cursor.execute(f"""
+        INSERT INTO t_onset_events (ID_SUBJECT, ID_DISORDER, MIN_YEAR)
+        SELECT d.ID_SUBJECT, d.ID_DISORDER, MIN(p.DT_PRESCR_YEAR)
+        FROM pharma p
+        JOIN t_diagnoses d ON d.ID_SUBJECT = p.ID_SUBJECT
+        WHERE
+            p.DT_PRESCR_YEAR - d.MIN_YEAR BETWEEN -{COHORTS_WASHOUT_YEARS} AND 0
+            AND
+            {pharma_condition}
+        GROUP BY d.ID_SUBJECT, d.ID_DISORDER
+    """)
+    timings_["pharma"] = time.time() - t_
+    # one pass over interventions for all disorders: any intervention in the washout window
+    t_ = time.time()
+    cursor.execute(f"""
+        INSERT INTO t_onset_events (ID_SUBJECT, ID_DISORDER, MIN_YEAR)
+        SELECT d.ID_SUBJECT, d.ID_DISORDER, MIN(i.DT_INT_YEAR)
+        FROM interventions i
+        JOIN t_diagnoses d ON d.ID_SUBJECT = i.ID_SUBJECT
+        WHERE
+            i.DT_INT_YEAR - d.MIN_YEAR BETWEEN -{COHORTS_WASHOUT_YEARS} AND 0
+        GROUP BY d.ID_SUBJECT, d.ID_DISORDER
+    """)
+    timings_["interventions"] = time.time() - t_
+    # the year of onset is the earliest between the first diagnosis and the
+    # first related pharma prescription or intervention in the washout window
+    t_ = time.time()
+    cursor.execute("""
+        INSERT INTO cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)
+        SELECT ID_SUBJECT, ID_DISORDER, MIN(MIN_YEAR)
+        FROM (
+            SELECT ID_SUBJECT, ID_DISORDER, MIN_YEAR FROM t_diagnoses
+            UNION ALL
+            SELECT ID_SUBJECT, ID_DISORDER, MIN_YEAR FROM t_onset_events
+        )
+        GROUP BY ID_SUBJECT, ID_DISORDER
+    """)
+    # delete the temporary tables
+    cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
+    cursor.execute("DROP TABLE IF EXISTS temp.t_onset_events")
+    # This table will be queried a lot since it will be used for stratification (read only from here on)
+    # so we need to create an index on ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET to speed up the process
+    if subjects_table is None:
+        cursor.execute("CREATE INDEX idx_cohorts ON cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)")
+    timings_["cohorts"] = time.time() - t_
+    return timings_
+
 def add_cohorts_table(connection: sqlite3.Connection, force: bool=False) -> None:
     """ Create the temporary cohorts table in the database.
 
@@ -1125,10 +1400,15 @@ def add_cohorts_table(connection: sqlite3.Connection, force: bool=False) -> None
         - "B", stands for PREVALENT
         - "C", stands for INCIDENT for age 18-25
 
+    The YEAR_OF_ONSET of a subject in a disorder cohort is the earliest year between
+    the first diagnosis of the disorder and the first related pharma prescription or
+    intervention in the COHORTS_WASHOUT_YEARS preceding it (see COHORTS_DEFINITIONS).
+    All disorders are computed together, with a single pass over each source table.
+
     cohorts is kept into the jasqlite3 database as a table.
     Use force=True if any previous preprocessing has happened.
-    This function will do its job only if the cohorts table is not found in the database
-    or if force is True.
+    This function will do its job only if the cohorts table is not found in the database,
+    if this stage did not complete on the current ja database, or if force is True.
 
     connection: sqlite3.Connection
         The connection to the database.
@@ -1145,327 +1425,23 @@ def add_cohorts_table(connection: sqlite3.Connection, force: bool=False) -> None
         raise ValueError(f"The database is missing the following tables: {missing_tables}")
     # check if the process has to run or not
     has_cohorts_table = "cohorts" in get_tables(connection)
-    if has_cohorts_table and not force:
+    if has_cohorts_table and not force and is_stage_up_to_date("cohorts"):
         return
     print("Creating the cohorts table...", end=" ")
     # logic
     cursor = connection.cursor()
-    WASHOUT_YEARS: int = 3
-    # create the cohorts table
-    cursor.execute("DROP TABLE IF EXISTS cohorts")
-    cursor.execute("""
-        CREATE TABLE cohorts (
-            ID_SUBJECT TEXT,
-            ID_DISORDER TEXT,
-            YEAR_OF_ONSET INTEGER /* Not the year of the diagnosis, but the year of the first doubt which is afterward confirmed by a diagnosis */
-        )
-    """)
-    # create the three temporary tables that are needed for there calculations
-    def create_temp_tables(cursor: sqlite3.Cursor) -> None:
-        # clear the temporary tables if they exist and recreate them
-        cursor.execute("DROP TABLE IF EXISTS temp.t_pharma")
-        cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
-        cursor.execute("DROP TABLE IF EXISTS temp.t_interventions")
-        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS t_pharma (ID_SUBJECT TEXT, MIN_YEAR INTEGER)")
-        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS t_diagnoses (ID_SUBJECT TEXT, MIN_YEAR INTEGER)")
-        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS t_interventions (ID_SUBJECT TEXT, MIN_YEAR INTEGER)")
-        cursor.execute("DELETE FROM t_pharma")
-        cursor.execute("DELETE FROM t_diagnoses")
-        cursor.execute("DELETE FROM t_interventions")
-    # Print out an estimation of the time it will take to process the data
-    n_diagnoses = get_table_num_rows(connection, "diagnoses")
-    entries_per_second_diagnoses = 111500.0
-    n_pharma = get_table_num_rows(connection, "pharma")
-    entries_per_second_pharma = 29500.0
-    n_interventions = get_table_num_rows(connection, "interventions")
-    entries_per_second_interventions = 7600.0
-    overhead_seconds = 10.0
-    tot_seconds = n_diagnoses/entries_per_second_diagnoses + n_pharma/entries_per_second_pharma + n_interventions/entries_per_second_interventions + overhead_seconds
-    tot_seconds *= 3 # three mental disorders considered
-    hours, minutes, seconds = tot_seconds//3600, (tot_seconds//60)%60, tot_seconds%60
-    print(f"Estimated time: {hours:.0f}h {minutes:.0f}m {seconds:.0f}s")
     t0_ = time.time()
-    # #######
-    # SCHIZO
-    # #######
-    create_temp_tables(cursor)
-    cursor.execute("""
-        INSERT INTO t_diagnoses (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DATE_DIAG) AS INTEGER))
-        FROM diagnoses
-        WHERE
-            (
-                (
-                    CODING_SYSTEM = 'ICD9'
-                    AND
-                    (
-                        substr(DIAGNOSIS,1,3) IN ('295', '297')
-                        OR
-                        substr(DIAGNOSIS,1,4) IN ('2982', '2983', '2984', '2988', '2989')
-                    )
-                )
-                OR
-                (
-                    CODING_SYSTEM = 'ICD10'
-                    AND
-                    (   
-                        substr(DIAGNOSIS,1,3) IN ('F20', 'F21', 'F22', 'F23', 'F24', 'F25', 'F28', 'F29')
-                    )
-                )
-            )
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_pharma (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_PRESCR) AS INTEGER))
-        FROM pharma    
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            AND
-            ATC_CHAR LIKE 'N05A%' AND ATC_CHAR NOT LIKE 'N05AN%'
-            AND
-            CAST(strftime('%Y', DT_PRESCR) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = pharma.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_interventions (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_INT) AS INTEGER))
-        FROM interventions
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            AND
-            CAST(strftime('%Y', DT_INT) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = interventions.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute("""
-        INSERT INTO cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)
-        SELECT 
-            ID_SUBJECT, 
-            'SCHIZO', 
-            MIN_YEAR
-        FROM t_diagnoses
-        /* by selecting from this table, I know that the subject was diagnosed */
-        /* I can use this to select the subjects that have a record of pharma or interventions */
-        /* before the diagnosis but after the year of diagnosis - WASHOUT_YEARS */
-    """)
-    cursor.execute(f"""
-        UPDATE cohorts
-        SET YEAR_OF_ONSET = (
-            /*
-            If i'm setting, it means that one of the two conditions in the WHERE is true:
-            So I can take the minimum of MIN_YEAR between the two tables that lies in the previous 3 years inclusive
-            as the new YEAR_OF_ONSET.
-            It is possible that the subjects in diagnosis have no record in pharma or interventions.
-            */
-            SELECT MIN(MIN_YEAR)
-            FROM (
-                SELECT MIN_YEAR FROM (SELECT YEAR_OF_ONSET AS MIN_YEAR FROM cohorts WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_pharma WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_interventions WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-            )
-        )
-        WHERE
-            ID_DISORDER = 'SCHIZO'
-            AND
-            ID_SUBJECT IN (
-                SELECT ID_SUBJECT FROM t_pharma
-                UNION
-                SELECT ID_SUBJECT FROM t_interventions
-                )
-    """)
-    ########
-    # DEPRE
-    ########
-    create_temp_tables(cursor)
-    cursor.execute("""
-        INSERT INTO t_diagnoses (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DATE_DIAG) AS INTEGER))
-        FROM diagnoses
-        WHERE
-            (
-                (
-                    CODING_SYSTEM = 'ICD9'
-                    AND
-                    (
-                        substr(DIAGNOSIS,1,3) IN ('311')
-                        OR
-                        substr(DIAGNOSIS,1,4) IN ('2962', '2963', '2980', '3004', '3090', '3091')
-                    )
-                )
-                OR
-                (
-                    CODING_SYSTEM = 'ICD10'
-                    AND
-                    (   
-                        substr(DIAGNOSIS,1,3) IN ('F32', 'F33', 'F39')
-                        OR
-                        substr(DIAGNOSIS,1,4) IN ('F341', 'F348', 'F349', 'F381', 'F388', 'F431', 'F432')
-                    )
-                )
-            )
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_pharma (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_PRESCR) AS INTEGER))
-        FROM pharma    
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            AND
-            ATC_CHAR LIKE 'N06A%'
-            AND
-            CAST(strftime('%Y', DT_PRESCR) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = pharma.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_interventions (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_INT) AS INTEGER))
-        FROM interventions
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            AND
-            CAST(strftime('%Y', DT_INT) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = interventions.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute("""
-        INSERT INTO cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)
-        SELECT 
-            ID_SUBJECT, 
-            'DEPRE', 
-            MIN_YEAR
-        FROM t_diagnoses
-    """)
-    cursor.execute(f"""
-        UPDATE cohorts
-        SET YEAR_OF_ONSET = (
-            SELECT MIN(MIN_YEAR)
-            FROM (
-                SELECT MIN_YEAR FROM (SELECT YEAR_OF_ONSET AS MIN_YEAR FROM cohorts WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_pharma WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_interventions WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-            )
-        )
-        WHERE
-            ID_DISORDER = 'DEPRE'
-            AND
-            ID_SUBJECT IN (
-                SELECT ID_SUBJECT FROM t_pharma
-                UNION
-                SELECT ID_SUBJECT FROM t_interventions
-                )
-    """)
-    # BIPOLAR
-    create_temp_tables(cursor)
-    cursor.execute("""
-        INSERT INTO t_diagnoses (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DATE_DIAG) AS INTEGER))
-        FROM diagnoses
-        WHERE
-            (
-                (
-                    CODING_SYSTEM = 'ICD9'
-                    AND
-                    (
-                        substr(DIAGNOSIS,1,4) IN ('2960', '2961', '2964', '2965', '2966', '2967', '2981')
-                        OR
-                        substr(DIAGNOSIS,1,5) IN ('29680', '29681', '29689', '29699')
-                    )
-                )
-                OR
-                (
-                    CODING_SYSTEM = 'ICD10'
-                    AND
-                    (   
-                        substr(DIAGNOSIS,1,3) IN ('F30', 'F31')
-                        OR
-                        substr(DIAGNOSIS,1,4) IN ('F340', 'F380')
-                    )
-                )
-            )
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_pharma (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_PRESCR) AS INTEGER))
-        FROM pharma    
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            /*Bipolar has no contraints on the pharma, except it must be a mental health related pharma */
-            /* Since pahrma is already filtered for mental health, no need to filter further */
-            AND
-            CAST(strftime('%Y', DT_PRESCR) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = pharma.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute(f"""
-        INSERT INTO t_interventions (ID_SUBJECT, MIN_YEAR)
-        SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_INT) AS INTEGER))
-        FROM interventions
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses) /* for some reason, way faster than using INNER JOIN */
-            AND
-            CAST(strftime('%Y', DT_INT) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = interventions.ID_SUBJECT LIMIT 1)
-                BETWEEN -{WASHOUT_YEARS} AND 0
-        GROUP BY ID_SUBJECT
-    """)
-    cursor.execute("""
-        INSERT INTO cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)
-        SELECT 
-            ID_SUBJECT, 
-            'BIPO', 
-            MIN_YEAR
-        FROM t_diagnoses
-    """)
-    cursor.execute(f"""
-        UPDATE cohorts
-        SET YEAR_OF_ONSET = (
-            SELECT MIN(MIN_YEAR)
-            FROM (
-                SELECT MIN_YEAR FROM (SELECT YEAR_OF_ONSET AS MIN_YEAR FROM cohorts WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_pharma WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-                UNION
-                SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_interventions WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
-            )
-        )
-        WHERE
-            ID_DISORDER = 'BIPO'
-            AND
-            ID_SUBJECT IN (
-                SELECT ID_SUBJECT FROM t_pharma
-                UNION
-                SELECT ID_SUBJECT FROM t_interventions
-                )
-    """)
-    # delete the temporary tables
-    cursor.execute("DROP TABLE IF EXISTS temp.t_pharma")
-    cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
-    cursor.execute("DROP TABLE IF EXISTS temp.t_interventions")
-    # This table will be queried a lot since it will be used for stratification (read only from here on)
-    # so we need to create an index on ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET to speed up the process
-    cursor.execute("CREATE INDEX idx_cohorts ON cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)")
+    timings_ = fill_cohorts_table(cursor)
     # commit changes and close
     connection.commit()
     cursor.close()
-    # hash and save hash
-    write_to_slim_database_hash_file(
-        hash_database_file(
-            get_slim_database_filepath()
-        )
-    )
+    # save the fingerprint of the database file
+    write_stage_manifest("cohorts")
     t1_ = time.time()
     h_ = int((t1_ - t0_)//3600)
     m_ = int((t1_ - t0_)//60 - h_*60)
     s_ = int((t1_ - t0_)%60)
-    print(f"done! (took {h_}h {m_}m {s_}s)")
+    print(f"done! (took {h_}h {m_}m {s_}s: " + ", ".join([f"{k} {v:.2f}s" for k, v in timings_.items()]) + ")")
 
 def get_all_years_of_inclusion(connection: sqlite3.Connection) -> list[int]:
     m, l = check_database_has_tables(connection, cohorts_required=True)
@@ -1479,41 +1455,82 @@ def get_all_years_of_inclusion(connection: sqlite3.Connection) -> list[int]:
     cursor.close()
     return years_of_inclusion
 
-def get_age_stratification_column(year_of_inclusion: int, ages: tuple[int, int]) -> str:
-    """ Return the name of the column in the age stratification table.
-    The column name is constructed as follows:
-    ast_<year_of_inclusion_yyyy>_<age_start>_<age_end>, for example 'ast_2010_18_65'.
-    
-    Input ages must be a tuple of two integers, the first one being the start of the age interval
-    and the second one being the end of the age interval.
+# age interval (inclusive) of the incident_18_25 cohort
+INCIDENT_18_25_AGE_INTERVAL = (18, 25)
+
+def get_age_stratification_condition(age_intervals: list[tuple[int, int]], age_column: str="AGE") -> str:
+    """ Return the SQL condition that selects, in the age_stratification table,
+    the rows whose age falls into any of the age intervals.
+
+    Input ages must be a list of tuples of two integers, the first one being the start of the age interval
+    and the second one being the end of the age interval (both inclusive).
     """
-    return f"ast_{year_of_inclusion}_{ages[0]}_{ages[1]}"
+    return "(" + " OR ".join([f"{age_column} BETWEEN {int(a)} AND {int(b)}" for a, b in age_intervals]) + ")"
 
-def get_age_stratification_column_all(year_of_inclusion_list: list[int], age_intervals: list[tuple[int, int]]) -> list[str]:
-    """ Return a list of all the column names for the age stratification table.
-    The column names are constructed as follows:
-    ast_<year_of_inclusion_yyyy>_<age_start>_<age_end>, for example 'ast_2010_18_65'.
-    
-    Input ages must be a tuple of two integers, the first one being the start of the age interval
-    and the second one being the end of the age interval.
+def fill_age_stratification_table(cursor: sqlite3.Cursor, year_of_inclusions_list: list[int], age_stratifications: list[tuple[int, int]], subjects_table: str|None=None) -> None:
+    """ Fill the (existing) age_stratification table, see make_age_startification_tables.
+    Does not commit.
+
+    subjects_table: str|None
+        If given, the name of a table with an ID_SUBJECT column: only the rows
+        of these subjects are computed anew.
     """
-    return [get_age_stratification_column(yoi, ai) for yoi in year_of_inclusion_list for ai in age_intervals] + [f"incident_18_25_{yoi}" for yoi in year_of_inclusion_list]
+    if subjects_table is None:
+        subjects_condition = "1"
+    else:
+        cursor.execute(f"DELETE FROM age_stratification WHERE ID_SUBJECT IN (SELECT ID_SUBJECT FROM {subjects_table})")
+        subjects_condition = f"d.ID_SUBJECT IN (SELECT ID_SUBJECT FROM {subjects_table})"
+    if len(year_of_inclusions_list) > 0:
+        years_values_string = ", ".join([f"({y})" for y in year_of_inclusions_list])
+        age_condition_string = get_age_stratification_condition(
+            list(age_stratifications) + [INCIDENT_18_25_AGE_INTERVAL],
+            age_column="(y.YEAR_OF_INCLUSION - d.DT_BIRTH_YEAR)"
+        )
+        cursor.execute(f"""
+            WITH years(YEAR_OF_INCLUSION) AS (VALUES {years_values_string})
+            INSERT OR IGNORE INTO age_stratification (ID_SUBJECT, YEAR_OF_INCLUSION, AGE)
+            SELECT
+                d.ID_SUBJECT,
+                y.YEAR_OF_INCLUSION,
+                y.YEAR_OF_INCLUSION - d.DT_BIRTH_YEAR
+            FROM demographics d, years y
+            WHERE
+                /* at the year of inclusion, the patient must be alive (birth < yoi, death > yoi or null)*/
+                /* at the year of inclusion, the patient must fall into one of the inclusive age ranges */
+                {age_condition_string}
+                AND
+                (
+                    (d.DT_DEATH_YEAR > y.YEAR_OF_INCLUSION)
+                    OR
+                    (d.DT_DEATH IS NULL)
+                )
+                /* Also, since I will work only with the subjects that appear in COHORTS, I can filter out the rest 
+                   When cohorts will consider every possible mental disorter, this condition will no nothing.
+                   Else, it will filter out the subjects that do not have a record in the cohort table.
+                */
+                AND
+                d.ID_SUBJECT IN (SELECT DISTINCT ID_SUBJECT FROM cohorts)
+                AND
+                {subjects_condition}
+        """)
 
 def make_age_startification_tables(connection: sqlite3.Connection, year_of_inclusions_list: list[int]|None=None, age_stratifications: dict[str:tuple]|None=None, force: bool=True):
     """ Age of all patients in demographics is computed with respect to each year of inclusion.
         By convention, the age is computed as the difference between the year of inclusion and the year of birth,
         not accounting for the month and day of birth.
 
-        The created tables are stored permanentrly in the ja database in table 'age_stratification'.
-        The process runs only if force is True, which means that the tables are created anew.
-        Each table has num_unique_ID_SUBJECT_in_demographics rows and num_age_intervals columns,
-        and columns are named following the convention 'ast_<year_of_inclusion_yyyy>_<age_start>_<age_end>'.
-        Both age_start and age_end are inclusive.
-        Each column is of type TEXT and holds either ID_SUBJECT data or NULL.
-
-        This function additionally creates len(year_of_inclusions_list) tables for subjects located in the 18-25 years old inclusive
-        to make stratification faster at runtime when the incident_18_25 cohort is concerned.
-        These are named: incident_18_25_"+str(yoi).
+        The created table is stored permanentrly in the ja database in table 'age_stratification'.
+        The process runs only if force is True, which means that the table is created anew.
+        The table has the following columns:
+            ID_SUBJECT INTEGER
+            YEAR_OF_INCLUSION INTEGER
+            AGE INTEGER
+        and holds one row for every patient that, at the year of inclusion, is alive, appears in the cohorts table
+        and whose age falls into one of the age stratification intervals or into the 18-25 interval
+        (used by the incident_18_25 cohort).
+        A stratification is then a query such as:
+            SELECT ID_SUBJECT FROM age_stratification WHERE YEAR_OF_INCLUSION = 2015 AND AGE BETWEEN 18 AND 25
+        which is answered by the primary key index (YEAR_OF_INCLUSION, AGE, ID_SUBJECT).
 
         Inputs:
         - connection: sqlite3.Connection
@@ -1557,113 +1574,31 @@ def make_age_startification_tables(connection: sqlite3.Connection, year_of_inclu
                 raise ValueError(f"year_of_inclusions_list must be in the past, {y} is in the future.")
     tables = get_all_tables(connection)
     if not force:
-        if "age_stratification" in tables:
+        # databases created by older versions have a wide age_stratification table
+        # (one column per year of inclusion and age interval): rebuild it
+        if "age_stratification" in tables and "YEAR_OF_INCLUSION" in get_column_names(connection, "age_stratification") \
+            and is_stage_up_to_date("age_stratification"):
             return
     print("Creating age stratification tables...", end=" ")
     # logic
     cursor = connection.cursor()
-    # each columns in the table is filled with the ID_SUBJECT of the patients that satisfy the conditions
-    # since the number of rows is the same for all columns, if a column has less rows than the others, it
-    # will be filled with null values.
-    table_columns = get_age_stratification_column_all(year_of_inclusions_list, age_stratifications)
-    table_num_rows = int(cursor.execute("SELECT COUNT(DISTINCT ID_SUBJECT) FROM demographics").fetchone()[0])
     # create the new table (discard old one if it exists)
     cursor.execute("DROP TABLE IF EXISTS age_stratification")
-    table_creation_string = ", ".join([f"{col} TEXT DEFAULT NULL" for col in table_columns])
-    cursor.execute(f"CREATE TABLE age_stratification ({table_creation_string})")
-    # fill the tables
-    # first fill table with NULL values for as many rows as there are in demographics' DISTINCT ID_SUBJECT
-    for _ in range(table_num_rows):
-        cursor.execute(f"""INSERT INTO age_stratification DEFAULT VALUES""")
-    # to update the table, we need a temporary table where to store the unique, sorted ID_SUBJECT
-    cursor.execute("CREATE TEMP TABLE buffer(ID_SUBJECT TEXT)")
-    for yoi in year_of_inclusions_list:
-        for ys, ye in age_stratifications:
-            column_name = get_age_stratification_column(yoi, (ys, ye))
-            # fill the temp table with the ID_SUBJECT of patients that satisfy the conditions
-            cursor.execute("DELETE FROM buffer")
-            cursor.execute(f"""
-                INSERT INTO buffer
-                SELECT DISTINCT ID_SUBJECT
-                FROM demographics
-                WHERE
-                    (
-                        /* at the year of inclusion, the patient must be alive (birth < yoi, death > yoi or null)*/
-                        /* at the year of inclusion, the patient must fall into the inclusive age range */
-                        ({yoi} - CAST(strftime('%Y', DT_BIRTH) as INT) BETWEEN {ys} AND {ye})
-                        AND
-                        (
-                            (CAST(strftime('%Y', DT_DEATH) as INT) > {yoi})
-                            OR
-                            (DT_DEATH IS NULL)
-                        )
-                        /* Also, since I will work only with the subjects that appear in COHORTS, I can filter out the rest 
-                           When cohorts will consider every possible mental disorter, this condition will no nothing.
-                           Else, it will filter out the subjects that do not have a record in the cohort table.
-                        */
-                        AND
-                        ID_SUBJECT IN (SELECT DISTINCT ID_SUBJECT FROM cohorts)
-                    )
-                ORDER BY ID_SUBJECT
-            """)
-            # update the age_stratification table
-            len_buffer = cursor.execute("SELECT COUNT(*) FROM buffer").fetchone()[0]
-            if len_buffer > 0:
-                cursor.execute(f"""
-                    UPDATE age_stratification SET {column_name} = (
-                        SELECT ID_SUBJECT
-                        FROM buffer
-                        WHERE rowid = age_stratification.rowid
-                    )
-                """)
-        # for that year of inclusion, we also need to create a table for the 18-25 years old
-        column_name = "incident_18_25_"+str(yoi)
-        cursor.execute("DELETE FROM buffer")
-        cursor.execute(f"""
-            INSERT INTO buffer
-            SELECT DISTINCT ID_SUBJECT
-            FROM demographics
-            WHERE
-                (
-                    /* at the year of inclusion, the patient must be alive (birth < yoi, death > yoi or null)*/
-                    /* at the year of inclusion, the patient must fall into the inclusive age range */
-                    ({yoi} - CAST(strftime('%Y', DT_BIRTH) as INT) BETWEEN 18 AND 25)
-                    AND
-                    (
-                        (CAST(strftime('%Y', DT_DEATH) as INT) > {yoi})
-                        OR
-                        (DT_DEATH IS NULL)
-                    )
-                    /* Also, since I will work only with the subjects that appear in COHORTS, I can filter out the rest
-                       When cohorts will consider every possible mental disorter, this condition will no nothing.
-                       Else, it will filter out the subjects that do not have a record in the cohort table.
-                    */
-                    AND
-                    ID_SUBJECT IN (SELECT DISTINCT ID_SUBJECT FROM cohorts)
-                )
-            ORDER BY ID_SUBJECT
-        """)
-        len_buffer = cursor.execute("SELECT COUNT(*) FROM buffer").fetchone()[0]
-        if len_buffer > 0:
-            cursor.execute(f"""
-                UPDATE age_stratification SET {column_name} = (
-                    SELECT ID_SUBJECT
-                    FROM buffer
-                    WHERE rowid = age_stratification.rowid
-                )
-            """)
-    # get rid of the temporary table
-    cursor.execute("DROP TABLE IF EXISTS buffer")
-    cursor.execute("DROP TABLE IF EXISTS temp.buffer")
+    cursor.execute("""
+        CREATE TABLE age_stratification (
+            ID_SUBJECT INTEGER,
+            YEAR_OF_INCLUSION INTEGER,
+            AGE INTEGER,
+            PRIMARY KEY (YEAR_OF_INCLUSION, AGE, ID_SUBJECT)
+        ) WITHOUT ROWID
+    """)
+    # fill the table in a single pass over demographics for all years of inclusion
+    fill_age_stratification_table(cursor, year_of_inclusions_list, age_stratifications)
     # commit changes and close
     connection.commit()
     cursor.close()
-    # hash and save hash
-    write_to_slim_database_hash_file(
-        hash_database_file(
-            get_slim_database_filepath()
-        )
-    )
+    # save the fingerprint of the database file
+    write_stage_manifest("age_stratification")
     print("done!")
 
 ##########################################
@@ -1671,12 +1606,64 @@ def make_age_startification_tables(connection: sqlite3.Connection, year_of_inclu
 # which will be imported from other files
 ##########################################
 
-from ..indicator.widget import AGE_WIDGET_INTERVALS
+from ..indicator.widget_texts import AGE_WIDGET_INTERVALS
+
+def get_demographics_selector_string(gender: str, civil_status: str, job_condition: str, educational_level: str) -> str:
+    """ Return the SQL condition (to be used in a WHERE clause on the demographics table)
+    that selects the patients satisfying the gender, civil status, job condition
+    and educational level stratification.
+    Inputs are expected to be already validated (see stratify_demographics for the allowed values).
+    """
+    if gender == "A":
+        gender_selector_statement = "1"
+    elif gender == "A-U":
+        gender_selector_statement = f"GENDER IS NOT NULL"
+    elif gender == "U":
+        gender_selector_statement = f"GENDER IS NULL"
+    else:
+        gender_selector_statement = f"GENDER = '{str(gender)}'"
+    if civil_status == "All":
+        civil_status_selector_statement = "1"
+    elif civil_status == "All-Other":
+        civil_status_selector_statement = f"(CIVIL_STATUS != 'Other' AND CIVIL_STATUS IS NOT NULL)"
+    else:
+        civil_status_selector_statement = f"CIVIL_STATUS = '{civil_status}'"
+    if job_condition == "All":
+        job_condition_selector_statement = "1"
+    elif job_condition == "All-Unknown":
+        job_condition_selector_statement = f"JOB_COND IS NOT NULL"
+    elif job_condition == "Unknown":
+        job_condition_selector_statement = f"JOB_COND IS NULL"
+    else:
+        job_condition_selector_statement = f"JOB_COND = '{job_condition}'"
+    if educational_level == "All":
+        educational_level_selector_statement = "1"
+    elif educational_level == "All-Unknown":
+        educational_level_selector_statement = f"(EDU_LEVEL IS NOT NULL AND EDU_LEVEL != 9)"
+    elif educational_level == "Unknown" or educational_level == "9":
+        # 9 is the ISCED level for Unknown
+        educational_level_selector_statement = f"(EDU_LEVEL IS NULL OR EDU_LEVEL = 9)"
+    else:
+        try:
+            edu_level_int = int(educational_level)
+        except ValueError:
+            edu_level_int = 9
+            print(f"WARNING: {educational_level} is not a valid educational level. Using 9 (Unknown) instead.")
+        educational_level_selector_statement = f"EDU_LEVEL = {edu_level_int}"
+    return f"""
+        {gender_selector_statement}
+        AND
+        {civil_status_selector_statement}
+        AND
+        {job_condition_selector_statement}
+        AND
+        {educational_level_selector_statement}
+    """
 
 def stratify_demographics(connection: sqlite3.Connection, **kwargs) -> str:
     """ Given the internal ja database, stratify the patients according to the kwargs parameters.
     This function outputs a string, that is the name of the temporary table that stores the IDs of the patients that satisfy the conditions.
-    The temporary table only has the column ID_SUBJECT of type TEXT.
+    The temporary table only has the column ID_SUBJECT of type INTEGER (see the subjects table for the original IDs).
 
     The returned table name will be in the format 'temp.<table_timestamp_name>'.
 
@@ -1748,50 +1735,19 @@ def stratify_demographics(connection: sqlite3.Connection, **kwargs) -> str:
     # create the table of stratified patients ids
     time_string = datetime.datetime.now().strftime("%H%M%S%f")
     table_name = "stratified_patients_" + time_string
-    selection_string_from_age_startification_table = " UNION ".join(
-        [
-            f"""SELECT {get_age_stratification_column(year_of_inclusion, age_tuple)} AS ID_SUBJECT
-            FROM age_stratification
-            WHERE {get_age_stratification_column(year_of_inclusion, age_tuple)} IS NOT NULL"""
-            for age_tuple in age_intervals_list
-        ] 
+    selection_string_from_age_startification_table = f"""
+        SELECT ID_SUBJECT FROM age_stratification
+        WHERE
+            YEAR_OF_INCLUSION = {year_of_inclusion}
+            AND
+            {get_age_stratification_condition(age_intervals_list)}
+    """
+    demographics_selector_statement = get_demographics_selector_string(
+        gender=gender,
+        civil_status=civil_status,
+        job_condition=job_condition,
+        educational_level=educational_level
     )
-    if gender == "A":
-        gender_selector_statement = "1"
-    elif gender == "A-U":
-        gender_selector_statement = f"GENDER IS NOT NULL"
-    elif gender == "U":
-        gender_selector_statement = f"GENDER IS NULL"
-    else:
-        gender_selector_statement = f"GENDER = '{str(gender)}'"
-    if civil_status == "All":
-        civil_status_selector_statement = "1"
-    elif civil_status == "All-Other":
-        civil_status_selector_statement = f"(CIVIL_STATUS != 'Other' AND CIVIL_STATUS IS NOT NULL)"
-    else:
-        civil_status_selector_statement = f"CIVIL_STATUS = '{civil_status}'"
-    if job_condition == "All":
-        job_condition_selector_statement = "1"
-    elif job_condition == "All-Unknown":
-        job_condition_selector_statement = f"JOB_COND IS NOT NULL"
-    elif job_condition == "Unknown":
-        job_condition_selector_statement = f"JOB_COND IS NULL"
-    else:
-        job_condition_selector_statement = f"JOB_COND = '{job_condition}'"
-    if educational_level == "All":
-        educational_level_selector_statement = "1"
-    elif educational_level == "All-Unknown":
-        educational_level_selector_statement = f"(EDU_LEVEL IS NOT NULL AND EDU_LEVEL != 9)"
-    elif educational_level == "Unknown" or educational_level == "9":
-        # 9 is the ISCED level for Unknown
-        educational_level_selector_statement = f"(EDU_LEVEL IS NULL OR EDU_LEVEL = 9)"
-    else:
-        try:
-            edu_level_int = int(educational_level)
-        except ValueError:
-            edu_level_int = 9
-            print(f"WARNING: {educational_level} is not a valid educational level. Using 9 (Unknown) instead.")
-        educational_level_selector_statement = f"EDU_LEVEL = {edu_level_int}"
     # database query
     cursor.execute(f"DROP TABLE IF EXISTS temp.{table_name};")
     cursor.execute(f"""
@@ -1802,13 +1758,7 @@ def stratify_demographics(connection: sqlite3.Connection, **kwargs) -> str:
             ID_SUBJECT IN ({selection_string_from_age_startification_table})
             AND
             /* ID_SUBJECT must satisfy the other conditions on gender, civil status, job condition, educational level */
-            {gender_selector_statement}
-            AND
-            {civil_status_selector_statement}
-            AND
-            {job_condition_selector_statement}
-            AND
-            {educational_level_selector_statement}
+            {demographics_selector_statement}
     """)
     # do not commit, the table is temporary, don't want this table to be persistent
     cursor.close()
@@ -0,0 +1,289 @@
+"""
+Regression and timing check of the cohorts table builder.
+
+The cohorts table used to be built one disorder at a time, with correlated
+subqueries on each pharma and interventions record and a correlated UPDATE for
+the year of onset, selecting the records by their ICD9/ICD10 and ATC codes
+(legacy_fill_cohorts_table below, with the code conditions of that version copied as they were).
+It is now built by database.fill_cohorts_table, with a single pass on each source table,
+selecting the records by their disorder and drug classes (see database.classification).
+
+Note: the legacy UPDATE contains a shadowed subquery
+    SELECT YEAR_OF_ONSET AS MIN_YEAR FROM cohorts WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1
+in which both ID_SUBJECT refer to the inner cohorts table, so it returns the year of
+onset of the first row of the table instead of the one of the subject being updated.
+When that year is earlier than the subject's pharma/interventions years, the subject
+gets a wrong (too early) year of onset. The legacy builder is therefore compared both
+as it was (differences are reported) and with the subquery correlated to the subject
+being updated, which must give identical results.
+
+By default the check runs on a small synthetic database (see database.synthetic), generated
+and preprocessed by the dashboard pipeline in a temporary folder (with its own cache folder,
+the cache of the dashboard is not touched). It exits with status 1 on a regression.
+
+Usage (from the repository root):
+python -m ja_implemental_dashboard.v2.database.example.cohorts_regression [n_subjects] [seed]
+python -m ja_implemental_dashboard.v2.database.example.cohorts_regression path/to/database.jasqlite3
+"""
+
+import os, sys, time
+import shutil
+import sqlite3
+import tempfile
+
+from ...caching.caching import CACHE_FOLDER_ENVIRONMENT_VARIABLE
+from ..database import COHORTS_WASHOUT_YEARS, fill_cohorts_table
+
+# The conditions on the codes of the diagnoses and pharma records of each disorder
+# in the legacy builder, as they were.
+LEGACY_COHORTS_CODE_CONDITIONS = {
+    "SCHIZO": {
+        "diagnoses": """
+            (
+                (
+                    CODING_SYSTEM = 'ICD9'
+                    AND
+                    (
+                        substr(DIAGNOSIS,1,3) IN ('295', '297')
+                        OR
+                        substr(DIAGNOSIS,1,4) IN ('2982', '2983', '2984', '2988', '2989')
+                    )
+                )
+                OR
+                (
+                    CODING_SYSTEM = 'ICD10'
+                    AND
+                    (   
+                        substr(DIAGNOSIS,1,3) IN ('F20', 'F21', 'F22', 'F23', 'F24', 'F25', 'F28', 'F29')
+                    )
+                )
+            )
+        """,
+        "pharma": "ATC_CHAR LIKE 'N05A%' AND ATC_CHAR NOT LIKE 'N05AN%'",
+    },
+    "DEPRE": {
+        "diagnoses": """
+            (
+                (
+                    CODING_SYSTEM = 'ICD9'
+                    AND
+                    (
+                        substr(DIAGNOSIS,1,3) IN ('311')
+                        OR
+                        substr(DIAGNOSIS,1,4) IN ('2962', '2963', '2980', '3004', '3090', '3091')
+                    )
+                )
+                OR
+                (
+                    CODING_SYSTEM = 'ICD10'
+                    AND
+                    (   
+                        substr(DIAGNOSIS,1,3) IN ('F32', 'F33', 'F39')
+                        OR
+                        substr(DIAGNOSIS,1,4) IN ('F341', 'F348', 'F349', 'F381', 'F388', 'F431', 'F432')
+                    )
+                )
+            )
+        """,
+        "pharma": "ATC_CHAR LIKE 'N06A%'",
+    },
+    "BIPO": {
+        "diagnoses": """
+            (
+                (
+                    CODING_SYSTEM = 'ICD9'
+                    AND
+                    (
+                        substr(DIAGNOSIS,1,4) IN ('2960', '2961', '2964', '2965', '2966', '2967', '2981')
+                        OR
+                        substr(DIAGNOSIS,1,5) IN ('29680', '29681', '29689', '29699')
+                    )
+                )
+                OR
+                (
+                    CODING_SYSTEM = 'ICD10'
+                    AND
+                    (   
+                        substr(DIAGNOSIS,1,3) IN ('F30', 'F31')
+                        OR
+                        substr(DIAGNOSIS,1,4) IN ('F340', 'F380')
+                    )
+                )
+            )
+        """,
+        # Bipolar has no contraints on the pharma, except it must be a mental health related pharma
+        # (pharma is already filtered for mental health)
+        "pharma": "1",
+    },
+}
+
+
+def legacy_fill_cohorts_table(cursor: sqlite3.Cursor, fix_shadowed_subquery: bool=False) -> None:
+    """ The previous, one-disorder-at-a-time, cohorts table builder.
+    The subjects are kept as the integer keys of the ja database.
+    """
+    cursor.execute("DROP TABLE IF EXISTS cohorts")
+    cursor.execute("CREATE TABLE cohorts (ID_SUBJECT INTEGER, ID_DISORDER TEXT, YEAR_OF_ONSET INTEGER)")
+    if fix_shadowed_subquery:
+        onset_subquery = "SELECT c.YEAR_OF_ONSET AS MIN_YEAR FROM cohorts c WHERE c.ID_SUBJECT = cohorts.ID_SUBJECT AND c.ID_DISORDER = cohorts.ID_DISORDER LIMIT 1"
+    else:
+        onset_subquery = "SELECT YEAR_OF_ONSET AS MIN_YEAR FROM cohorts WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1"
+    for disorder, definition in LEGACY_COHORTS_CODE_CONDITIONS.items():
+        cursor.execute("DROP TABLE IF EXISTS temp.t_pharma")
+        cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
+        cursor.execute("DROP TABLE IF EXISTS temp.t_interventions")
+        cursor.execute("CREATE TEMP TABLE t_pharma (ID_SUBJECT INTEGER, MIN_YEAR INTEGER)")
+        cursor.execute("CREATE TEMP TABLE t_diagnoses (ID_SUBJECT INTEGER, MIN_YEAR INTEGER)")
+        cursor.execute("CREATE TEMP TABLE t_interventions (ID_SUBJECT INTEGER, MIN_YEAR INTEGER)")
+        cursor.execute(f"""
+            INSERT INTO t_diagnoses (ID_SUBJECT, MIN_YEAR)
+            SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DATE_DIAG) AS INTEGER))
+            FROM diagnoses
+            WHERE {definition["diagnoses"]}
+            GROUP BY ID_SUBJECT
+        """)
+        cursor.execute(f"""
+            INSERT INTO t_pharma (ID_SUBJECT, MIN_YEAR)
+            SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_PRESCR) AS INTEGER))
+            FROM pharma
+            WHERE
+                ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses)
+                AND
+                {definition["pharma"]}
+                AND
+                CAST(strftime('%Y', DT_PRESCR) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = pharma.ID_SUBJECT LIMIT 1)
+                    BETWEEN -{COHORTS_WASHOUT_YEARS} AND 0
+            GROUP BY ID_SUBJECT
+        """)
+        cursor.execute(f"""
+            INSERT INTO t_interventions (ID_SUBJECT, MIN_YEAR)
+            SELECT ID_SUBJECT, MIN(CAST(strftime('%Y', DT_INT) AS INTEGER))
+            FROM interventions
+            WHERE
+                ID_SUBJECT IN (SELECT ID_SUBJECT FROM t_diagnoses)
+                AND
+                CAST(strftime('%Y', DT_INT) AS INTEGER) - ( SELECT MIN_YEAR FROM t_diagnoses WHERE ID_SUBJECT = interventions.ID_SUBJECT LIMIT 1)
+                    BETWEEN -{COHORTS_WASHOUT_YEARS} AND 0
+            GROUP BY ID_SUBJECT
+        """)
+        cursor.execute(f"""
+            INSERT INTO cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)
+            SELECT ID_SUBJECT, '{disorder}', MIN_YEAR
+            FROM t_diagnoses
+        """)
+        cursor.execute(f"""
+            UPDATE cohorts
+            SET YEAR_OF_ONSET = (
+                SELECT MIN(MIN_YEAR)
+                FROM (
+                    SELECT MIN_YEAR FROM ({onset_subquery})
+                    UNION
+                    SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_pharma WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
+                    UNION
+                    SELECT MIN_YEAR FROM (SELECT MIN_YEAR FROM t_interventions WHERE ID_SUBJECT = cohorts.ID_SUBJECT LIMIT 1)
+                )
+            )
+            WHERE
+                ID_DISORDER = '{disorder}'
+                AND
+                ID_SUBJECT IN (
+                    SELECT ID_SUBJECT FROM t_pharma
+                    UNION
+                    SELECT ID_SUBJECT FROM t_interventions
+                )
+        """)
+    cursor.execute("DROP TABLE IF EXISTS temp.t_pharma")
+    cursor.execute("DROP TABLE IF EXISTS temp.t_diagnoses")
+    cursor.execute("DROP TABLE IF EXISTS temp.t_interventions")
+    cursor.execute("CREATE INDEX idx_cohorts ON cohorts (ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET)")
+
+def build_cohorts(database_file_path: str, builder, without_interventions: bool=False) -> tuple[set, float]:
+    """ Build the cohorts table with builder(cursor) on a copy of the database.
+    If without_interventions, the interventions are deleted from the copy first.
+    Returns the set of rows of the cohorts table and the time taken.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        copy_path = os.path.join(folder, "cohorts_regression.jasqlite3")
+        shutil.copyfile(database_file_path, copy_path)
+        connection = sqlite3.connect(copy_path)
+        cursor = connection.cursor()
+        if without_interventions:
+            cursor.execute("DELETE FROM interventions")
+            connection.commit()
+        t0 = time.time()
+        builder(cursor)
+        connection.commit()
+        t1 = time.time()
+        rows = cursor.execute("SELECT ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET FROM cohorts").fetchall()
+        cursor.close()
+        connection.close()
+    return set(rows), t1 - t0
+
+
+def prepare_synthetic_database(folder: str, n_subjects: int, seed: int) -> str:
+    """ Generate a synthetic original database in folder and preprocess it with the
+    dashboard pipeline. Returns the path to the ja database.
+    """
+    # the cache of the pipeline must be set before it is first used
+    os.environ[CACHE_FOLDER_ENVIRONMENT_VARIABLE] = os.path.join(folder, "cache")
+    from ..synthetic import generate_synthetic_database
+    from ..pipeline import load_and_preprocess_database
+    database_file_path = os.path.join(folder, f"synthetic_{n_subjects}_seed{seed}.sqlite3")
+    generate_synthetic_database(database_file_path, n_subjects, seed=seed)
+    connection = load_and_preprocess_database(database_file_path)
+    connection.close()
+    return database_file_path.replace(".sqlite3", ".jasqlite3")
+
+def check_cohorts_regression(database_file_path: str) -> bool:
+    """ Compare the cohorts built by the current and by the legacy builders on a copy of
+    the ja database, print the timings and the differences.
+    The comparison is made with all the records, then without the interventions: the interventions
+    usually give the year of onset, without them it depends on the pharma conditions.
+    Returns True if the current builder gives the same cohorts as the fixed legacy builder.
+    """
+    ok = True
+    for without_interventions in [False, True]:
+        print(f"Cohorts {'without the interventions' if without_interventions else 'with all the records'}:")
+        new_rows, new_time = build_cohorts(database_file_path, fill_cohorts_table, without_interventions)
+        legacy_rows, legacy_time = build_cohorts(database_file_path, legacy_fill_cohorts_table, without_interventions)
+        fixed_rows, fixed_time = build_cohorts(
+            database_file_path,
+            lambda cursor: legacy_fill_cohorts_table(cursor, fix_shadowed_subquery=True),
+            without_interventions
+        )
+        print(f"Cohorts rows: {len(new_rows):,d}")
+        for disorder in LEGACY_COHORTS_CODE_CONDITIONS.keys():
+            print(f"- {disorder}: {len([r for r in new_rows if r[1] == disorder]):,d}")
+        print(f"Timing:")
+        print(f"- legacy builder: {legacy_time:.3f} s")
+        print(f"- legacy builder, fixed subquery: {fixed_time:.3f} s")
+        print(f"- current builder: {new_time:.3f} s ({legacy_time/max(new_time, 1e-9):.1f}x faster than legacy)")
+        different_from_legacy = len(new_rows.symmetric_difference(legacy_rows)) // 2
+        print(f"Subjects with a different year of onset than the legacy builder (shadowed subquery): {different_from_legacy:,d}")
+        if len(new_rows) == 0:
+            print("REGRESSION: the cohorts table is empty.")
+            ok = False
+        elif new_rows != fixed_rows:
+            print(f"REGRESSION: {len(new_rows.symmetric_difference(fixed_rows)):,d} rows differ from the fixed legacy builder, e.g.:")
+            for row in sorted(new_rows - fixed_rows)[:10]:
+                print("\t current:", row)
+            for row in sorted(fixed_rows - new_rows)[:10]:
+                print("\t legacy: ", row)
+            ok = False
+        else:
+            print("OK: identical to the fixed legacy builder.")
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1].endswith(".jasqlite3"):
+        database_file_path = sys.argv[1]
+        if not os.path.exists(database_file_path):
+            raise ValueError(f"Database file not found: {database_file_path}")
+        sys.exit(0 if check_cohorts_regression(database_file_path) else 1)
+    n_subjects = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    with tempfile.TemporaryDirectory() as folder:
+        database_file_path = prepare_synthetic_database(folder, n_subjects, seed)
+        ok = check_cohorts_regression(database_file_path)
+    sys.exit(0 if ok else 1)
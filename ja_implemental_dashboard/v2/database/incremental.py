@@ -0,0 +1,353 @@
+"""Incremental maintenance of the internal ja database.
+
+Any change of the original database file changes its hash, and the whole ja database
+is normally rebuilt: slim down, data types, date-times, cohorts and age stratification,
+and the indicators cache is wiped.
+When new records (e.g. a new month of data) are only appended to the tables of the original
+database, the records already processed are identified by the rowid high-water mark
+of each table, stored by slim_down_database in the ingestion_state table of the ja database.
+Then only the new records are slimmed down and normalized, the cohorts and age stratification
+rows are computed anew only for the affected subjects, and only the cached indicators
+of the affected diseases and years are discarded (of all the diseases for the
+indicators that count the subjects of every cohort, see invalidate_cached_indicators).
+
+Records modified or deleted in place in the original database cannot be detected this way
+(deletions are, by comparing the number of records up to the high-water mark):
+delete the .jasqlite3 file to force a full rebuild in that case.
+
+Usage (see database/pipeline.py):
+
+    appended = append_new_records_to_slim_database(original_connection)
+    ...
+    if appended is not None:
+        affected_years = update_cohorts_and_age_stratification(ja_connection, appended, age_stratifications)
+        invalidate_cached_indicators(affected_years)
+"""
+import os, time
+import sqlite3
+
+from .database import (
+    get_ja_database_layout,
+    DATETIME_COLUMNS_REQUIRED,
+    INGESTION_STATE_TABLE,
+    get_tables,
+    get_column_names,
+    get_year_column_name,
+    normalize_datetime_columns,
+    fill_cohorts_table,
+    fill_age_stratification_table,
+    get_all_years_of_inclusion,
+)
+from .classification import CODE_CLASSIFICATION_TABLE, code_classification_table_is_current, create_classified_records_table
+from ..caching.database import (
+    get_slim_database_filepath,
+    detect_original_database_has_changed,
+    detect_slim_database_has_changed,
+    update_original_database_manifest,
+    write_stage_manifest,
+)
+
+SLIM_TABLES = ["demographics", "diagnoses", "pharma", "interventions", "physical_exams"]
+
+# records of these tables make a subject part of the ja database
+# (demographics and physical_exams are kept only for those subjects)
+# (the records of pharma and diagnoses are classified and slimmed down as in slim_down_database)
+_SUBJECT_DEFINING_TABLES = ["pharma", "diagnoses", "interventions"]
+
+
+def detect_appended_records(connection: sqlite3.Connection) -> dict[str, tuple[int, int]]|None:
+    """ Detect whether the original database only had records appended since the
+    ja database was built.
+
+    connection: sqlite3.Connection
+        The connection to the original (user selected) database.
+
+    Returns None if the ja database has to be built from scratch (or if nothing changed),
+    else a dictionary with, for each table, the (old, new) maximum rowid:
+    the records to process are the ones with old < rowid <= new.
+    """
+    slim_database_file = get_slim_database_filepath()
+    if not os.path.exists(slim_database_file):
+        return None
+    if not detect_original_database_has_changed():
+        return None
+    if detect_slim_database_has_changed():
+        return None
+    slim_connection = sqlite3.connect(slim_database_file)
+    slim_tables = get_tables(slim_connection)
+    if "subjects" not in slim_tables or INGESTION_STATE_TABLE not in slim_tables or not code_classification_table_is_current(slim_connection):
+        slim_connection.close()
+        return None
+    ingestion_state = {
+        t: (max_rowid, n_rows)
+        for t, max_rowid, n_rows in slim_connection.execute(f"SELECT TABLE_NAME, MAX_ROWID, N_ROWS FROM {INGESTION_STATE_TABLE}").fetchall()
+    }
+    slim_columns = {t: get_column_names(slim_connection, t) for t in SLIM_TABLES}
+    slim_connection.close()
+    cursor = connection.cursor()
+    appended = {}
+    for t in SLIM_TABLES:
+        if t not in ingestion_state:
+            cursor.close()
+            return None
+        # the columns must be the same as the ones already processed
+        if any([c not in slim_columns[t] for c in get_column_names(connection, t)]):
+            cursor.close()
+            return None
+        # no record must have been deleted up to the high-water mark
+        old_max_rowid, old_n_rows = ingestion_state[t]
+        n_rows, new_max_rowid = cursor.execute(f"""
+            SELECT
+                SUM(CASE WHEN rowid <= {int(old_max_rowid)} THEN 1 ELSE 0 END),
+                COALESCE(MAX(rowid), 0)
+            FROM {t}
+        """).fetchone()
+        if int(n_rows or 0) != int(old_n_rows):
+            cursor.close()
+            return None
+        appended[t] = (int(old_max_rowid), int(new_max_rowid))
+    cursor.close()
+    return appended
+
+def append_new_records_to_slim_database(connection: sqlite3.Connection) -> dict|None:
+    """ Slim down, convert and normalize only the records appended to the original database
+    since the last time it was processed, and append them to the ja database.
+    To be run before slim_down_database, which finds no changes afterwards if this succeeds.
+
+    connection: sqlite3.Connection
+        The connection to the original (user selected) database.
+
+    Returns None if the incremental update is not possible (see detect_appended_records),
+    else a dictionary with:
+    - "n_records": dict, the number of records appended to each table of the ja database
+    - "subjects": list[int], the ID_SUBJECT keys of the subjects with new records
+    - "subject_years": list[tuple[int, int]], the (ID_SUBJECT, year) pairs of the new records
+    - "demographics_subjects": list[int], the ID_SUBJECT keys of the subjects with new demographics records
+    """
+    appended = detect_appended_records(connection)
+    if appended is None:
+        return None
+    print("Appending new records to the internal database...", end=" ")
+    t0_ = time.time()
+    slim_database_file = get_slim_database_filepath()
+    cursor = connection.cursor()
+    cursor.execute(f"ATTACH DATABASE '{slim_database_file}' AS slim")
+    def new_records(t: str) -> str:
+        old_max_rowid, new_max_rowid = appended[t]
+        return f"(rowid > {old_max_rowid} AND rowid <= {new_max_rowid})"
+    def old_records(t: str) -> str:
+        return f"(rowid <= {appended[t][0]})"
+    # new records of the tables that define the subjects of the ja database
+    for t in _SUBJECT_DEFINING_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS temp.new_{t}")
+        create_classified_records_table(cursor, t, f"main.{t}", f"new_{t}", new_records(t), f"slim.{CODE_CLASSIFICATION_TABLE}")
+    # subjects that enter the ja database with these records
+    cursor.execute("DROP TABLE IF EXISTS temp.new_subjects")
+    cursor.execute("CREATE TEMP TABLE new_subjects (ORIGINAL_ID_SUBJECT TEXT PRIMARY KEY) WITHOUT ROWID")
+    union_string = " UNION ".join([f"SELECT trim(CAST(ID_SUBJECT AS TEXT)) AS ORIGINAL_ID_SUBJECT FROM temp.new_{t}" for t in _SUBJECT_DEFINING_TABLES])
+    cursor.execute(f"""
+        INSERT INTO new_subjects (ORIGINAL_ID_SUBJECT)
+        SELECT ORIGINAL_ID_SUBJECT FROM ({union_string})
+        WHERE
+            ORIGINAL_ID_SUBJECT IS NOT NULL
+            AND
+            ORIGINAL_ID_SUBJECT NOT IN (SELECT ORIGINAL_ID_SUBJECT FROM slim.subjects)
+    """)
+    # demographics: the new records of the subjects of the ja database,
+    # and the old records of the subjects that enter it now
+    cursor.execute("DROP TABLE IF EXISTS temp.new_demographics")
+    cursor.execute(f"""
+        CREATE TEMP TABLE new_demographics AS
+        SELECT * FROM main.demographics
+        WHERE
+            (
+                {new_records("demographics")}
+                AND
+                trim(CAST(ID_SUBJECT AS TEXT)) IN (
+                    SELECT ORIGINAL_ID_SUBJECT FROM slim.subjects
+                    UNION
+                    SELECT ORIGINAL_ID_SUBJECT FROM temp.new_subjects
+                )
+            )
+            OR
+            (
+                {old_records("demographics")}
+                AND
+                trim(CAST(ID_SUBJECT AS TEXT)) IN (SELECT ORIGINAL_ID_SUBJECT FROM temp.new_subjects)
+            )
+    """)
+    # physical_exams: the new records of the subjects with demographics,
+    # and the old records of the subjects that did not have demographics before
+    cursor.execute("DROP TABLE IF EXISTS temp.new_demographics_subjects")
+    cursor.execute("""
+        CREATE TEMP TABLE new_demographics_subjects AS
+        SELECT DISTINCT trim(CAST(ID_SUBJECT AS TEXT)) AS ORIGINAL_ID_SUBJECT
+        FROM temp.new_demographics
+        WHERE trim(CAST(ID_SUBJECT AS TEXT)) NOT IN (
+            SELECT s.ORIGINAL_ID_SUBJECT FROM slim.subjects s WHERE s.ID_SUBJECT IN (SELECT ID_SUBJECT FROM slim.demographics)
+        )
+    """)
+    cursor.execute("DROP TABLE IF EXISTS temp.new_physical_exams")
+    cursor.execute(f"""
+        CREATE TEMP TABLE new_physical_exams AS
+        SELECT * FROM main.physical_exams
+        WHERE
+            (
+                {new_records("physical_exams")}
+                AND
+                trim(CAST(ID_SUBJECT AS TEXT)) IN (
+                    SELECT s.ORIGINAL_ID_SUBJECT FROM slim.subjects s WHERE s.ID_SUBJECT IN (SELECT ID_SUBJECT FROM slim.demographics)
+                    UNION
+                    SELECT ORIGINAL_ID_SUBJECT FROM temp.new_demographics_subjects
+                )
+            )
+            OR
+            (
+                {old_records("physical_exams")}
+                AND
+                trim(CAST(ID_SUBJECT AS TEXT)) IN (SELECT ORIGINAL_ID_SUBJECT FROM temp.new_demographics_subjects)
+            )
+    """)
+    # new subjects get the next integer keys
+    cursor.execute("""
+        INSERT INTO slim.subjects (ORIGINAL_ID_SUBJECT)
+        SELECT ORIGINAL_ID_SUBJECT FROM temp.new_subjects
+        ORDER BY ORIGINAL_ID_SUBJECT
+    """)
+    # convert the new records as preprocess_database_data_types and preprocess_database_datetimes
+    # would do, in staging tables with the same columns of the ja database tables, then append them
+    n_records = {}
+    for t in SLIM_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS temp.inc_{t}")
+        cursor.execute(f"CREATE TEMP TABLE inc_{t} AS SELECT * FROM slim.{t} WHERE 0")
+        columns = [c for c in get_column_names(connection, f"new_{t}") if c != "ID_SUBJECT"]
+        columns_string = "".join([f", {c}" for c in columns])
+        values_string = "".join([
+            f", CAST(n.{c} AS {get_ja_database_layout(t)[c]})" if c in get_ja_database_layout(t) else f", n.{c}"
+            for c in columns
+        ])
+        cursor.execute(f"""
+            INSERT INTO inc_{t} (ID_SUBJECT{columns_string})
+            SELECT s.ID_SUBJECT{values_string}
+            FROM temp.new_{t} n
+            JOIN slim.subjects s ON s.ORIGINAL_ID_SUBJECT = trim(CAST(n.ID_SUBJECT AS TEXT))
+            ORDER BY s.ID_SUBJECT
+        """)
+        normalize_datetime_columns(connection, t, target_table=f"inc_{t}")
+        cursor.execute(f"INSERT INTO slim.{t} SELECT * FROM temp.inc_{t}")
+        n_records[t] = int(cursor.execute(f"SELECT COUNT(*) FROM temp.inc_{t}").fetchone()[0])
+    # subjects and years touched by the new records
+    # (demographics records have no year of their own: they concern all the years of the subject)
+    years_string = " UNION ".join([
+        f"SELECT ID_SUBJECT, {get_year_column_name(DATETIME_COLUMNS_REQUIRED[t][0])} FROM temp.inc_{t}"
+        for t in SLIM_TABLES if t != "demographics"
+    ])
+    subject_years = cursor.execute(years_string).fetchall()
+    demographics_subjects = [s for (s,) in cursor.execute("SELECT DISTINCT ID_SUBJECT FROM temp.inc_demographics").fetchall()]
+    subjects = sorted(set([s for s, _ in subject_years] + demographics_subjects))
+    # move the high-water marks
+    for t in SLIM_TABLES:
+        cursor.execute(f"""
+            UPDATE slim.{INGESTION_STATE_TABLE}
+            SET MAX_ROWID = {appended[t][1]}, N_ROWS = (SELECT COUNT(*) FROM main.{t} WHERE rowid <= {appended[t][1]})
+            WHERE TABLE_NAME = '{t}'
+        """)
+    for t in SLIM_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS temp.new_{t}")
+        cursor.execute(f"DROP TABLE IF EXISTS temp.inc_{t}")
+    cursor.execute("DROP TABLE IF EXISTS temp.new_subjects")
+    cursor.execute("DROP TABLE IF EXISTS temp.new_demographics_subjects")
+    connection.commit()
+    cursor.execute("DETACH DATABASE slim")
+    cursor.close()
+    # the ja database is now in sync with the original database: record it, so that the full rebuild is not triggered
+    update_original_database_manifest()
+    print(f"done! ({sum(n_records.values()):,d} records of {len(subjects):,d} subjects, took {time.time()-t0_:.1f}s)")
+    return {
+        "n_records": n_records,
+        "subjects": subjects,
+        "subject_years": subject_years,
+        "demographics_subjects": demographics_subjects,
+    }
+
+def update_cohorts_and_age_stratification(connection: sqlite3.Connection, appended: dict, age_stratifications: list[tuple[int, int]]) -> dict[str, set[int]|None]:
+    """ Update the cohorts and age_stratification tables of the ja database
+    for the subjects with new records only.
+
+    connection: sqlite3.Connection
+        The connection to the ja database.
+    appended: dict
+        The output of append_new_records_to_slim_database.
+    age_stratifications: list[tuple[int, int]]
+        The age intervals of the age stratification (see make_age_startification_tables).
+
+    Returns, for each disease (database code, e.g. 'SCHIZO') whose indicators may have changed,
+    the set of affected years, or None if all years are affected.
+    """
+    print("Updating cohorts and age stratification of the subjects with new records...", end=" ")
+    t0_ = time.time()
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS temp.inc_subjects")
+    cursor.execute("CREATE TEMP TABLE inc_subjects (ID_SUBJECT INTEGER PRIMARY KEY)")
+    cursor.executemany("INSERT INTO inc_subjects (ID_SUBJECT) VALUES (?)", [(s,) for s in appended["subjects"]])
+    def get_onsets() -> dict[tuple[int, str], int]:
+        return {
+            (s, d): y for s, d, y in cursor.execute(
+                "SELECT ID_SUBJECT, ID_DISORDER, YEAR_OF_ONSET FROM cohorts WHERE ID_SUBJECT IN (SELECT ID_SUBJECT FROM inc_subjects)"
+            ).fetchall()
+        }
+    def get_min_onsets() -> dict[str, int]:
+        return dict(cursor.execute("SELECT ID_DISORDER, MIN(YEAR_OF_ONSET) FROM cohorts GROUP BY ID_DISORDER").fetchall())
+    old_onsets, old_min_onsets = get_onsets(), get_min_onsets()
+    old_years_of_inclusion = get_all_years_of_inclusion(connection)
+    # cohorts
+    fill_cohorts_table(cursor, subjects_table="inc_subjects")
+    new_onsets, new_min_onsets = get_onsets(), get_min_onsets()
+    years_of_inclusion = get_all_years_of_inclusion(connection)
+    # age stratification: all subjects if the years of inclusion changed
+    if years_of_inclusion != old_years_of_inclusion:
+        cursor.execute("DELETE FROM age_stratification")
+        fill_age_stratification_table(cursor, years_of_inclusion, age_stratifications)
+    else:
+        fill_age_stratification_table(cursor, years_of_inclusion, age_stratifications, subjects_table="inc_subjects")
+    cursor.execute("DROP TABLE IF EXISTS temp.inc_subjects")
+    connection.commit()
+    cursor.close()
+    write_stage_manifest("cohorts")
+    write_stage_manifest("age_stratification")
+    # affected years of each disease
+    last_year = years_of_inclusion[-1] if len(years_of_inclusion) > 0 else int(time.localtime().tm_year)
+    affected_years = {}
+    def add_years(disease: str, years: set[int]|None):
+        if disease in affected_years and affected_years[disease] is None:
+            return
+        if years is None:
+            affected_years[disease] = None
+        else:
+            affected_years.setdefault(disease, set()).update(years)
+    # - the years of inclusion evaluated by the dashboard start from the first onset of the disease
+    for d in set(old_min_onsets.keys()).union(new_min_onsets.keys()):
+        if old_min_onsets.get(d, None) != new_min_onsets.get(d, None) or years_of_inclusion != old_years_of_inclusion:
+            add_years(d, None)
+    # - a subject entering, leaving or changing onset year in a cohort changes the cohorts from that year on
+    for key in set(old_onsets.keys()).union(new_onsets.keys()):
+        old_onset, new_onset = old_onsets.get(key, None), new_onsets.get(key, None)
+        if old_onset != new_onset:
+            first_year = min([y for y in [old_onset, new_onset] if y is not None])
+            add_years(key[1], set(range(first_year, last_year + 1)))
+    # - new records of the subjects of a cohort change the indicators of their year
+    subject_diseases = {}
+    for s, d in set(old_onsets.keys()).union(new_onsets.keys()):
+        subject_diseases.setdefault(s, set()).add(d)
+    for s, y in appended["subject_years"]:
+        if y is None:
+            continue
+        for d in subject_diseases.get(s, []):
+            add_years(d, {int(y)})
+    # - new demographics records of the subjects of a cohort change the indicators from their onset on
+    for s in appended["demographics_subjects"]:
+        for d in subject_diseases.get(s, []):
+            onsets = [y for y in [old_onsets.get((s, d), None), new_onsets.get((s, d), None)] if y is not None]
+            add_years(d, set(range(min(onsets), last_year + 1)))
+    print(f"done! (took {time.time()-t0_:.1f}s)")
+    return affected_years
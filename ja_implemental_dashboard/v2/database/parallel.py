@@ -0,0 +1,297 @@
+import os, sys, time
+import sqlite3
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from .profiler import profiled
+
+# Parallel evaluation of the indicators over the years of inclusion.
+#
+# The years of inclusion of an indicator are independent from each other, but
+# they cannot be evaluated concurrently on the single connection to the ja database
+# shared by the dashboard (see load_database.DB). The ja database is only read once
+# preprocessed, so the years are spread over a pool of threads, each with its own
+# read-only connection (URI mode=ro) to the same file. SQLite releases the GIL
+# while it executes a statement, so the queries of different years run in parallel.
+# The temporary tables used by the indicators (e.g. database.stratify_demographics)
+# live in the temp schema of each connection, which is writable on read-only connections.
+# The results are always returned in the order of the years.
+#
+# A computation can be cancelled with a CancellationToken (e.g. when the user changed
+# the widgets before the plot was ready): while a connection is used on behalf of a token
+# (see cancellable), the token interrupts its running statement when cancelled, and a
+# progress handler stops the next ones. The token is passed on to the pool threads.
+#
+# Similarly, a computation can report its progress (see reporting_progress): map_years
+# calls the progress callback of the calling thread, if any, every time a year is done.
+
+def get_max_workers() -> int:
+    """ Default number of parallel connections: the number of cores, at most 8. """
+    return min(8, os.cpu_count() or 1)
+
+def get_database_file_path(connection: sqlite3.Connection) -> str|None:
+    """ Path of the main database file of a connection, None for in-memory databases. """
+    for _, name, file_path in connection.execute("PRAGMA database_list").fetchall():
+        if name == "main":
+            return file_path if file_path else None
+    return None
+
+
+class ComputationCancelled(Exception):
+    """ Raised by a computation whose CancellationToken was cancelled. """
+    pass
+
+
+class CancellationToken(object):
+    def __init__(self):
+        """ Cancels the statements run, on behalf of this token, on the connections
+        registered with cancellable.
+        """
+        self._cancelled = threading.Event()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        with self._lock:
+            for connection in self._connections:
+                connection.interrupt()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise ComputationCancelled()
+
+    def _register(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.add(connection)
+        if self.is_cancelled():
+            connection.interrupt()
+
+    def _unregister(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.discard(connection)
+
+
+_current = threading.local()
+
+def get_current_cancellation_token() -> CancellationToken|None:
+    """ The token of the computation running in this thread, if any (see cancellable). """
+    return getattr(_current, "token", None)
+
+@contextlib.contextmanager
+def cancellable(connection: sqlite3.Connection, token: CancellationToken, progress_steps: int=10000):
+    """ Run the statements on connection on behalf of token, in this thread: when the token
+    is cancelled, the running statement is interrupted and the next ones fail
+    (sqlite3.OperationalError: interrupted). The interruption is reported as ComputationCancelled.
+    """
+    token.raise_if_cancelled()
+    previous_token = get_current_cancellation_token()
+    _current.token = token
+    connection.set_progress_handler(lambda: 1 if token.is_cancelled() else 0, progress_steps)
+    token._register(connection)
+    try:
+        yield connection
+    except sqlite3.OperationalError as e:
+        if token.is_cancelled():
+            raise ComputationCancelled() from e
+        raise
+    finally:
+        token._unregister(connection)
+        connection.set_progress_handler(None, progress_steps)
+        _current.token = previous_token
+    token.raise_if_cancelled()
+
+
+def get_current_progress_callback():
+    """ The progress callback of the computation running in this thread, if any (see reporting_progress). """
+    return getattr(_current, "progress_callback", None)
+
+@contextlib.contextmanager
+def reporting_progress(callback):
+    """ Report the progress of the computations run in this thread, and in the pool threads
+    on its behalf, as callback(n_done, n_total), e.g. the years evaluated by map_years.
+    """
+    previous_callback = get_current_progress_callback()
+    _current.progress_callback = callback
+    try:
+        yield callback
+    finally:
+        _current.progress_callback = previous_callback
+
+
+class ReadOnlyConnectionPool(object):
+    def __init__(self, database_file_path: str, max_workers: int|None=None):
+        """ A pool of threads, each with its own read-only connection to database_file_path
+        (opened at the first use of the thread).
+        """
+        if not os.path.exists(database_file_path):
+            raise ValueError(f"Database file not found: {database_file_path}")
+        self.database_file_path = database_file_path
+        self.max_workers = get_max_workers() if max_workers is None else int(max_workers)
+        if self.max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ja_ro_connection")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = profiled(sqlite3.connect(f"file:{self.database_file_path}?mode=ro", uri=True, check_same_thread=False))
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _call(self, function, item, token: CancellationToken|None, progress_callback=None):
+        connection = self._get_connection()
+        with reporting_progress(progress_callback):
+            if token is None:
+                return function(connection, item)
+            with cancellable(connection, token):
+                return function(connection, item)
+
+    def map(self, function, items: list) -> list:
+        """ Call function(connection, item) for every item, in parallel,
+        and return the results in the order of the items.
+        The cancellation token and the progress callback of the calling thread, if any,
+        apply to all the calls (the progress is reported as the number of items done).
+        """
+        token = get_current_cancellation_token()
+        progress_callback = get_current_progress_callback()
+        futures = [self._executor.submit(self._call, function, item, token) for item in items]
+        if progress_callback is not None:
+            n_done = [0]
+            lock = threading.Lock()
+            def on_done_(future: Future) -> None:
+                with lock:
+                    n_done[0] += 1
+                    n = n_done[0]
+                progress_callback(n, len(futures))
+            for future in futures:
+                future.add_done_callback(on_done_)
+        try:
+            return [future.result() for future in futures]
+        finally:
+            # as executor.map: on error, the calls not started yet are not run
+            for future in futures:
+                future.cancel()
+
+    def submit(self, function, item, token: CancellationToken|None=None) -> Future:
+        """ Call function(connection, item) in a thread of the pool, on behalf of token. """
+        return self._executor.submit(self._call, function, item, token)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+# one pool per database file, number of workers and usage (the pools must not be
+# shared by computations that wait for each other), shared by all the tabs
+_pools: dict[tuple[str, int, str]: ReadOnlyConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_read_only_connection_pool(connection: sqlite3.Connection, max_workers: int|None=None, usage: str="years") -> ReadOnlyConnectionPool|None:
+    """ The shared pool of read-only connections to the database of connection,
+    None if connection is to an in-memory database.
+    usage: str
+        Pools with different usages have different threads, e.g. the plots are computed
+        in the "plots" pool and their years in the "years" pool.
+    """
+    database_file_path = get_database_file_path(connection)
+    if database_file_path is None:
+        return None
+    max_workers = get_max_workers() if max_workers is None else int(max_workers)
+    key = (os.path.normpath(database_file_path), max_workers, usage)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ReadOnlyConnectionPool(database_file_path, max_workers=max_workers)
+        return _pools[key]
+
+def close_read_only_connection_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def map_years(connection: sqlite3.Connection, function, years: list[int], max_workers: int|None=None) -> list:
+    """ Evaluate function(connection, year) for every year, returning the results
+    in the order of the years. The years are evaluated in parallel over the pool of
+    read-only connections to the database of connection (see ReadOnlyConnectionPool),
+    or sequentially on connection itself if there is only one worker, only one year,
+    or connection is to an in-memory database.
+    """
+    max_workers = get_max_workers() if max_workers is None else int(max_workers)
+    pool = None
+    if max_workers > 1 and len(years) > 1:
+        pool = get_read_only_connection_pool(connection, max_workers=max_workers)
+    if pool is None:
+        token = get_current_cancellation_token()
+        progress_callback = get_current_progress_callback()
+        results = []
+        for year in years:
+            if token is not None:
+                token.raise_if_cancelled()
+            results.append(function(connection, year))
+            if progress_callback is not None:
+                progress_callback(len(results), len(years))
+        return results
+    return pool.map(function, years)
+
+def split_years(years: list[int], n_chunks: int) -> list[list[int]]:
+    """ Split the years in at most n_chunks contiguous chunks of (almost) equal length. """
+    n_chunks = max(1, min(int(n_chunks), len(years)))
+    size, remainder = divmod(len(years), n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        end = start + size + (1 if i < remainder else 0)
+        chunks.append(years[start:end])
+        start = end
+    return chunks
+
+
+if __name__ == "__main__":
+    # benchmark of the parallel evaluation of the indicators over the years, e.g.
+    # python -m ja_implemental_dashboard.v2.database.parallel path/to/database.jasqlite3 1 2 4 8
+    if len(sys.argv) < 2:
+        print("Usage: python -m ja_implemental_dashboard.v2.database.parallel path/to/database.jasqlite3 [n_workers ...]")
+        sys.exit(1)
+    from .database import DISEASE_CODE_TO_DB_CODE
+    from ..indicator.monitoring.engine import ma1
+    from ..indicator.evaluation.engine import evaluate_indicator_json, get_years_of_inclusion
+    from ..indicator.widget_texts import AGE_WIDGET_INTERVALS
+    database_file_path_ = sys.argv[1]
+    workers_list_ = [int(a) for a in sys.argv[2:]] if len(sys.argv) > 2 else [1, 2, 4, 8]
+    connection_ = sqlite3.connect(database_file_path_)
+    selection_ = dict(
+        age=[AGE_WIDGET_INTERVALS[list(AGE_WIDGET_INTERVALS.keys())[0]]],
+        gender="A", civil_status="All", job_condition="All", educational_level="All"
+    )
+    print(f"CPUs: {os.cpu_count()}")
+    reference_ = {}
+    for disease_code_ in DISEASE_CODE_TO_DB_CODE:
+        years_ = get_years_of_inclusion(connection_, DISEASE_CODE_TO_DB_CODE[disease_code_])
+        for n_workers_ in workers_list_:
+            def ma1_year_(connection, year):
+                return ma1(connection=connection, cohorts_required=True, disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code_], year_of_inclusion=year, **selection_)
+            t0_ = time.time()
+            ma1_out_ = map_years(connection_, ma1_year_, years_, max_workers=n_workers_)
+            t1_ = time.time()
+            ea_out_ = evaluate_indicator_json("EA1", connection_, disease_code_, "_a_", max_workers=n_workers_, **selection_)
+            t2_ = time.time()
+            if disease_code_ not in reference_:
+                reference_[disease_code_] = (ma1_out_, ea_out_)
+                t_ref_ = (t1_ - t0_, t2_ - t1_)
+            same_ = reference_[disease_code_] == (ma1_out_, ea_out_)
+            print(f"{disease_code_:<20} {n_workers_} workers: MA1 {t1_-t0_:.3f} s ({t_ref_[0]/(t1_-t0_):.2f}x), EA1 {t2_-t1_:.3f} s ({t_ref_[1]/(t2_-t1_):.2f}x){'' if same_ else '  DIFFERENT RESULTS'}")
+    close_read_only_connection_pools()
+    connection_.close()
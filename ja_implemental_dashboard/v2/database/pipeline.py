@@ -0,0 +1,140 @@
+import os, time
+import sqlite3
+
+from .database import (
+    standardize_table_names,
+    check_database_has_tables,
+    slim_down_database,
+    preprocess_database_data_types,
+    create_indices_on_ja_database,
+    preprocess_database_datetimes,
+    add_cohorts_table,
+    make_age_startification_tables,
+    get_all_years_of_inclusion,
+)
+from .incremental import (
+    append_new_records_to_slim_database,
+    update_cohorts_and_age_stratification,
+)
+from .profiler import profiled
+from ..caching.database import get_original_database_file_path_cache_file
+from ..caching.indicators import initialize_indicators_cache_database, invalidate_cached_indicators
+from ..indicator.widget_texts import AGE_WIDGET_INTERVALS
+
+
+# The preprocessing pipeline of the database, used by the dashboard
+# (see session.DatabaseSession, which runs it on first use of the database)
+# and by the headless export (see export).
+#
+#######################################################
+# ***   MAIN LOGIC   ***
+# - CREATION/CONNECTION TO INTERNAL DATABASE
+# - PREPROCESSING OF INTERNAL DATABASE
+# - CREATION OF cohorts AND age_stratifications TABLES
+#######################################################
+
+class _StageTimer(object):
+    def __init__(self, stage_timings: dict):
+        """ Records the seconds taken by each stage of the pipeline in stage_timings. """
+        self.stage_timings = stage_timings
+        self._stage = None
+        self._t = None
+
+    def start(self, stage: str) -> None:
+        self.stop()
+        self._stage = stage
+        self._t = time.time()
+
+    def stop(self) -> None:
+        if self._stage is not None:
+            self.stage_timings[self._stage] = self.stage_timings.get(self._stage, 0.0) + time.time() - self._t
+        self._stage = None
+
+
+def print_stage_timings(stage_timings: dict) -> None:
+    total = sum(stage_timings.values())
+    for stage, dt in stage_timings.items():
+        print(f"\t{stage:<32} {dt:8.2f} s ({100 * dt / total if total > 0 else 0:.0f}%)")
+
+
+def load_and_preprocess_database(user_database_file: str, stage_timings: dict|None=None) -> sqlite3.Connection:
+    """ Preprocess the user database (the original database) into the ja database,
+    which is used to compute the indicators, and prepare the indicators cache.
+    Each stage is skipped if it is up to date.
+    user_database_file: str
+        Path to the original database file (.sqlite3).
+    stage_timings: dict|None
+        If given, filled with the seconds taken by each stage of the pipeline.
+    Returns the connection to the ja database.
+    """
+    if not os.path.exists(user_database_file):
+        raise ValueError(f"Database file not found: {user_database_file}")
+    user_database_file = os.path.normpath(user_database_file)
+    stage_timings = {} if stage_timings is None else stage_timings
+    timer = _StageTimer(stage_timings)
+    DB = profiled(sqlite3.connect(user_database_file))
+    # save original database file path into a cache file
+    with open(get_original_database_file_path_cache_file(), "w") as f:
+        f.write(user_database_file)
+    # CREATION/CONNECTION TO INTERNAL DATABASE
+    _t0 = time.time()
+    # Standardize tables names
+    timer.start("standardize_table_names")
+    standardize_table_names(DB)
+    # Check if the database has the necessary tables
+    timer.start("check_database_has_tables")
+    is_ok, missing = check_database_has_tables(DB)
+    if not is_ok:
+        raise ValueError("The database is missing the following tables which are required:", missing)
+    # Preprocess the database: create a second database file (that will be used for the dashboard)
+    #                          containing only patients
+    #                          that are mental health patients of some sort, to exclude
+    #                          every other medical condition not of interest of the dashboard
+    # If records were only appended to the original database since the last time, process only those
+    timer.start("append_new_records")
+    _appended = append_new_records_to_slim_database(DB)
+    timer.start("slim_down_database")
+    new_db_path, _has_been_slimmed = slim_down_database(DB)
+    DB.close()
+    DB = profiled(sqlite3.connect(new_db_path))
+    # PREPROCESSING OF INTERNAL DATABASE
+    # Fix data types
+    timer.start("preprocess_data_types")
+    preprocess_database_data_types(DB, force=_has_been_slimmed)
+    # Create indices on the tables
+    timer.start("create_indices")
+    create_indices_on_ja_database(DB, force=_has_been_slimmed)
+    # Fix datetime columns
+    timer.start("preprocess_datetimes")
+    preprocess_database_datetimes(DB, force=_has_been_slimmed)
+    # CREATE THE 'cohorts' TABLE
+    timer.start("cohorts")
+    add_cohorts_table(DB, force=_has_been_slimmed)
+    # CREATE THE 'age_stratification' TABLE
+    timer.start("age_stratification")
+    _years_of_inclusion = get_all_years_of_inclusion(DB)
+    _age_stratifications_list = [v for v in AGE_WIDGET_INTERVALS.values()]
+    make_age_startification_tables(DB, _years_of_inclusion, _age_stratifications_list, force=_has_been_slimmed)
+    # UPDATE 'cohorts' AND 'age_stratification' FOR THE SUBJECTS WITH APPENDED RECORDS
+    _affected_years = None
+    if _appended is not None:
+        timer.start("update_appended_records")
+        _affected_years = update_cohorts_and_age_stratification(DB, _appended, _age_stratifications_list)
+    # CREATE INDICATOR CACHE DATABASE
+    timer.start("indicators_cache")
+    initialize_indicators_cache_database(force=_has_been_slimmed)
+    if _affected_years is not None:
+        _n_invalidated = invalidate_cached_indicators(_affected_years)
+        print(f"Discarded {_n_invalidated:,d} cached indicators affected by the new records.")
+    timer.stop()
+    # PRINT OUT HOW MUCH IT TOOK
+    _dt = time.time() - _t0
+    hours = _dt//3600
+    minutes = (_dt//60)%60
+    seconds = _dt%60
+    print(f"Database checked and loaded in {hours:.0f}h {minutes:.0f}m {seconds:.0f}s")
+    print_stage_timings(stage_timings)
+    return DB
+
+if __name__ == "__main__":
+    print("This script is not intended to be run as the main script.")
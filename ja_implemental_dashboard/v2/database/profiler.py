@@ -0,0 +1,330 @@
+import os, sys, time, re
+import json
+import atexit
+import sqlite3
+import threading
+import numpy
+
+# Opt-in profiler of the SQL statements run on the ja database.
+#
+# When enabled (enable_sql_profiler, or the environment variable JA_SQL_PROFILE),
+# the connections made by the preprocessing pipeline, the database session and the
+# pools of read-only connections (see database.parallel) are wrapped by profiled(), so
+# that every statement run by stratify_demographics, the indicators functions and the
+# preprocessing stages is recorded with:
+# - its template: the statement with the literals replaced by ? and the names of the
+#   temporary tables normalized, since the indicators format their values in the SQL text;
+# - its bound parameters, wall time (execution and fetching of the rows) and number of rows;
+# - the EXPLAIN QUERY PLAN output, captured the first time the template is seen.
+# The statements are aggregated by template (count, total, p50, p95 and max time), and the
+# templates whose plan scans a whole table without an index are flagged.
+# The results are dumped as JSON (JA_SQL_PROFILE=path/to/file.json dumps them at exit)
+# and shown in the diagnostics section of the dashboard, only when enabled.
+#
+# When the profiler is not enabled, profiled() returns the connection itself: no overhead.
+
+PROFILE_ENVIRONMENT_VARIABLE = "JA_SQL_PROFILE"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_TIMESTAMPED_NAME = re.compile(r"(\w+?)_\d{6,}\b")
+_VALUES_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINED_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE")
+
+
+def normalize_statement(sql: str) -> str:
+    """ Template of a statement: literals replaced by ?, lists of literals by (?, ...),
+    timestamped names (e.g. of the tables of stratify_demographics) by name_N,
+    and whitespace collapsed.
+    """
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _TIMESTAMPED_NAME.sub(r"\1_N", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip().rstrip(";").strip()
+    sql = _VALUES_LIST.sub("(?, ...)", sql)
+    return sql
+
+def is_full_table_scan(detail: str) -> bool:
+    """ If a line of EXPLAIN QUERY PLAN scans a whole table without using an index. """
+    detail = detail.strip().upper()
+    if not detail.startswith("SCAN "):
+        return False
+    if "USING INDEX" in detail or "USING COVERING INDEX" in detail or "USING INTEGER PRIMARY KEY" in detail:
+        return False
+    # scans of subqueries, views materialized and constant rows are not table scans
+    return not (detail.startswith("SCAN (") or detail.startswith("SCAN CONSTANT ROW") or " SUBQUERY " in f" {detail} ")
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(numpy.percentile(values, q)) if len(values) > 0 else 0.0
+
+def _to_json_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+class SqlProfiler(object):
+    def __init__(self, explain: bool=True, max_records: int=1_000_000):
+        """ Records the statements run on the profiled connections.
+        explain: bool
+            Capture the EXPLAIN QUERY PLAN of each template (once).
+        max_records: int
+            The statements beyond this number are only counted.
+        """
+        self.explain = explain
+        self.max_records = max_records
+        self._records = []
+        self._plans = {}
+        self._n_dropped = 0
+        self._lock = threading.Lock()
+
+    def _explain(self, connection: sqlite3.Connection, template: str, sql: str, parameters) -> None:
+        if not self.explain or template in self._plans:
+            return
+        if not sql.lstrip().upper().startswith(_EXPLAINED_STATEMENTS):
+            self._plans[template] = None
+            return
+        try:
+            rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+            plan = [row[-1] for row in rows]
+        except sqlite3.Error as e:
+            # e.g. CREATE TABLE of a table that is created by the statement before
+            plan = [f"(EXPLAIN QUERY PLAN failed: {e})"]
+        self._plans[template] = plan
+
+    def start(self, connection: sqlite3.Connection, sql: str, parameters=(), many: bool=False) -> dict:
+        """ The record of a statement about to run on connection (the unwrapped one). """
+        template = normalize_statement(sql)
+        if not many:
+            self._explain(connection, template, sql, parameters)
+        record = {
+            "template": template,
+            "parameters": None if many else [_to_json_value(p) for p in parameters] if isinstance(parameters, (list, tuple)) else {k: _to_json_value(v) for k, v in dict(parameters).items()},
+            "time": 0.0,
+            "rows": 0,
+            "thread": threading.current_thread().name,
+            "start": time.time(),
+        }
+        with self._lock:
+            if len(self._records) < self.max_records:
+                self._records.append(record)
+            else:
+                self._n_dropped += 1
+        return record
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records = []
+            self._plans = {}
+            self._n_dropped = 0
+
+    def get_records(self) -> list[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def get_summary(self) -> list[dict]:
+        """ The statistics of each template, slowest (in total) first. """
+        by_template = {}
+        for record in self.get_records():
+            by_template.setdefault(record["template"], []).append(record)
+        summary = []
+        for template, records in by_template.items():
+            times = [r["time"] for r in records]
+            plan = self._plans.get(template, None)
+            summary.append({
+                "template": template,
+                "count": len(records),
+                "total_time": float(sum(times)),
+                "p50_time": _percentile(times, 50),
+                "p95_time": _percentile(times, 95),
+                "max_time": float(max(times)),
+                "rows": int(sum([r["rows"] for r in records])),
+                "full_table_scan": plan is not None and any([is_full_table_scan(d) for d in plan]),
+                "plan": plan,
+                "example_parameters": records[0]["parameters"],
+            })
+        return sorted(summary, key=lambda s: s["total_time"], reverse=True)
+
+    def to_dict(self, include_records: bool=False) -> dict:
+        out = {
+            "n_statements": len(self._records) + self._n_dropped,
+            "n_dropped_records": self._n_dropped,
+            "summary": self.get_summary(),
+        }
+        if include_records:
+            out["records"] = self.get_records()
+        return out
+
+    def dump_json(self, file_path: str, include_records: bool=False) -> None:
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(include_records=include_records), f, indent=1)
+
+    def print_summary(self, n: int=20) -> None:
+        summary = self.get_summary()
+        print(f"SQL profile: {sum([s['count'] for s in summary]):,d} statements, {len(summary):,d} templates")
+        for s in summary[:n]:
+            flag = " FULL SCAN" if s["full_table_scan"] else ""
+            print(f"\t{s['total_time']:8.3f} s  {s['count']:6,d} x  p50 {1000*s['p50_time']:8.2f} ms  p95 {1000*s['p95_time']:8.2f} ms{flag}  {s['template'][:100]}")
+
+
+class ProfiledCursor(object):
+    def __init__(self, cursor: sqlite3.Cursor, connection: sqlite3.Connection, profiler: SqlProfiler):
+        """ A cursor whose statements are recorded by profiler. The time and rows of a statement
+        include the fetching of its rows, until the next statement.
+        """
+        self._cursor = cursor
+        self._connection = connection
+        self._profiler = profiler
+        self._record = None
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def _run(self, record: dict, function, *args):
+        self._record = record
+        t0 = time.perf_counter()
+        try:
+            function(*args)
+        finally:
+            record["time"] += time.perf_counter() - t0
+            if self._cursor.rowcount > 0:
+                record["rows"] += self._cursor.rowcount
+        return self
+
+    def execute(self, sql: str, parameters=()):
+        return self._run(self._profiler.start(self._connection, sql, parameters), self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self._run(self._profiler.start(self._connection, sql, many=True), self._cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str):
+        return self._run(self._profiler.start(self._connection, sql_script, many=True), self._cursor.executescript, sql_script)
+
+    def _fetch(self, function, *args):
+        t0 = time.perf_counter()
+        rows = function(*args)
+        if self._record is not None:
+            self._record["time"] += time.perf_counter() - t0
+            self._record["rows"] += len(rows) if isinstance(rows, list) else (0 if rows is None else 1)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size: int|None=None):
+        return self._fetch(self._cursor.fetchmany) if size is None else self._fetch(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ProfiledConnection(object):
+    def __init__(self, connection: sqlite3.Connection, profiler: SqlProfiler):
+        """ A connection whose statements (and the ones of its cursors) are recorded by profiler.
+        Everything else is forwarded to connection.
+        """
+        self._connection = connection
+        self._profiler = profiler
+
+    def __getattr__(self, name: str):
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._connection.__exit__(*args)
+
+    def cursor(self) -> ProfiledCursor:
+        return ProfiledCursor(self._connection.cursor(), self._connection, self._profiler)
+
+    def execute(self, sql: str, parameters=()) -> ProfiledCursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> ProfiledCursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str) -> ProfiledCursor:
+        return self.cursor().executescript(sql_script)
+
+
+_profiler = None
+
+def get_sql_profiler() -> SqlProfiler|None:
+    """ The profiler, None if not enabled. """
+    return _profiler
+
+def enable_sql_profiler(explain: bool=True) -> SqlProfiler:
+    """ Enable the profiler for the connections made from now on (see profiled). """
+    global _profiler
+    if _profiler is None:
+        _profiler = SqlProfiler(explain=explain)
+    return _profiler
+
+def disable_sql_profiler() -> None:
+    """ The connections made from now on are not profiled (the ones already made still are). """
+    global _profiler
+    _profiler = None
+
+def profiled(connection: sqlite3.Connection) -> sqlite3.Connection:
+    """ connection, wrapped by a ProfiledConnection if the profiler is enabled. """
+    if _profiler is None or isinstance(connection, ProfiledConnection):
+        return connection
+    return ProfiledConnection(connection, _profiler)
+
+
+def _dump_at_exit(file_path: str) -> None:
+    if _profiler is not None:
+        _profiler.dump_json(file_path)
+        print(f"SQL profile written to {file_path}")
+
+if os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, "") not in ["", "0"]:
+    # JA_SQL_PROFILE=1 only enables the profiler, JA_SQL_PROFILE=path/to/file.json also dumps it at exit
+    enable_sql_profiler()
+    if os.environ[PROFILE_ENVIRONMENT_VARIABLE] != "1":
+        atexit.register(_dump_at_exit, os.environ[PROFILE_ENVIRONMENT_VARIABLE])
+
+
+if __name__ == "__main__":
+    # profile the indicators on a ja database, e.g.
+    # python -m ja_implemental_dashboard.v2.database.profiler path/to/database.jasqlite3 [profile.json]
+    if len(sys.argv) < 2:
+        print("Usage: python -m ja_implemental_dashboard.v2.database.profiler path/to/database.jasqlite3 [profile.json]")
+        sys.exit(1)
+    from .database import DISEASE_CODE_TO_DB_CODE
+    from ..indicator.widget_texts import AGE_WIDGET_INTERVALS
+    from ..indicator.evaluation.engine import EVALUATION_INDICATORS_EVENTS, evaluate_indicator_json, get_years_of_inclusion
+    from ..indicator.monitoring.engine import MONITORING_INDICATORS_FUNCTIONS
+    profiler_ = enable_sql_profiler()
+    connection_ = profiled(sqlite3.connect(sys.argv[1]))
+    selection_ = dict(
+        age=[AGE_WIDGET_INTERVALS[list(AGE_WIDGET_INTERVALS.keys())[0]]],
+        gender="A", civil_status="All", job_condition="All", educational_level="All"
+    )
+    t0_ = time.time()
+    for disease_code_, disease_db_code_ in DISEASE_CODE_TO_DB_CODE.items():
+        years_ = get_years_of_inclusion(connection_, disease_db_code_)
+        for indicator_code_, function_ in MONITORING_INDICATORS_FUNCTIONS.items():
+            for year_ in years_:
+                function_(connection=connection_, cohorts_required=True, disease_db_code=disease_db_code_, year_of_inclusion=year_, **selection_)
+        for indicator_code_, events_ in EVALUATION_INDICATORS_EVENTS.items():
+            if events_["disease_db_code"] is not None and events_["disease_db_code"] != disease_db_code_:
+                continue
+            evaluate_indicator_json(indicator_code_, connection_, disease_code_, "_a_", max_workers=1, **selection_)
+    print(f"Indicators computed in {time.time() - t0_:.1f} s")
+    profiler_.print_summary()
+    if len(sys.argv) > 2:
+        profiler_.dump_json(sys.argv[2], include_records=True)
+        print(f"SQL profile written to {sys.argv[2]}")
+    connection_.close()
@@ -0,0 +1,185 @@
+import os, sys, time
+import sqlite3
+import threading
+
+from .profiler import profiled
+from ..caching.database import get_cache_folder
+
+# Handle to the database of the dashboard.
+#
+# Importing the dashboard modules must not do anything with the database: the
+# database file is chosen, and preprocessed into the ja database (see pipeline),
+# only when the connection is first needed, or when prepare() is called explicitly.
+#
+# The database file is, in order of precedence:
+# - the path given to DatabaseSession.open (e.g. the --database argument of the dashboard);
+# - the path in the environment variable JA_DATABASE_FILE;
+# - the file selected by the user with a file dialog (tkinter), as a fallback.
+# A ja database (.jasqlite3) already preprocessed can also be given, in which case
+# the pipeline is not run.
+#
+# The tabs of the dashboard are built when the dispatcher is imported, before the
+# database is known: they are given session.lazy_connection(), which behaves as the
+# connection to the ja database and prepares the session at its first use.
+
+DATABASE_FILE_ENVIRONMENT_VARIABLE = "JA_DATABASE_FILE"
+
+
+def ask_database_file_path() -> str|None:
+    """ Ask the user for the database file with a file selection dialog.
+    Returns None if no file was selected.
+    """
+    print("Please select the database file using the file selection dialog that opened.")
+    import tkinter
+    from tkinter import filedialog
+    root = tkinter.Tk()
+    root.withdraw()
+    filedialog_cache_file = os.path.join(get_cache_folder(), "filedialog_last_used_directory.cache")
+    if os.path.exists(filedialog_cache_file):
+        with open(filedialog_cache_file, "r") as f:
+            last_used_dir = f.read()
+    else:
+        last_used_dir = ""
+    if not os.path.exists(last_used_dir):
+        last_used_dir = os.path.expanduser("~")
+    file_path = filedialog.askopenfilename(
+        defaultextension=".sqlite3",
+        filetypes=[("SQLite3 database files", "*.sqlite3")],
+        initialdir=last_used_dir,
+    )
+    root.destroy()
+    if file_path == "" or file_path == ():
+        return None
+    file_path = os.path.normpath(file_path)
+    with open(filedialog_cache_file, "w") as f:
+        f.write(os.path.dirname(file_path))
+    print("Database file selected:\n\t", file_path)
+    return file_path
+
+
+class DatabaseSession(object):
+    def __init__(self, database_file_path: str|None=None):
+        """ The database of the dashboard, opened and preprocessed on first use.
+        database_file_path: str|None
+            The original database (.sqlite3) or a ja database (.jasqlite3).
+            If None, see open.
+        """
+        self.database_file_path = None
+        self.stage_timings = {}
+        self._connection = None
+        self._lock = threading.RLock()
+        if database_file_path is not None:
+            self.open(database_file_path)
+
+    def open(self, database_file_path: str|None=None) -> "DatabaseSession":
+        """ Set the database file, without reading it.
+        If database_file_path is None, it is taken from the environment variable
+        JA_DATABASE_FILE or, if not set, from the file selection dialog.
+        Nothing is done if the session is already open and database_file_path is None.
+        """
+        with self._lock:
+            if database_file_path is None:
+                if self.database_file_path is not None:
+                    return self
+                t0 = time.time()
+                database_file_path = os.environ.get(DATABASE_FILE_ENVIRONMENT_VARIABLE, "")
+                if database_file_path == "":
+                    database_file_path = ask_database_file_path()
+                    if database_file_path is None:
+                        raise ValueError("No database file selected.")
+                self.stage_timings["select_database_file"] = time.time() - t0
+            database_file_path = os.path.normpath(database_file_path)
+            if not os.path.exists(database_file_path):
+                raise ValueError(f"Database file not found: {database_file_path}")
+            if self._connection is not None and database_file_path != self.database_file_path:
+                # another database: the next use prepares it
+                self.close()
+            self.database_file_path = database_file_path
+            return self
+
+    def is_prepared(self) -> bool:
+        return self._connection is not None
+
+    def prepare(self) -> sqlite3.Connection:
+        """ Run the preprocessing pipeline of the database (see pipeline), if not done yet,
+        and connect to the ja database. Prints the time taken by each stage, which are
+        also in stage_timings. Returns the connection to the ja database.
+        """
+        with self._lock:
+            if self._connection is not None:
+                return self._connection
+            self.open()
+            t0 = time.time()
+            if self.database_file_path.endswith(".jasqlite3"):
+                # already preprocessed
+                from ..caching.indicators import initialize_indicators_cache_database
+                initialize_indicators_cache_database()
+                ja_database_file_path = self.database_file_path
+                self.stage_timings["indicators_cache"] = time.time() - t0
+            else:
+                from .pipeline import load_and_preprocess_database
+                from .parallel import get_database_file_path
+                connection = load_and_preprocess_database(self.database_file_path, stage_timings=self.stage_timings)
+                ja_database_file_path = get_database_file_path(connection)
+                connection.close()
+            # the connection can be first used from any thread (e.g. the threads of the plots)
+            self._connection = profiled(sqlite3.connect(ja_database_file_path, check_same_thread=False))
+            print(f"Database session ready in {time.time() - t0:.1f} s: {ja_database_file_path}")
+            return self._connection
+
+    def connection(self) -> sqlite3.Connection:
+        """ The connection to the ja database, preparing the session if needed. """
+        connection = self._connection
+        if connection is None:
+            connection = self.prepare()
+        return connection
+
+    def lazy_connection(self) -> "LazyConnection":
+        """ A stand-in for connection() that prepares the session only when used. """
+        return LazyConnection(self)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                from .parallel import close_read_only_connection_pools
+                close_read_only_connection_pools()
+                self._connection.close()
+                self._connection = None
+            self.stage_timings = {}
+
+
+class LazyConnection(object):
+    def __init__(self, session: DatabaseSession):
+        """ Forwards every attribute (cursor, execute, commit, ...) to the connection
+        of session, which is prepared at the first access.
+        """
+        self._session = session
+
+    def __getattr__(self, name: str):
+        return getattr(self._session.connection(), name)
+
+    def __enter__(self):
+        return self._session.connection().__enter__()
+
+    def __exit__(self, *args):
+        return self._session.connection().__exit__(*args)
+
+    def __repr__(self) -> str:
+        return f"LazyConnection({self._session.database_file_path}, prepared={self._session.is_prepared()})"
+
+
+# the session of the dashboard
+_database_session = DatabaseSession()
+
+def get_database_session() -> DatabaseSession:
+    return _database_session
+
+
+if __name__ == "__main__":
+    # prepare a database without the dashboard, e.g.
+    # python -m ja_implemental_dashboard.v2.database.session path/to/database.sqlite3
+    session_ = get_database_session()
+    session_.open(sys.argv[1] if len(sys.argv) > 1 else None)
+    connection_ = session_.connection()
+    print(connection_.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall())
+    session_.close()
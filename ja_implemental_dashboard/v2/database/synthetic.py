@@ -0,0 +1,271 @@
+import os, sys, time
+import sqlite3
+import numpy
+
+from .database import DATABSE_RECORD_LAYOUT_DATA_TYPES
+
+# Synthetic original databases, to measure how the pipeline and the indicators scale.
+#
+# generate_synthetic_database writes the demographics, diagnoses, interventions, pharma
+# and physical_exams tables of an original database (the input of the dashboard, see
+# DATABSE_RECORD_LAYOUT_DATA_TYPES), for a given number of subjects and random seed:
+# the same scale and seed always give the same database.
+# The records mimic the real data the pipeline has to deal with:
+# - subjects with schizophrenia, depression or bipolar disorder, with other mental disorders,
+#   and with no mental disorder (removed from the ja database by slim_down_database);
+# - ICD9 diagnoses in the first years and ICD10 later, with the codes of the cohorts
+#   definitions (see COHORTS_DEFINITIONS) and some codes not related to mental health;
+# - ATC codes of antipsychotics, lithium, antidepressants and mood stabilizers, and others;
+# - interventions with all the TYPE_INT codes, psychiatric visits the most frequent;
+# - dates in the formats handled by normalize_datetime_columns (mostly ISO 8601),
+#   with a few missing or not convertible ones.
+#
+# Usage (from the repository root):
+# python -m ja_implemental_dashboard.v2.database.synthetic path/to/database.sqlite3 [10k|100k|1M|5M|n_subjects] [seed]
+
+SYNTHETIC_SCALES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1M": 1_000_000,
+    "5M": 5_000_000,
+}
+
+SYNTHETIC_FIRST_YEAR = 2010
+SYNTHETIC_LAST_YEAR = 2022
+# year from which the diagnoses are coded in ICD10 (ICD9 before, with some overlap)
+SYNTHETIC_ICD10_FROM_YEAR = 2016
+
+# groups of subjects: share, diagnoses codes and drugs (ATC)
+SYNTHETIC_SUBJECT_GROUPS = {
+    "SCHIZO": {
+        "share": 0.12,
+        "icd9": ["2950", "2951", "2953", "2956", "2970", "2982", "2989"],
+        "icd10": ["F200", "F201", "F205", "F209", "F21", "F22", "F250", "F29"],
+        "atc": ["N05AA01", "N05AD01", "N05AH03", "N05AH04", "N05AX08", "N05AX12"],
+    },
+    "DEPRE": {
+        "share": 0.25,
+        "icd9": ["2962", "2963", "2980", "3004", "3090", "3091", "311"],
+        "icd10": ["F320", "F321", "F329", "F331", "F339", "F341", "F431"],
+        "atc": ["N06AB04", "N06AB06", "N06AB10", "N06AX16", "N06AX21", "N06AA09"],
+    },
+    "BIPO": {
+        "share": 0.08,
+        "icd9": ["2960", "2961", "2964", "2965", "2966", "29680", "29689"],
+        "icd10": ["F300", "F310", "F311", "F313", "F316", "F319", "F340"],
+        "atc": ["N05AN01", "N03AX09", "N03AG01", "N03AF01", "N05AH04", "N06AB04"],
+    },
+    "OTHER_MENTAL": {
+        # personality and anxiety disorders, suicidal behaviour: in the ja database, in no cohort
+        "share": 0.15,
+        "icd9": ["3010", "3012", "3000", "3001", "3003", "E950"],
+        "icd10": ["F600", "F603", "F410", "F411", "F42", "X60", "X64"],
+        "atc": ["N06AB06", "N05AH03"],
+    },
+    "NOT_MENTAL": {
+        # removed by slim_down_database
+        "share": 0.40,
+        "icd9": ["4019", "2500", "4280", "4910"],
+        "icd10": ["I10", "E119", "I500", "J449"],
+        "atc": ["C09AA02", "A10BA02", "C07AB07", "R03AK06"],
+    },
+}
+# codes not related to mental health that the subjects with mental disorders also have
+SYNTHETIC_OTHER_ICD9 = ["4019", "2500", "4280"]
+SYNTHETIC_OTHER_ICD10 = ["I10", "E119", "I500"]
+SYNTHETIC_OTHER_ATC = ["C09AA02", "A10BA02", "C07AB07"]
+
+# TYPE_INT of the interventions (see INTERVENTIONS_CODES_LANGDICT_MAP) and their frequencies
+SYNTHETIC_INTERVENTION_TYPES = [1, 2, 3, 4, 5, 6, 7, 9]
+SYNTHETIC_INTERVENTION_WEIGHTS = [0.36, 0.04, 0.10, 0.16, 0.04, 0.12, 0.08, 0.10]
+
+# mean number of records per subject with a mental disorder (Poisson)
+SYNTHETIC_MEAN_RECORDS = {
+    "diagnoses": 3.0,
+    "pharma": 8.0,
+    "interventions": 12.0,
+    "physical_exams": 1.0,
+}
+
+# date formats, as handled by normalize_datetime_columns, and their frequencies
+SYNTHETIC_DATE_FORMATS = ["iso", "iso_time", "yyyy/mm/dd", "dd/mm/yyyy", "yyyymmdd", "yymmdd", "missing"]
+SYNTHETIC_DATE_FORMAT_WEIGHTS = [0.80, 0.05, 0.05, 0.04, 0.04, 0.01, 0.01]
+
+SYNTHETIC_CIVIL_STATUS = ["Unmarried", "Married", "Married_no_long", "Other", None]
+SYNTHETIC_CIVIL_STATUS_WEIGHTS = [0.40, 0.35, 0.10, 0.10, 0.05]
+SYNTHETIC_JOB_CONDITION = ["Employed", "Unemployed", "Pension", None]
+SYNTHETIC_JOB_CONDITION_WEIGHTS = [0.40, 0.25, 0.25, 0.10]
+SYNTHETIC_EDUCATIONAL_LEVEL = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, None]
+SYNTHETIC_EDUCATIONAL_LEVEL_WEIGHTS = [0.02, 0.08, 0.25, 0.30, 0.08, 0.05, 0.10, 0.03, 0.01, 0.06, 0.02]
+
+
+def get_synthetic_table_columns() -> dict[str, list[str]]:
+    """ The columns of the original database tables: the ones of the record layout. """
+    return {table: list(columns.keys()) for table, columns in DATABSE_RECORD_LAYOUT_DATA_TYPES.items()}
+
+def _format_dates(rng: numpy.random.Generator, days: numpy.ndarray) -> list[str|None]:
+    """ Dates (days since 1970-01-01) as strings, in the formats of SYNTHETIC_DATE_FORMATS. """
+    iso = numpy.datetime_as_string(days.astype("datetime64[D]"), unit="D")
+    formats = rng.choice(len(SYNTHETIC_DATE_FORMATS), size=len(days), p=SYNTHETIC_DATE_FORMAT_WEIGHTS)
+    out = []
+    for d, f in zip(iso.tolist(), formats.tolist()):
+        y, m, dd = d[:4], d[5:7], d[8:10]
+        name = SYNTHETIC_DATE_FORMATS[f]
+        if name == "iso":
+            out.append(d)
+        elif name == "iso_time":
+            out.append(f"{d} 00:00:00")
+        elif name == "yyyy/mm/dd":
+            out.append(f"{y}/{m}/{dd}")
+        elif name == "dd/mm/yyyy":
+            out.append(f"{dd}/{m}/{y}")
+        elif name == "yyyymmdd":
+            out.append(f"{y}{m}{dd}")
+        elif name == "yymmdd":
+            # cannot be converted: dropped by the pipeline
+            out.append(f"{y[2:]}{m}{dd}")
+        else:
+            out.append(None)
+    return out
+
+def _days(year: numpy.ndarray|int) -> numpy.ndarray:
+    return (numpy.asarray(year, dtype="int64") - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype("int64")
+
+def _generate_batch(rng: numpy.random.Generator, first_id: int, n: int, first_year: int, last_year: int) -> dict[str, list[tuple]]:
+    groups = list(SYNTHETIC_SUBJECT_GROUPS.keys())
+    group = rng.choice(len(groups), size=n, p=[g["share"] for g in SYNTHETIC_SUBJECT_GROUPS.values()])
+    ids = numpy.arange(first_id, first_id + n)
+    day_first = _days(first_year)
+    day_end = _days(last_year + 1)
+    rows = {t: [] for t in ["demographics", "diagnoses", "pharma", "interventions", "physical_exams"]}
+    # demographics
+    birth = _days(rng.integers(1935, 2008, size=n)) + rng.integers(0, 365, size=n)
+    dead = rng.random(n) < 0.08
+    death = rng.integers(day_first, day_end, size=n)
+    birth_s = numpy.datetime_as_string(birth.astype("datetime64[D]"), unit="D").tolist()
+    death_s = numpy.datetime_as_string(death.astype("datetime64[D]"), unit="D").tolist()
+    start_assist_s = numpy.datetime_as_string((day_first - rng.integers(0, 3650, size=n)).astype("datetime64[D]"), unit="D").tolist()
+    gender = rng.choice(["M", "F", "U"], size=n, p=[0.48, 0.50, 0.02]).tolist()
+    civil_status = rng.choice(len(SYNTHETIC_CIVIL_STATUS), size=n, p=SYNTHETIC_CIVIL_STATUS_WEIGHTS).tolist()
+    job_condition = rng.choice(len(SYNTHETIC_JOB_CONDITION), size=n, p=SYNTHETIC_JOB_CONDITION_WEIGHTS).tolist()
+    educational_level = rng.choice(len(SYNTHETIC_EDUCATIONAL_LEVEL), size=n, p=SYNTHETIC_EDUCATIONAL_LEVEL_WEIGHTS).tolist()
+    suicide = rng.random(n) < 0.1
+    for i in range(n):
+        rows["demographics"].append((
+            int(ids[i]), birth_s[i], gender[i],
+            death_s[i] if dead[i] else None,
+            ("X60" if suicide[i] else "I10") if dead[i] else None, None,
+            start_assist_s[i], death_s[i] if dead[i] else None,
+            SYNTHETIC_CIVIL_STATUS[civil_status[i]], SYNTHETIC_JOB_CONDITION[job_condition[i]],
+            SYNTHETIC_EDUCATIONAL_LEVEL[educational_level[i]],
+        ))
+    # records of the other tables: the subjects with no mental disorder have fewer records,
+    # no interventions, and their records are not related to mental health
+    mental = group != groups.index("NOT_MENTAL")
+    # the records of a subject start from the onset of the disorder
+    onset = rng.integers(day_first - 3 * 365, day_end - 30, size=n)
+    for table, mean in SYNTHETIC_MEAN_RECORDS.items():
+        counts = rng.poisson(numpy.where(mental, mean, 0 if table == "interventions" else mean / 3))
+        subject = numpy.repeat(numpy.arange(n), counts)
+        if len(subject) == 0:
+            continue
+        days = onset[subject] + rng.integers(0, 6 * 365, size=len(subject))
+        days = numpy.clip(days, day_first - 3 * 365, day_end - 1)
+        dates = _format_dates(rng, days)
+        years = days.astype("datetime64[D]").astype("datetime64[Y]").astype("int64") + 1970
+        u = rng.random(len(subject))
+        k = rng.integers(0, 1 << 30, size=len(subject))
+        subject_ids = ids[subject].tolist()
+        subject_groups = group[subject].tolist()
+        if table == "diagnoses":
+            setting = rng.choice(["OUTP", "INP", "ER"], size=len(subject), p=[0.7, 0.2, 0.1]).tolist()
+            for j in range(len(subject)):
+                g = SYNTHETIC_SUBJECT_GROUPS[groups[subject_groups[j]]]
+                icd10 = years[j] > SYNTHETIC_ICD10_FROM_YEAR or (years[j] == SYNTHETIC_ICD10_FROM_YEAR and u[j] < 0.5)
+                if u[j] < 0.15:
+                    codes = SYNTHETIC_OTHER_ICD10 if icd10 else SYNTHETIC_OTHER_ICD9
+                else:
+                    codes = g["icd10"] if icd10 else g["icd9"]
+                inpatient = setting[j] == "INP"
+                rows["diagnoses"].append((
+                    subject_ids[j], codes[k[j] % len(codes)], "ICD10" if icd10 else "ICD9", dates[j],
+                    "Y" if u[j] < 0.8 else "N", None, setting[j],
+                    dates[j] if inpatient else None, dates[j] if inpatient else None,
+                    "PUBLIC" if inpatient else None, "URGENT" if inpatient and u[j] < 0.3 else None,
+                ))
+        elif table == "pharma":
+            for j in range(len(subject)):
+                g = SYNTHETIC_SUBJECT_GROUPS[groups[subject_groups[j]]]
+                codes = SYNTHETIC_OTHER_ATC if u[j] < 0.1 else g["atc"]
+                n_days = float(30 * (1 + k[j] % 3))
+                rows["pharma"].append((subject_ids[j], dates[j], codes[k[j] % len(codes)], float(1 + k[j] % 2), n_days, n_days))
+        elif table == "interventions":
+            types = rng.choice(SYNTHETIC_INTERVENTION_TYPES, size=len(subject), p=SYNTHETIC_INTERVENTION_WEIGHTS).tolist()
+            for j in range(len(subject)):
+                rows["interventions"].append((subject_ids[j], dates[j], types[j], f"S{k[j] % 50:02d}", int(k[j] % 400), None, None))
+        elif table == "physical_exams":
+            for j in range(len(subject)):
+                rows["physical_exams"].append((subject_ids[j], dates[j], int(1 + k[j] % 5)))
+    return rows
+
+def generate_synthetic_database(output_db_file: str, n_subjects: int|str, seed: int=0, first_year: int=SYNTHETIC_FIRST_YEAR, last_year: int=SYNTHETIC_LAST_YEAR, batch_size: int=20_000) -> dict:
+    """ Write a synthetic original database with n_subjects subjects
+    (or a scale of SYNTHETIC_SCALES, e.g. "100k") in output_db_file, which is overwritten.
+    The same n_subjects, seed and years always give the same database.
+    Returns a dict with the number of records of each table and the time taken.
+    """
+    t0 = time.time()
+    if isinstance(n_subjects, str):
+        if n_subjects not in SYNTHETIC_SCALES:
+            raise ValueError(f"Unknown scale '{n_subjects}', must be among {list(SYNTHETIC_SCALES.keys())} or a number of subjects")
+        n_subjects = SYNTHETIC_SCALES[n_subjects]
+    if n_subjects < 1:
+        raise ValueError(f"n_subjects must be at least 1, got {n_subjects}")
+    if first_year > last_year:
+        raise ValueError(f"first_year ({first_year}) must not be after last_year ({last_year})")
+    if os.path.exists(output_db_file):
+        os.remove(output_db_file)
+    columns = get_synthetic_table_columns()
+    connection = sqlite3.connect(output_db_file)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    cursor = connection.cursor()
+    for table, table_columns in columns.items():
+        types = DATABSE_RECORD_LAYOUT_DATA_TYPES[table]
+        cursor.execute(f"CREATE TABLE {table} ({', '.join([f'{c} {types[c]}' for c in table_columns])})")
+    # one generator per batch, from the seed and the batch number: the database does not
+    # depend on how the batches are scheduled
+    n_records = {table: 0 for table in columns}
+    for first in range(0, n_subjects, batch_size):
+        rng = numpy.random.default_rng([seed, first // batch_size])
+        rows = _generate_batch(rng, 1 + first, min(batch_size, n_subjects - first), first_year, last_year)
+        for table, table_rows in rows.items():
+            cursor.executemany(f"INSERT INTO {table} VALUES ({', '.join(['?'] * len(columns[table]))})", table_rows)
+            n_records[table] += len(table_rows)
+        connection.commit()
+        print(f"Generating synthetic database: {min(first + batch_size, n_subjects):,d}/{n_subjects:,d} subjects ({time.time() - t0:.0f} s)", end="\r")
+    print()
+    cursor.close()
+    connection.close()
+    return {
+        "n_subjects": n_subjects,
+        "seed": seed,
+        "n_records": n_records,
+        "file_size": os.path.getsize(output_db_file),
+        "time": time.time() - t0,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m ja_implemental_dashboard.v2.database.synthetic path/to/database.sqlite3 [10k|100k|1M|5M|n_subjects] [seed]")
+        sys.exit(1)
+    scale_ = sys.argv[2] if len(sys.argv) > 2 else "10k"
+    output_ = generate_synthetic_database(
+        output_db_file=sys.argv[1],
+        n_subjects=int(scale_) if scale_.isdigit() else scale_,
+        seed=int(sys.argv[3]) if len(sys.argv) > 3 else 0,
+    )
+    print(f"{output_['n_subjects']:,d} subjects, {output_['file_size'] / 1e6:.1f} MB in {output_['time']:.1f} s:")
+    for table_, n_ in output_["n_records"].items():
+        print(f"\t{table_:<16} {n_:>12,d} records")
@@ -0,0 +1 @@
+from .diagnostics import Diagnostics
\ No newline at end of file
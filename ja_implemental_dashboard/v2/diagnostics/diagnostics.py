@@ -0,0 +1,61 @@
+import io
+import json
+import pandas
+import panel
+from .._panel_settings import PANEL_EXTENSION, PANEL_TEMPLATE, PANEL_SIZING_MODE
+panel.extension(
+    PANEL_EXTENSION,
+    template=PANEL_TEMPLATE,
+    sizing_mode=PANEL_SIZING_MODE
+)
+
+from ..database.profiler import SqlProfiler
+
+# Diagnostics section of the dashboard, with the statistics of the SQL statements
+# recorded by the profiler (see database.profiler). It is added to the dashboard only
+# when the profiler is enabled (environment variable JA_SQL_PROFILE).
+
+class Diagnostics(object):
+    def __init__(self, profiler: SqlProfiler):
+        self._profiler = profiler
+        self._refresh_button = panel.widgets.Button(name="Refresh", button_type="light", width=100)
+
+    def _get_table(self, *events) -> panel.viewable.Viewable:
+        summary = self._profiler.get_summary()
+        if len(summary) == 0:
+            return panel.pane.HTML("<p>No SQL statement recorded yet.</p>")
+        df = pandas.DataFrame([
+            {
+                "total [s]": round(s["total_time"], 3),
+                "count": s["count"],
+                "p50 [ms]": round(1000 * s["p50_time"], 2),
+                "p95 [ms]": round(1000 * s["p95_time"], 2),
+                "max [ms]": round(1000 * s["max_time"], 2),
+                "rows": s["rows"],
+                "full scan": "yes" if s["full_table_scan"] else "",
+                "template": s["template"][:300],
+                "plan": " | ".join(s["plan"] or []),
+            }
+            for s in summary
+        ])
+        n_statements = sum([s["count"] for s in summary])
+        return panel.Column(
+            panel.pane.HTML(f"<p>{n_statements:,d} statements, {len(summary):,d} templates, slowest in total first.</p>"),
+            panel.pane.DataFrame(df, index=False, max_rows=200, sizing_mode="stretch_width"),
+        )
+
+    def _get_json(self) -> io.StringIO:
+        return io.StringIO(json.dumps(self._profiler.to_dict(include_records=True), indent=1))
+
+    def get_panel(self, **kwargs) -> panel.viewable.Viewable:
+        return panel.Card(
+            panel.Row(
+                self._refresh_button,
+                panel.widgets.FileDownload(callback=self._get_json, filename="sql_profile.json", button_type="light", width=200),
+            ),
+            panel.bind(self._get_table, self._refresh_button),
+            title="Diagnostics: SQL statements",
+            collapsed=True,
+            sizing_mode="stretch_width",
+            styles={"margin-bottom": "60px"},
+        )
@@ -0,0 +1,249 @@
+"""
+Headless export of the indicators, without the dashboard.
+
+Runs the preprocessing pipeline of the database (as the dashboard does at start up,
+see database.session) and computes the indicators on a grid of widget states,
+using only the computation logic of the indicators (indicator.evaluation.engine and
+indicator.monitoring.engine): no panel, bokeh or tkinter is imported, so it can run
+on a server without a display.
+
+Usage (from the repository root):
+python -m ja_implemental_dashboard.v2 export --db path/to/database.sqlite3 --out path/to/folder
+    [--format csv,json,parquet] [--indicators EA1,MA1,...] [--diseases _depression_,...]
+    [--cohorts _a_,_b_,_c_] [--max-depth 0] [--workers N]
+
+--db can also be a ja database (.jasqlite3) already preprocessed by the dashboard,
+in which case the pipeline is not run.
+The grid of widget states is the one of caching.precompute: --max-depth 0 (default)
+exports only the default state (all ages, genders, ...), 1 also the states with one
+selector changed, and so on (-1 for the whole grid).
+
+Two tables are written in the output folder, in each of the requested formats:
+- series: one row per indicator, disease, cohort, widget state, year and measure,
+  with the value of the measure (e.g. the percentage of EA1, the number of patients of MA1,
+  or the mean of a distribution);
+- distributions: one row per indicator, disease, cohort, widget state, year and
+  distribution (e.g. the number of events per patient of EA1), with its histogram
+  as a JSON list of [value, number of patients] pairs (see indicator.histogram).
+"""
+
+import os, sys, time
+import argparse
+import importlib.util
+import json
+import csv
+
+EXPORT_FORMATS = ["csv", "json", "parquet"]
+
+SERIES_COLUMNS = [
+    "indicator", "disease", "cohort", "age", "gender", "civil_status",
+    "job_condition", "educational_level", "year", "measure", "value"
+]
+DISTRIBUTIONS_COLUMNS = [
+    "indicator", "disease", "cohort", "age", "gender", "civil_status",
+    "job_condition", "educational_level", "year", "distribution", "histogram"
+]
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m ja_implemental_dashboard.v2 export",
+        description="Export the indicators of the dashboard without the graphical interface."
+    )
+    parser.add_argument("--db", required=True, help="The original database (.sqlite3), or a ja database (.jasqlite3) already preprocessed.")
+    parser.add_argument("--out", required=True, help="Output folder (created if it does not exist).")
+    parser.add_argument("--format", default="csv", help=f"Comma separated output formats, among {','.join(EXPORT_FORMATS)} (default: csv).")
+    parser.add_argument("--indicators", default=None, help="Comma separated indicators (default: all), e.g. EA1,EA6-0,MA1,MB2.")
+    parser.add_argument("--diseases", default=None, help="Comma separated diseases (default: all), e.g. _depression_.")
+    parser.add_argument("--cohorts", default=None, help="Comma separated cohorts of the evaluation indicators (default: _a_,_b_,_c_).")
+    parser.add_argument("--max-depth", type=int, default=0, help="Maximum number of widget selectors changed from 'All' (default 0, -1 for the whole grid).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parallel read-only connections (default: number of CPUs).")
+    return parser
+
+def _split_option(value: str|None, allowed: list[str], name: str) -> list[str]:
+    if value is None:
+        return list(allowed)
+    values = [v.strip() for v in value.split(",") if v.strip() != ""]
+    for v in values:
+        if v not in allowed:
+            raise ValueError(f"Unknown {name} '{v}', must be among {allowed}")
+    return values
+
+
+def check_formats(formats: list[str]) -> None:
+    """ Fail before computing anything if an output format cannot be written. """
+    for f in formats:
+        if f not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{f}', must be among {EXPORT_FORMATS}")
+    if "parquet" in formats:
+        if importlib.util.find_spec("pyarrow") is None and importlib.util.find_spec("fastparquet") is None:
+            raise ValueError("Parquet output requires pyarrow or fastparquet to be installed.")
+
+
+def export_indicators(connection, out_folder: str, formats: list[str], indicator_codes: list[str], disease_codes: list[str], cohort_codes: list[str], max_depth: int|None=0, max_workers: int|None=None) -> dict:
+    """ Compute the indicators on the grid and write the series and distributions tables
+    in out_folder. Returns a dict with the number of rows of the tables, the written files
+    and the time taken.
+    """
+    from .database.database import DISEASE_CODE_TO_DB_CODE
+    from .database.parallel import map_years
+    from .caching.precompute import get_widget_states
+    from .caching.indicators import get_indicators_cache_client
+    from .indicator.widget_texts import AGE_WIDGET_INTERVALS
+    from .indicator.histogram import histogram_from_values, histogram_statistics
+    from .indicator.evaluation.engine import EVALUATION_INDICATORS_EVENTS, evaluate_indicator_json, get_years_of_inclusion
+    from .indicator.monitoring.engine import MONITORING_INDICATORS_FUNCTIONS
+    t0 = time.time()
+    check_formats(formats)
+    states = get_widget_states(max_depth)
+    series = []
+    distributions = []
+    def add_distribution(row: dict, name: str, histogram: list[list[int]]) -> None:
+        distributions.append({**row, "distribution": name, "histogram": json.dumps(histogram)})
+        statistics = histogram_statistics(histogram)
+        for k in ["count", "mean", "median", "q1", "q3"]:
+            series.append({**row, "measure": f"{name}_{k}", "value": statistics[k]})
+    n_calls = 0
+    for disease_code in disease_codes:
+        disease_db_code = DISEASE_CODE_TO_DB_CODE[disease_code]
+        years = get_years_of_inclusion(connection, disease_db_code)
+        for state in states:
+            selection = {
+                "age": [AGE_WIDGET_INTERVALS[a] for a in state["age"]],
+                "gender": state["gender"],
+                "civil_status": state["civil_status"],
+                "job_condition": state["job_condition"],
+                "educational_level": state["educational_level"],
+            }
+            state_columns = {
+                "disease": disease_code,
+                "age": "|".join(state["age"]),
+                "gender": state["gender"],
+                "civil_status": state["civil_status"],
+                "job_condition": state["job_condition"],
+                "educational_level": state["educational_level"],
+            }
+            for indicator_code in indicator_codes:
+                # evaluation indicators: all years at once, through the indicators cache
+                if indicator_code in EVALUATION_INDICATORS_EVENTS:
+                    fixed_disease_db_code = EVALUATION_INDICATORS_EVENTS[indicator_code]["disease_db_code"]
+                    if fixed_disease_db_code is not None and fixed_disease_db_code != disease_db_code:
+                        # the indicator is only defined for another disease
+                        continue
+                    for cohort_code in cohort_codes:
+                        x, y = get_indicators_cache_client().get_or_compute_decoded(
+                            indicator_name=indicator_code,
+                            compute=lambda: evaluate_indicator_json(
+                                indicator_code=indicator_code, connection=connection,
+                                disease_code=disease_code, cohort_code=cohort_code,
+                                max_workers=max_workers, **selection
+                            ),
+                            disease_code=disease_code,
+                            cohort=cohort_code,
+                            age_interval=selection["age"],
+                            gender=selection["gender"],
+                            civil_status=selection["civil_status"],
+                            job_condition=selection["job_condition"],
+                            educational_level=selection["educational_level"]
+                        )
+                        n_calls += 1
+                        for year, percentage, histogram in zip(x, y["percentage"], y["histogram"]):
+                            row = {"indicator": indicator_code, "cohort": cohort_code, **state_columns, "year": int(year)}
+                            series.append({**row, "measure": "percentage", "value": float(percentage)})
+                            add_distribution(row, "events", histogram)
+                # monitoring indicators: one year at a time, years in parallel
+                else:
+                    function = MONITORING_INDICATORS_FUNCTIONS[indicator_code]
+                    def evaluate_year_(connection_, year: int) -> dict:
+                        return function(
+                            connection=connection_,
+                            cohorts_required=True,
+                            disease_db_code=disease_db_code,
+                            year_of_inclusion=year,
+                            **selection
+                        )
+                    outputs = map_years(connection, evaluate_year_, years, max_workers=max_workers)
+                    n_calls += 1
+                    for year, output in zip(years, outputs):
+                        row = {"indicator": indicator_code, "cohort": "", **state_columns, "year": int(year)}
+                        for key, value in output.items():
+                            if isinstance(value, list):
+                                # MB2: number of interventions per patient, by type of intervention
+                                name = "any_type" if key == "any_type" else f"type_{key}"
+                                add_distribution(row, name, histogram_from_values(value))
+                            else:
+                                series.append({**row, "measure": str(key), "value": value})
+            print(f"Exporting indicators: {n_calls:,d} calls, {len(series):,d} rows ({time.time() - t0:.1f} s)", end="\r")
+    print()
+    # write
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    files = []
+    for name, rows, columns in [("series", series, SERIES_COLUMNS), ("distributions", distributions, DISTRIBUTIONS_COLUMNS)]:
+        for f in formats:
+            file_path = os.path.join(out_folder, f"{name}.{f}")
+            write_table(file_path, rows, columns, f)
+            files.append(file_path)
+    return {
+        "n_series_rows": len(series),
+        "n_distributions_rows": len(distributions),
+        "files": files,
+        "time": time.time() - t0,
+    }
+
+def write_table(file_path: str, rows: list[dict], columns: list[str], format: str) -> None:
+    """ Write the rows (dicts with the given columns) as csv, json (list of records) or parquet. """
+    if format == "csv":
+        with open(file_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif format == "json":
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+    elif format == "parquet":
+        import pandas
+        try:
+            pandas.DataFrame(rows, columns=columns).to_parquet(file_path, index=False)
+        except ImportError as e:
+            raise ValueError(f"Parquet output requires pyarrow or fastparquet to be installed ({e})") from e
+    else:
+        raise ValueError(f"Unknown format '{format}', must be among {EXPORT_FORMATS}")
+
+
+def main(argv: list[str]) -> int:
+    args = get_argument_parser().parse_args(argv)
+    print(f"Exporting the indicators of {args.db} to {args.out}")
+    t0 = time.time()
+    from .database.session import DatabaseSession
+    from .database.database import DISEASE_CODE_TO_DB_CODE
+    from .indicator.evaluation.engine import EVALUATION_INDICATORS_EVENTS
+    from .indicator.monitoring.engine import MONITORING_INDICATORS_FUNCTIONS
+    if not os.path.exists(args.db):
+        raise ValueError(f"Database file not found: {args.db}")
+    formats = _split_option(args.format, EXPORT_FORMATS, "format")
+    check_formats(formats)
+    indicator_codes = _split_option(args.indicators, list(MONITORING_INDICATORS_FUNCTIONS.keys()) + list(EVALUATION_INDICATORS_EVENTS.keys()), "indicator")
+    disease_codes = _split_option(args.diseases, list(DISEASE_CODE_TO_DB_CODE.keys()), "disease")
+    cohort_codes = _split_option(args.cohorts, ["_a_", "_b_", "_c_"], "cohort")
+    session = DatabaseSession(args.db)
+    connection = session.connection()
+    output = export_indicators(
+        connection=connection,
+        out_folder=args.out,
+        formats=formats,
+        indicator_codes=indicator_codes,
+        disease_codes=disease_codes,
+        cohort_codes=cohort_codes,
+        max_depth=None if args.max_depth < 0 else args.max_depth,
+        max_workers=args.workers,
+    )
+    session.close()
+    print(f"Exported {output['n_series_rows']:,d} series rows and {output['n_distributions_rows']:,d} distributions rows in {time.time() - t0:.1f} s:")
+    for file_path in output["files"]:
+        print("\t", file_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,167 @@
+import asyncio
+import sqlite3
+import param
+import panel
+from .._panel_settings import PANEL_EXTENSION, PANEL_TEMPLATE, PANEL_SIZING_MODE
+panel.extension(
+    PANEL_EXTENSION,
+    template=PANEL_TEMPLATE,
+    sizing_mode=PANEL_SIZING_MODE
+)
+
+from ..database.parallel import (
+    get_read_only_connection_pool, get_max_workers,
+    CancellationToken, ComputationCancelled, reporting_progress
+)
+from ..loading.loading import loading_state
+
+# Non-blocking plots of the indicator tabs.
+#
+# The get_plot methods of the tabs compute the indicator (or read it from the cache)
+# and make the plot synchronously: bound with panel.bind(self.get_plot, ...), they
+# run on the event loop of the Bokeh server, which freezes all the sessions while an
+# indicator is computed, and every intermediate state of the widgets (e.g. clicking
+# through several age buttons) is computed and rendered in turn.
+#
+# AsyncPlot(tab.get_plot).get_plot is an async generator to be bound instead:
+# - get_plot runs in a thread of the "plots" pool of read-only connections to the
+#   ja database (database.parallel), with the connection passed as the connection kwarg;
+# - if the plot is not ready within PLACEHOLDER_DELAY seconds, a placeholder is shown;
+# - when the widgets change again, the computation of the previous state is cancelled
+#   (its SQLite statements are interrupted) and only the latest state is rendered.
+#
+# The plots are also rendered lazily: lazy_bind binds get_plot so that it is evaluated
+# only when its pane is first displayed, and the indicator tabs are dynamic
+# (see indicator_panel.IndicatorPanel), so the plots of the tabs that are not
+# active are not computed. plot_counter counts the plots computed for each interaction.
+# While computed, a plot is a task of loading.loading_state, which reports the progress
+# of its years of inclusion (see database.parallel.reporting_progress).
+
+PLACEHOLDER_DELAY = 0.15
+
+_placeholder_text_langdict = {
+    "en": "Computing the indicator...",
+    "it": "Calcolo dell'indicatore...",
+    "fr": "Calcul de l'indicateur...",
+    "de": "Berechnung des Indikators...",
+    "es": "Calculando el indicador...",
+    "pt": "Calculando o indicador..."
+}
+
+def get_placeholder(language_code: str="en") -> panel.viewable.Viewable:
+    return panel.Column(
+        panel.indicators.LoadingSpinner(value=True, size=40, name=_placeholder_text_langdict.get(language_code, _placeholder_text_langdict["en"])),
+        height=350,
+        sizing_mode="stretch_width",
+    )
+
+
+class PlotCounter(param.Parameterized):
+    """ Number of plots computed (and cancelled) since the last interaction of the user:
+    a change of the main selectors (see dispatcher.Dispatcher) or of the widgets of a tab.
+    """
+    interaction = param.String(default="")
+    computed = param.Integer(default=0)
+    cancelled = param.Integer(default=0)
+    total_computed = param.Integer(default=0)
+
+    def start_interaction(self, description: str) -> None:
+        if self.computed > 0 or self.cancelled > 0:
+            print(f"Plots computed for '{self.interaction}': {self.computed} ({self.cancelled} cancelled)")
+        self.param.update(interaction=description, computed=0, cancelled=0)
+
+    def add_computed(self) -> None:
+        self.param.update(computed=self.computed + 1, total_computed=self.total_computed + 1)
+
+    def add_cancelled(self) -> None:
+        self.cancelled += 1
+
+    def _get_text(self, computed: int, cancelled: int, total_computed: int) -> str:
+        return f"<p style='color: #999999; font-size: 0.7em; margin: 0;'>Plots computed: {computed} ({cancelled} cancelled), {total_computed} in total.</p>"
+
+    def get_panel(self, **kwargs) -> panel.viewable.Viewable:
+        return panel.pane.HTML(
+            panel.bind(self._get_text, self.param.computed, self.param.cancelled, self.param.total_computed),
+            styles={"margin": "auto"}
+        )
+
+plot_counter = PlotCounter()
+
+
+def lazy_bind(function, **kwargs) -> panel.param.ParamFunction:
+    """ Same as panel.bind, but the function is evaluated only when the pane
+    is displayed for the first time (e.g. when its tab is activated).
+    """
+    return panel.param.ParamFunction(panel.bind(function, **kwargs), lazy=True)
+
+
+class AsyncPlot(object):
+    def __init__(self, get_plot, db_conn: sqlite3.Connection):
+        """ Non-blocking version of the get_plot method of a tab.
+        get_plot: callable
+            Must accept the connection to use as the connection kwarg.
+        db_conn: sqlite3.Connection
+            The connection of the tab: the plots are computed on read-only connections to
+            its database file (on db_conn itself, in the event loop, if it is in memory).
+        """
+        self._get_plot = get_plot
+        self._db_conn = db_conn
+        self._token = None
+        self._running = False
+        self.n_cancelled = 0
+
+    def _supersede(self) -> CancellationToken:
+        if self._token is not None:
+            # the widgets of the tab changed: new interaction
+            plot_counter.start_interaction(f"{getattr(self._get_plot, '__self__', self._get_plot).__class__.__name__} widgets")
+            # cancel the computation of the previous state, if still running
+            if self._running and not self._token.is_cancelled():
+                self._token.cancel()
+                self.n_cancelled += 1
+                plot_counter.add_cancelled()
+        self._token = CancellationToken()
+        return self._token
+
+    async def get_plot(self, **kwargs):
+        token = self._supersede()
+        pool = get_read_only_connection_pool(self._db_conn, max_workers=max(2, get_max_workers()), usage="plots")
+        if pool is None:
+            out = self._get_plot(connection=self._db_conn, **kwargs)
+            plot_counter.add_computed()
+            yield out
+            return
+        self._running = True
+        # the plot is a task of loading_state only if it is not ready right away
+        task = {"id": None, "progress": None}
+        def on_progress_(n_done: int, n_total: int) -> None:
+            task["progress"] = (n_done, n_total)
+            if task["id"] is not None:
+                loading_state.set_task_progress(task["id"], n_done, n_total)
+        def get_plot_(connection, kwargs_):
+            with reporting_progress(on_progress_):
+                return self._get_plot(connection=connection, **kwargs_)
+        future = asyncio.wrap_future(pool.submit(get_plot_, kwargs, token))
+        try:
+            done, _ = await asyncio.wait({future}, timeout=PLACEHOLDER_DELAY)
+            if len(done) == 0:
+                task["id"] = loading_state.start_task(getattr(self._get_plot, '__self__', self._get_plot).__class__.__name__)
+                if task["progress"] is not None:
+                    loading_state.set_task_progress(task["id"], *task["progress"])
+                yield get_placeholder(kwargs.get("language_code", "en"))
+            out = await future
+        except ComputationCancelled:
+            # a newer state of the widgets is being computed
+            return
+        finally:
+            # also when panel cancels this task (asyncio.CancelledError) because the
+            # widgets changed, or the generator is closed
+            if not future.done():
+                token.cancel()
+            if task["id"] is not None:
+                loading_state.end_task(task["id"])
+            if self._token is token:
+                self._running = False
+        if token.is_cancelled():
+            return
+        plot_counter.add_computed()
+        yield out
@@ -10,7 +10,8 @@ panel.extension(
 # All indicators and their logic will be included here
 
 from .indicator_panel import IndicatorPanel, EmptyPanel
-from ..loading.loading import increase_loading_counter, decrease_loading_counter
+from .async_plot import plot_counter
+from ..loading.loading import loading_state
 
 
 class Dispatcher(object):
@@ -28,7 +29,11 @@ class Dispatcher(object):
         self._pane = None
 
     def get_panel(self, language_code, disease_code, indicator_type_code, cohort_code):
-        increase_loading_counter()
+        with loading_state.task(f"{disease_code} {indicator_type_code} {cohort_code}", blocking=True):
+            return self._get_panel(language_code, disease_code, indicator_type_code, cohort_code)
+
+    def _get_panel(self, language_code, disease_code, indicator_type_code, cohort_code):
+        plot_counter.start_interaction(f"{language_code} {disease_code} {indicator_type_code} {cohort_code}")
         # ALL DISEASES
         if disease_code == "_all_":
             pane = panel.Column(
@@ -68,15 +73,15 @@ class Dispatcher(object):
                 styles=self._pane_styles,
                 stylesheets=[self._pane_stylesheet]
             )
-        decrease_loading_counter()
         return self._pane
 
 
 # Make all indicator panels to be displayed in the dashboard
-# This line will trigger the loading of the database from the user
-# and the preprocessing of it.
-# Check out load_database for the whole process
-from ..database.load_database import DB
+# The tabs get a lazy connection to the database: the database is selected
+# and preprocessed at its first use, not by importing this module.
+# Check out database.session for the whole process
+from ..database.session import get_database_session
+DB = get_database_session().lazy_connection()
 from .indicator_panel import SectionDividerPanel
 
 # Monitoring indicators
@@ -9,27 +9,19 @@ panel.extension(
     template=PANEL_TEMPLATE,
     sizing_mode=PANEL_SIZING_MODE
 )
-import holoviews
-holoviews.extension('bokeh') # here holoviews is kept to create a BoxWhisker plot
-                             # anda Violin plot, which are not available in Bokeh
-                             # However, holoview plots for some reason get linked
-                             # in the sense that if you move/zoom on one plot,
-                             # also all other displayed plots move together.
-                             # This is not the case with Bokeh plots, which are
-                             # independent. This is why the line plot is done with Bokeh
-                             # and the other two with Holoviews.
-                             # In the future it would be better to have all plots
-                             # done with Bokeh, but for now this is a workaround.
 import bokeh.models
 import bokeh.plotting
 
 from ...database.database import DISEASE_CODE_TO_DB_CODE
-from ...database.database import stratify_demographics, check_database_has_tables
-from ..logic_utilities import clean_indicator_getter_input
+from ...database.database import check_database_has_tables
+from .engine import evaluate_indicator, evaluate_indicator_json
 from ..widget import indicator_widget, AGE_WIDGET_INTERVALS
+from ..histogram import histogram_statistics
+from ..histogram_plots import histograms_boxplot, histograms_violin
 from ...main_selectors.disease_text import DS_TITLE as DISEASES_LANGDICT
-from ...caching.indicators import is_call_in_cache, retrieve_cached_json, cache_json
+from ...caching.indicators import get_indicators_cache_client
 from ...main_selectors.cohort_text import COHORT_NAMES
+from ..async_plot import AsyncPlot, lazy_bind
 from ...loading.loading import increase_loading_counter, decrease_loading_counter
 
 
@@ -41,117 +33,10 @@ def ea1(**kwargs):
     - distribution (list): the distribution of number of intervention per patient
     if the patient has at least one intervention
     """
-    # inputs
-    kwargs = clean_indicator_getter_input(**kwargs)
-    connection: sqlite3.Connection = kwargs.get("connection", None)
-    disease_db_code = kwargs.get("disease_db_code", None)
-    cohort_code = kwargs.get("cohort_code", None)
-    year_of_inclusion = kwargs.get("year_of_inclusion", None)
-    age = kwargs.get("age", None)
-    gender = kwargs.get("gender", None)
-    civil_status = kwargs.get("civil_status", None)
-    job_condition = kwargs.get("job_condition", None)
-    educational_level = kwargs.get("educational_level", None)
-    #
-    # Access to community care
-    # Percentage of patients with at least one outpatient 
-    # community contact.
-    #
-    output = {"percentage": 0.0, "distribution": []}
-    # logic
-    stratified_demographics_table_name = stratify_demographics(
-        connection=connection,
-        year_of_inclusion=year_of_inclusion,
-        age=age,
-        gender=gender,
-        civil_status=civil_status,
-        job_condition=job_condition,
-        educational_level=educational_level
+    return evaluate_indicator(
+        indicator_code="EA1",
+        **kwargs
     )
-    # open a cursor (close it before return)
-    cursor = connection.cursor()
-    # check if table is empty
-    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
-    if cursor.fetchone()[0] == 0:
-        return output
-    # get the indicator values
-    # - first get the total of patients that
-    #   satisfy the stratification and are in the cohort
-    if cohort_code is None:
-        print("WARNING: cohort_code is None in ea1.")
-        cohort_code = "_a_"
-    if cohort_code not in ["_a_", "_b_", "_c_"]:
-        print("WARNING: cohort_code is not valid in ea1:", cohort_code)
-        cohort_code = "_a_"
-    if cohort_code == "_a_":
-        cohort_condition_string = f"ID_DISORDER = '{disease_db_code}' AND YEAR_OF_ONSET <= {year_of_inclusion}"
-    elif cohort_code == "_b_":
-        cohort_condition_string = f"ID_DISORDER = '{disease_db_code}' AND YEAR_OF_ONSET = {year_of_inclusion}"
-    elif cohort_code == "_c_":
-        cohort_condition_string = f"""
-            ID_DISORDER = '{disease_db_code}' 
-            AND 
-            YEAR_OF_ONSET = {year_of_inclusion} 
-            AND
-            ID_SUBJECT IN (
-                SELECT {"incident_18_25_"+str(year_of_inclusion)} AS ID_SUBJECT 
-                FROM age_stratification 
-                WHERE {"incident_18_25_"+str(year_of_inclusion)} IS NOT NULL
-            )
-            """
-    cursor.execute(f"""
-        CREATE TEMPORARY TABLE temp_ea1 AS
-        SELECT DISTINCT(ID_SUBJECT) 
-        FROM {stratified_demographics_table_name}
-        WHERE ID_SUBJECT IN (
-            SELECT DISTINCT ID_SUBJECT FROM cohorts
-                WHERE {cohort_condition_string}
-        )
-    """)
-    total_ = int(cursor.execute(f"SELECT COUNT(*) FROM temp_ea1").fetchone()[0])
-    # - from this list, find the number of patients that
-    #   have at least one intervention of any kind in the year of inclusion
-    cursor.execute(f"""
-        CREATE TEMPORARY TABLE temp_ea1_2 AS
-        SELECT ID_SUBJECT
-        FROM temp_ea1
-        WHERE ID_SUBJECT IN (
-            SELECT DISTINCT ID_SUBJECT
-            FROM interventions
-            WHERE strftime('%Y', DT_INT) = '{year_of_inclusion}'
-        )
-        /*
-        In this call, I don't have to worry about person characteristic, 
-        disease, or cohort, as it is already taken care of 
-        in the previous call.
-        */
-    """)
-    numerator_ = int(cursor.execute(f"SELECT COUNT(DISTINCT ID_SUBJECT) FROM temp_ea1_2").fetchone()[0])
-    # - calculate the percentage
-    output["percentage"] = numerator_ / total_ if total_ > 0 else 0.0
-    # - find the distribution of number of interventions per patient from the interventions table
-    cursor.execute(f"""
-        SELECT COUNT(*)
-        FROM interventions
-        WHERE 
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM temp_ea1_2)
-            AND
-            strftime('%Y', DT_INT) = '{year_of_inclusion}'
-        GROUP BY ID_SUBJECT
-    """)
-    distribution_ = [int(row[0]) for row in cursor.fetchall()]
-    output["distribution"] = distribution_ if len(distribution_) > 0 else [0, 0]
-    # delete the table of stratified demograpohics
-    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
-    cursor.execute("DROP TABLE IF EXISTS temp_ea1")
-    cursor.execute("DROP TABLE IF EXISTS temp_ea1_2")
-    # close the cursor
-    cursor.close()
-    # check output
-    if output["percentage"] == 0.0:
-        output["distribution"] = [0, 0]
-    # return
-    return output
 
 # Indicator display
 ea1_code = "EA1"
@@ -292,6 +177,7 @@ class ea1_tab0(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -302,8 +188,21 @@ class ea1_tab0(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea1_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea1_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -312,74 +211,9 @@ class ea1_tab0(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea1_list = [100*float(v) for v in y["percentage"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea1_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea1_ = ea1(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea1_list.append(ea1_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea1_["percentage"] for ea1_ in ea1_list],
-                    "distribution": [ea1_["distribution"] for ea1_ in ea1_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea1_list = [100*ea1_["percentage"] for ea1_ in ea1_list]
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea1_list = [100*float(v) for v in y["percentage"]]
         # plot - use bokeh because it allows independent zooming
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -429,8 +263,8 @@ class ea1_tab0(object):
         disease_code = kwargs.get("disease_code", "_depression_")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 cohort_code=cohort_code,
@@ -466,6 +300,7 @@ class ea1_tab1(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -476,8 +311,21 @@ class ea1_tab1(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea1_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea1_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -486,105 +334,29 @@ class ea1_tab1(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea1_dist_list = [[int(n) for n in v] for v in y["distribution"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea1_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea1_ = ea1(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea1_list.append(ea1_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea1_["percentage"] for ea1_ in ea1_list],
-                    "distribution": [ea1_["distribution"] for ea1_ in ea1_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea1_dist_list = [l["distribution"] for l in ea1_list]
-        # plot: BoxWhisker (not available in Bokeh)
-        # make a BoxWhisker plot
-        # groups (the years)
-        # cathegory (the type of intervention, sub-years)
-        # value (the distribution of the number of interventions)
-        g_ = []
-        v_ = []
-        for i, y_ in enumerate(years_to_evaluate):
-            n = len(ea1_dist_list[i])
-            g_.extend([y_] * n)
-            v_.extend(ea1_dist_list[i])
-        plot = holoviews.BoxWhisker(
-            (g_, v_), 
-            kdims=[("year", _year_langdict[language_code])], 
-            vdims=[("dist", _number_of_interventions_langdict[language_code])]
-        ).opts(
-            show_legend=False, 
-            box_fill_color="#d3e3fd", 
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea1_histograms = y["histogram"]
+        # plot: boxplot drawn from the histograms of each year
+        bokeh_plot = histograms_boxplot(
+            categories=[str(i) for i in years_to_evaluate],
+            histograms=ea1_histograms,
             title=ea1_code + " - " + ea1_name_langdict[language_code] + " - " + DISEASES_LANGDICT[language_code][disease_code] + ", " + COHORT_NAMES[language_code][cohort_code],
+            x_axis_label=_year_langdict[language_code],
+            y_axis_label=_number_of_interventions_langdict[language_code],
+            box_fill_color="#d3e3fd"
         )
-        bokeh_plot = holoviews.render(plot)
         # add a transparent Circle plot to show some info with a custom hover tool
+        ea1_statistics = [histogram_statistics(h) for h in ea1_histograms]
         source = bokeh.models.ColumnDataSource({
             "year": [str(i) for i in years_to_evaluate],
-            "median": [numpy.median(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "mean": [numpy.mean(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "stdev": [numpy.std(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "q1": [numpy.percentile(ea1_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "q3": [numpy.percentile(ea1_dist_list[i], 75) for i in range(len(years_to_evaluate))],
-            "iqr": [numpy.percentile(ea1_dist_list[i], 75) - numpy.percentile(ea1_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "count": [len(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
+            "median": [s["median"] for s in ea1_statistics],
+            "mean": [s["mean"] for s in ea1_statistics],
+            "stdev": [s["stdev"] for s in ea1_statistics],
+            "q1": [s["q1"] for s in ea1_statistics],
+            "q3": [s["q3"] for s in ea1_statistics],
+            "iqr": [s["iqr"] for s in ea1_statistics],
+            "count": [s["count"] for s in ea1_statistics],
         })
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -621,8 +393,8 @@ class ea1_tab1(object):
         disease_code = kwargs.get("disease_code", "_depression_")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 cohort_code=cohort_code,
@@ -657,6 +429,7 @@ class ea1_tab2(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -667,8 +440,21 @@ class ea1_tab2(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea1_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea1_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -677,107 +463,29 @@ class ea1_tab2(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea1_dist_list = [[int(n) for n in v] for v in y["distribution"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea1_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea1_ = ea1(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea1_list.append(ea1_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea1_["percentage"] for ea1_ in ea1_list],
-                    "distribution": [ea1_["distribution"] for ea1_ in ea1_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea1_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea1_dist_list = [l["distribution"] for l in ea1_list]
-        # plot: BoxWhisker (not available in Bokeh)
-        # make a BoxWhisker plot
-        # groups (the years)
-        # cathegory (the type of intervention, sub-years)
-        # value (the distribution of the number of interventions)
-        g_ = []
-        v_ = []
-        for i, y_ in enumerate(years_to_evaluate):
-            n = len(ea1_dist_list[i])
-            g_.extend([y_] * n)
-            v_.extend(ea1_dist_list[i])
-        plot = holoviews.Violin(
-            (g_, v_), 
-            kdims=[("year", _year_langdict[language_code])], 
-            vdims=[("dist", _number_of_interventions_langdict[language_code])]
-        ).opts(
-            show_legend=False,
-            inner="quartiles",
-            bandwidth=0.5,
-            violin_color="#d3e3fd", 
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea1_histograms = y["histogram"]
+        # plot: violin plot drawn from the histograms of each year
+        bokeh_plot = histograms_violin(
+            categories=[str(i) for i in years_to_evaluate],
+            histograms=ea1_histograms,
             title=ea1_code + " - " + ea1_name_langdict[language_code] + " - " + DISEASES_LANGDICT[language_code][disease_code] + ", " + COHORT_NAMES[language_code][cohort_code],
+            x_axis_label=_year_langdict[language_code],
+            y_axis_label=_number_of_interventions_langdict[language_code],
+            violin_color="#d3e3fd"
         )
-        bokeh_plot = holoviews.render(plot)
         # add a transparent Circle plot to show some info with a custom hover tool
+        ea1_statistics = [histogram_statistics(h) for h in ea1_histograms]
         source = bokeh.models.ColumnDataSource({
             "year": [str(i) for i in years_to_evaluate],
-            "median": [numpy.median(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "mean": [numpy.mean(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "stdev": [numpy.std(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "q1": [numpy.percentile(ea1_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "q3": [numpy.percentile(ea1_dist_list[i], 75) for i in range(len(years_to_evaluate))],
-            "iqr": [numpy.percentile(ea1_dist_list[i], 75) - numpy.percentile(ea1_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "count": [len(ea1_dist_list[i]) for i in range(len(years_to_evaluate))],
+            "median": [s["median"] for s in ea1_statistics],
+            "mean": [s["mean"] for s in ea1_statistics],
+            "stdev": [s["stdev"] for s in ea1_statistics],
+            "q1": [s["q1"] for s in ea1_statistics],
+            "q3": [s["q3"] for s in ea1_statistics],
+            "iqr": [s["iqr"] for s in ea1_statistics],
+            "count": [s["count"] for s in ea1_statistics],
         })
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -815,8 +523,8 @@ class ea1_tab2(object):
         disease_code = kwargs.get("disease_code", "_depression_")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 cohort_code=cohort_code,
@@ -9,27 +9,19 @@ panel.extension(
     template=PANEL_TEMPLATE,
     sizing_mode=PANEL_SIZING_MODE
 )
-import holoviews
-holoviews.extension('bokeh') # here holoviews is kept to create a BoxWhisker plot
-                             # anda Violin plot, which are not available in Bokeh
-                             # However, holoview plots for some reason get linked
-                             # in the sense that if you move/zoom on one plot,
-                             # also all other displayed plots move together.
-                             # This is not the case with Bokeh plots, which are
-                             # independent. This is why the line plot is done with Bokeh
-                             # and the other two with Holoviews.
-                             # In the future it would be better to have all plots
-                             # done with Bokeh, but for now this is a workaround.
 import bokeh.models
 import bokeh.plotting
 
 from ...database.database import DISEASE_CODE_TO_DB_CODE
-from ...database.database import stratify_demographics, check_database_has_tables
-from ..logic_utilities import clean_indicator_getter_input
+from ...database.database import check_database_has_tables
+from .engine import evaluate_indicator, evaluate_indicator_json
 from ..widget import indicator_widget, AGE_WIDGET_INTERVALS
+from ..histogram import histogram_statistics
+from ..histogram_plots import histograms_boxplot, histograms_violin
 from ...main_selectors.disease_text import DS_TITLE as DISEASES_LANGDICT
-from ...caching.indicators import is_call_in_cache, retrieve_cached_json, cache_json
+from ...caching.indicators import get_indicators_cache_client
 from ...main_selectors.cohort_text import COHORT_NAMES
+from ..async_plot import AsyncPlot, lazy_bind
 from ...loading.loading import increase_loading_counter, decrease_loading_counter
 
 # ATTENTION: THIS INDICATOR DOES NOT DEPEND ON THE DISEASE SELECTOR, AS THE DISEASE IS FIXED 
@@ -43,122 +35,10 @@ def ea5(**kwargs):
     - distribution (list): the distribution of number of intervention per patient
     if the patient has at least one intervention
     """
-    # inputs
-    kwargs = clean_indicator_getter_input(**kwargs)
-    connection: sqlite3.Connection = kwargs.get("connection", None)
-    disease_db_code = DISEASE_CODE_TO_DB_CODE['_depression_']
-    cohort_code = kwargs.get("cohort_code", None)
-    year_of_inclusion = kwargs.get("year_of_inclusion", None)
-    age = kwargs.get("age", None)
-    gender = kwargs.get("gender", None)
-    civil_status = kwargs.get("civil_status", None)
-    job_condition = kwargs.get("job_condition", None)
-    educational_level = kwargs.get("educational_level", None)
-    #
-    # Access to treatment
-    #
-    output = {"percentage": 0.0, "distribution": []}
-    # logic
-    stratified_demographics_table_name = stratify_demographics(
-        connection=connection,
-        year_of_inclusion=year_of_inclusion,
-        age=age,
-        gender=gender,
-        civil_status=civil_status,
-        job_condition=job_condition,
-        educational_level=educational_level
+    return evaluate_indicator(
+        indicator_code="EA5",
+        **kwargs
     )
-    # open a cursor (close it before return)
-    cursor = connection.cursor()
-    # check if table is empty
-    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
-    if cursor.fetchone()[0] == 0:
-        return output
-    # get the indicator values
-    # - first get the total of patients that
-    #   satisfy the stratification and are in the cohort
-    if cohort_code is None:
-        print("WARNING: cohort_code is None in ea5.")
-        cohort_code = "_a_"
-    if cohort_code not in ["_a_", "_b_", "_c_"]:
-        print("WARNING: cohort_code is not valid in ea5:", cohort_code)
-        cohort_code = "_a_"
-    if cohort_code == "_a_":
-        cohort_condition_string = f"ID_DISORDER = '{disease_db_code}' AND YEAR_OF_ONSET <= {year_of_inclusion}"
-    elif cohort_code == "_b_":
-        cohort_condition_string = f"ID_DISORDER = '{disease_db_code}' AND YEAR_OF_ONSET = {year_of_inclusion}"
-    elif cohort_code == "_c_":
-        cohort_condition_string = f"""
-            ID_DISORDER = '{disease_db_code}' 
-            AND 
-            YEAR_OF_ONSET = {year_of_inclusion} 
-            AND
-            ID_SUBJECT IN (
-                SELECT {"incident_18_25_"+str(year_of_inclusion)} AS ID_SUBJECT 
-                FROM age_stratification 
-                WHERE {"incident_18_25_"+str(year_of_inclusion)} IS NOT NULL
-            )
-            """
-    cursor.execute(f"""
-        CREATE TEMPORARY TABLE temp_ea5 AS
-        SELECT DISTINCT ID_SUBJECT 
-        FROM {stratified_demographics_table_name}
-        WHERE ID_SUBJECT IN (
-            SELECT DISTINCT ID_SUBJECT FROM cohorts
-                WHERE {cohort_condition_string}
-        )
-    """)
-    total_ = int(cursor.execute(f"SELECT COUNT(*) FROM temp_ea5").fetchone()[0])
-    # - from this list, find the number of patients that
-    #   have at least one prescription of antipsychotic drugs during the year of evaluation
-    cursor.execute(f"""
-        CREATE TEMPORARY TABLE temp_ea5_2 AS
-        SELECT DISTINCT ID_SUBJECT
-        FROM temp_ea5
-        WHERE ID_SUBJECT IN (
-            SELECT DISTINCT ID_SUBJECT
-            FROM pharma
-            WHERE
-                ID_SUBJECT IN (SELECT ID_SUBJECT FROM temp_ea5)
-                AND
-                strftime('%Y', DT_PRESCR) = '{year_of_inclusion}'
-                AND
-                ATC_CHAR LIKE 'N06A%'
-        )
-        /*
-        In this call, I don't have to worry about person characteristic, 
-        disease, or cohort, as it is already taken care of 
-        in the previous call.
-        */
-    """)
-    numerator_ = int(cursor.execute(f"SELECT COUNT(*) FROM temp_ea5_2").fetchone()[0])
-    # - calculate the percentage
-    output["percentage"] = numerator_ / total_ if total_ > 0 else 0.0
-    # - find the distribution of number of interventions per patient from the interventions table
-    cursor.execute(f"""
-        SELECT COUNT(*)
-        FROM pharma
-        WHERE
-            ID_SUBJECT IN (SELECT ID_SUBJECT FROM temp_ea5_2)
-            AND
-            strftime('%Y', DT_PRESCR) = '{year_of_inclusion}'
-            AND
-            ATC_CHAR LIKE 'N06A%'
-        GROUP BY ID_SUBJECT
-    """)
-    distribution_ = [int(row[0]) for row in cursor.fetchall()]
-    output["distribution"] = distribution_ if len(distribution_) > 0 else [0, 0]
-    # delete the table of stratified demograpohics
-    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
-    cursor.execute("DROP TABLE IF EXISTS temp_ea5")
-    cursor.execute("DROP TABLE IF EXISTS temp_ea5_2")
-    # close the cursor
-    cursor.close()
-    # check output
-    if output["percentage"] == 0.0:
-        output["distribution"] = [0, 0]
-    # return
-    return output
 
 # Indicator display
 ea5_code = "EA5"
@@ -299,6 +179,7 @@ class ea5_tab0(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -309,8 +190,21 @@ class ea5_tab0(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea5_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea5_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -319,74 +213,9 @@ class ea5_tab0(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea5_list = [100*float(v) for v in y["percentage"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea5_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea5_ = ea5(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea5_list.append(ea5_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea5_["percentage"] for ea5_ in ea5_list],
-                    "distribution": [ea5_["distribution"] for ea5_ in ea5_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea5_list = [100*ea5_["percentage"] for ea5_ in ea5_list]
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea5_list = [100*float(v) for v in y["percentage"]]
         # plot - use bokeh because it allows independent zooming
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -431,8 +260,8 @@ class ea5_tab0(object):
         language_code = kwargs.get("language_code", "en")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code="_depression_",
                 cohort_code=cohort_code,
@@ -468,6 +297,7 @@ class ea5_tab1(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -478,8 +308,21 @@ class ea5_tab1(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea5_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea5_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -488,105 +331,29 @@ class ea5_tab1(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea5_dist_list = [[int(n) for n in v] for v in y["distribution"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea5_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea5_ = ea5(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea5_list.append(ea5_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea5_["percentage"] for ea5_ in ea5_list],
-                    "distribution": [ea5_["distribution"] for ea5_ in ea5_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea5_dist_list = [l["distribution"] for l in ea5_list]
-        # plot: BoxWhisker (not available in Bokeh)
-        # make a BoxWhisker plot
-        # groups (the years)
-        # cathegory (the type of intervention, sub-years)
-        # value (the distribution of the number of interventions)
-        g_ = []
-        v_ = []
-        for i, y_ in enumerate(years_to_evaluate):
-            n = len(ea5_dist_list[i])
-            g_.extend([y_] * n)
-            v_.extend(ea5_dist_list[i])
-        plot = holoviews.BoxWhisker(
-            (g_, v_), 
-            kdims=[("year", _year_langdict[language_code])], 
-            vdims=[("dist", _number_of_interventions_langdict[language_code])]
-        ).opts(
-            show_legend=False, 
-            box_fill_color="#d3e3fd", 
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea5_histograms = y["histogram"]
+        # plot: boxplot drawn from the histograms of each year
+        bokeh_plot = histograms_boxplot(
+            categories=[str(i) for i in years_to_evaluate],
+            histograms=ea5_histograms,
             title=ea5_code + " - " + ea5_name_langdict[language_code] + " - " + DISEASES_LANGDICT[language_code][disease_code] + ", " + COHORT_NAMES[language_code][cohort_code],
+            x_axis_label=_year_langdict[language_code],
+            y_axis_label=_number_of_interventions_langdict[language_code],
+            box_fill_color="#d3e3fd"
         )
-        bokeh_plot = holoviews.render(plot)
         # add a transparent Circle plot to show some info with a custom hover tool
+        ea5_statistics = [histogram_statistics(h) for h in ea5_histograms]
         source = bokeh.models.ColumnDataSource({
             "year": [str(i) for i in years_to_evaluate],
-            "median": [numpy.median(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "mean": [numpy.mean(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "stdev": [numpy.std(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "q1": [numpy.percentile(ea5_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "q3": [numpy.percentile(ea5_dist_list[i], 75) for i in range(len(years_to_evaluate))],
-            "iqr": [numpy.percentile(ea5_dist_list[i], 75) - numpy.percentile(ea5_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "count": [len(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
+            "median": [s["median"] for s in ea5_statistics],
+            "mean": [s["mean"] for s in ea5_statistics],
+            "stdev": [s["stdev"] for s in ea5_statistics],
+            "q1": [s["q1"] for s in ea5_statistics],
+            "q3": [s["q3"] for s in ea5_statistics],
+            "iqr": [s["iqr"] for s in ea5_statistics],
+            "count": [s["count"] for s in ea5_statistics],
         })
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -623,8 +390,8 @@ class ea5_tab1(object):
         disease_code = kwargs.get("disease_code", "_depression_")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code="_depression_",
                 cohort_code=cohort_code,
@@ -659,6 +426,7 @@ class ea5_tab2(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         cohort_code = kwargs.get("cohort_code", None)
@@ -669,8 +437,21 @@ class ea5_tab2(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        is_in_cache = is_call_in_cache(
+        def compute_() -> tuple[str,str]:
+            return evaluate_indicator_json(
+                indicator_code=ea5_code,
+                connection=connection,
+                disease_code=disease_code,
+                cohort_code=cohort_code,
+                age=age_interval_list,
+                gender=gender,
+                civil_status=civil_status,
+                job_condition=job_condition,
+                educational_level=educational_level
+            )
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
             indicator_name=ea5_code,
+            compute=compute_,
             disease_code=disease_code,
             cohort=cohort_code,
             age_interval=age_interval_list,
@@ -679,107 +460,29 @@ class ea5_tab2(object):
             job_condition=job_condition,
             educational_level=educational_level
         )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            # encode for plotting
-            ea5_dist_list = [[int(n) for n in v] for v in y["distribution"]]
-        else:
-            cursor = self._db_conn.cursor()
-            # get the years of inclusion as all years from the first occurrence of the disease
-            # for any patient up to the current year
-            try:
-                min_year_ = int(
-                    cursor.execute(f"""
-                        SELECT MIN(YEAR_OF_ONSET) FROM cohorts
-                        WHERE ID_DISORDER = '{DISEASE_CODE_TO_DB_CODE[disease_code]}'
-                    """).fetchone()[0]
-                )
-                min_year_available_ = True
-            except:
-                min_year_ = time.localtime().tm_year - 2
-                min_year_available_ = False
-            cursor.close()
-            ea5_list = []
-            years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
-            for year in years_to_evaluate:
-                ea5_ = ea5(
-                    connection=self._db_conn,
-                    disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
-                    cohort_code=cohort_code,
-                    year_of_inclusion=year,
-                    age=age_interval_list,
-                    gender=gender,
-                    civil_status=civil_status,
-                    job_condition=job_condition,
-                    educational_level=educational_level
-                )
-                ea5_list.append(ea5_)
-            # cache everything
-            x_json = json.dumps(years_to_evaluate)
-            y_json = json.dumps(
-                {
-                    "percentage": [ea5_["percentage"] for ea5_ in ea5_list],
-                    "distribution": [ea5_["distribution"] for ea5_ in ea5_list]
-                }
-            )
-            cache_json(
-                indicator_name=ea5_code,
-                disease_code=disease_code,
-                cohort=cohort_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # encode for plotting
-            ea5_dist_list = [l["distribution"] for l in ea5_list]
-        # plot: BoxWhisker (not available in Bokeh)
-        # make a BoxWhisker plot
-        # groups (the years)
-        # cathegory (the type of intervention, sub-years)
-        # value (the distribution of the number of interventions)
-        g_ = []
-        v_ = []
-        for i, y_ in enumerate(years_to_evaluate):
-            n = len(ea5_dist_list[i])
-            g_.extend([y_] * n)
-            v_.extend(ea5_dist_list[i])
-        plot = holoviews.Violin(
-            (g_, v_), 
-            kdims=[("year", _year_langdict[language_code])], 
-            vdims=[("dist", _number_of_interventions_langdict[language_code])]
-        ).opts(
-            show_legend=False,
-            inner="quartiles",
-            bandwidth=0.5,
-            violin_color="#d3e3fd", 
+        years_to_evaluate = [int(v) for v in x]
+        # encode for plotting
+        ea5_histograms = y["histogram"]
+        # plot: violin plot drawn from the histograms of each year
+        bokeh_plot = histograms_violin(
+            categories=[str(i) for i in years_to_evaluate],
+            histograms=ea5_histograms,
             title=ea5_code + " - " + ea5_name_langdict[language_code] + " - " + DISEASES_LANGDICT[language_code][disease_code] + ", " + COHORT_NAMES[language_code][cohort_code],
+            x_axis_label=_year_langdict[language_code],
+            y_axis_label=_number_of_interventions_langdict[language_code],
+            violin_color="#d3e3fd"
         )
-        bokeh_plot = holoviews.render(plot)
         # add a transparent Circle plot to show some info with a custom hover tool
+        ea5_statistics = [histogram_statistics(h) for h in ea5_histograms]
         source = bokeh.models.ColumnDataSource({
             "year": [str(i) for i in years_to_evaluate],
-            "median": [numpy.median(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "mean": [numpy.mean(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "stdev": [numpy.std(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
-            "q1": [numpy.percentile(ea5_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "q3": [numpy.percentile(ea5_dist_list[i], 75) for i in range(len(years_to_evaluate))],
-            "iqr": [numpy.percentile(ea5_dist_list[i], 75) - numpy.percentile(ea5_dist_list[i], 25) for i in range(len(years_to_evaluate))],
-            "count": [len(ea5_dist_list[i]) for i in range(len(years_to_evaluate))],
+            "median": [s["median"] for s in ea5_statistics],
+            "mean": [s["mean"] for s in ea5_statistics],
+            "stdev": [s["stdev"] for s in ea5_statistics],
+            "q1": [s["q1"] for s in ea5_statistics],
+            "q3": [s["q3"] for s in ea5_statistics],
+            "iqr": [s["iqr"] for s in ea5_statistics],
+            "count": [s["count"] for s in ea5_statistics],
         })
         hover_tool = bokeh.models.HoverTool(
             tooltips=[
@@ -816,8 +519,8 @@ class ea5_tab2(object):
         disease_code = kwargs.get("disease_code", "_depression_")
         cohort_code = kwargs.get("cohort_code", "_a_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code="_depression_",
                 cohort_code=cohort_code,
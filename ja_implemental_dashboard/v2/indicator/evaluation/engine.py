@@ -0,0 +1,331 @@
+import time
+import json
+import sqlite3
+
+from ...database.database import DISEASE_CODE_TO_DB_CODE
+from ...database.classification import get_class_condition
+from ...database.database import get_age_stratification_condition, get_demographics_selector_string, INCIDENT_18_25_AGE_INTERVAL
+from ..logic_utilities import clean_indicator_getter_input
+from ..widget_texts import AGE_WIDGET_INTERVALS
+from ..histogram import histogram_to_values
+from ...database.parallel import map_years, split_years, get_max_workers
+
+# This module contains the batched evaluation logic of the
+# evaluation indicators (EA1, ..., EA6-2).
+# Instead of stratifying the patients and counting the events year by year,
+# all the years of inclusion are evaluated at once:
+# - one temporary table (YEAR, ID_SUBJECT) is filled with the patients that
+#   satisfy the stratification and the cohort definition for each year;
+# - one grouped query (GROUP BY YEAR, ID_SUBJECT) counts the events of every
+#   patient in every year, and is grouped again by number of events to
+#   return, for every year, the histogram of the number of events per patient.
+# The per-year indicator functions (ea1, ea2, ...) are thin views over this logic.
+
+# Each evaluation indicator is defined by the table in which its events are stored,
+# the (integer) year column of the events (see database.preprocess_database_datetimes), the condition that the events must satisfy
+# (the prescriptions are selected by their integer DRUG_CLASS, see database.classification),
+# and possibly by a fixed disease (if the indicator only makes sense for one disorder).
+EVALUATION_INDICATORS_EVENTS = {
+    "EA1": {
+        # Access to community care: any outpatient community contact
+        "table": "interventions",
+        "year_column": "DT_INT_YEAR",
+        "condition": "1",
+        "disease_db_code": None,
+    },
+    "EA2": {
+        # Psychosocial interventions
+        "table": "interventions",
+        "year_column": "DT_INT_YEAR",
+        "condition": "TYPE_INT = 4",
+        "disease_db_code": None,
+    },
+    "EA3": {
+        # Family involvement
+        "table": "interventions",
+        "year_column": "DT_INT_YEAR",
+        "condition": "TYPE_INT IN (1, 6)",
+        "disease_db_code": None,
+    },
+    "EA4": {
+        # Antipsychotic drugs, lithium excluded
+        "table": "pharma",
+        "year_column": "DT_PRESCR_YEAR",
+        "condition": get_class_condition("pharma", ["ANTIPSYCHOTIC"]),
+        "disease_db_code": DISEASE_CODE_TO_DB_CODE["_schizophrenia_"],
+    },
+    "EA5": {
+        # Antidepressant drugs
+        "table": "pharma",
+        "year_column": "DT_PRESCR_YEAR",
+        "condition": get_class_condition("pharma", ["ANTIDEPRESSANT"]),
+        "disease_db_code": DISEASE_CODE_TO_DB_CODE["_depression_"],
+    },
+    "EA6-0": {
+        # Mood stabilizers: lithium, lamotrigine, valproic acid, carbamazepine
+        "table": "pharma",
+        "year_column": "DT_PRESCR_YEAR",
+        "condition": get_class_condition("pharma", ["LITHIUM", "LAMOTRIGINE", "VALPROIC_ACID", "CARBAMAZEPINE"]),
+        "disease_db_code": DISEASE_CODE_TO_DB_CODE["_bipolar_disorder_"],
+    },
+    "EA6-1": {
+        # Valproic acid, carbamazepine
+        "table": "pharma",
+        "year_column": "DT_PRESCR_YEAR",
+        "condition": get_class_condition("pharma", ["VALPROIC_ACID", "CARBAMAZEPINE"]),
+        "disease_db_code": DISEASE_CODE_TO_DB_CODE["_bipolar_disorder_"],
+    },
+    "EA6-2": {
+        # Lithium
+        "table": "pharma",
+        "year_column": "DT_PRESCR_YEAR",
+        "condition": get_class_condition("pharma", ["LITHIUM"]),
+        "disease_db_code": DISEASE_CODE_TO_DB_CODE["_bipolar_disorder_"],
+    },
+}
+
+def _fill_population_table_sql(cursor: sqlite3.Cursor, disease_db_code: str, cohort_code: str, years_of_inclusion: list[int], age_intervals_list: list[tuple[int, int]], **kwargs) -> None:
+    """ Fill t_eval_population with the patients that satisfy the stratification and are in the cohort,
+    for every year of inclusion, querying the age_stratification, demographics and cohorts tables.
+    """
+    if cohort_code == "_a_":
+        cohort_condition_string = "c.YEAR_OF_ONSET <= a.YEAR_OF_INCLUSION"
+    elif cohort_code == "_b_":
+        cohort_condition_string = "c.YEAR_OF_ONSET = a.YEAR_OF_INCLUSION"
+    else:
+        cohort_condition_string = f"""
+            c.YEAR_OF_ONSET = a.YEAR_OF_INCLUSION
+            AND
+            EXISTS (
+                SELECT 1 FROM age_stratification i
+                WHERE
+                    i.ID_SUBJECT = a.ID_SUBJECT
+                    AND
+                    i.YEAR_OF_INCLUSION = a.YEAR_OF_INCLUSION
+                    AND
+                    {get_age_stratification_condition([INCIDENT_18_25_AGE_INTERVAL], age_column="i.AGE")}
+            )
+        """
+    demographics_selector_statement = get_demographics_selector_string(
+        gender=kwargs["gender"],
+        civil_status=kwargs["civil_status"],
+        job_condition=kwargs["job_condition"],
+        educational_level=kwargs["educational_level"]
+    )
+    cursor.execute("DROP TABLE IF EXISTS temp.t_eval_population")
+    cursor.execute("CREATE TEMPORARY TABLE t_eval_population (YEAR INTEGER, ID_SUBJECT INTEGER, PRIMARY KEY (YEAR, ID_SUBJECT)) WITHOUT ROWID")
+    years_string = ", ".join([str(int(y)) for y in years_of_inclusion])
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO t_eval_population (YEAR, ID_SUBJECT)
+        SELECT a.YEAR_OF_INCLUSION, a.ID_SUBJECT
+        FROM age_stratification a
+        WHERE
+            a.YEAR_OF_INCLUSION IN ({years_string})
+            AND
+            {get_age_stratification_condition(age_intervals_list, age_column="a.AGE")}
+            AND
+            a.ID_SUBJECT IN (
+                SELECT ID_SUBJECT FROM demographics
+                WHERE {demographics_selector_statement}
+            )
+            AND
+            EXISTS (
+                SELECT 1 FROM cohorts c
+                WHERE
+                    c.ID_SUBJECT = a.ID_SUBJECT
+                    AND
+                    c.ID_DISORDER = '{disease_db_code}'
+                    AND
+                    {cohort_condition_string}
+            )
+    """)
+
+
+def _fill_population_table_columnar(cursor: sqlite3.Cursor, columnar, disease_db_code: str, cohort_code: str, years_of_inclusion: list[int], age_intervals_list: list[tuple[int, int]], **kwargs) -> None:
+    """ Fill t_eval_population with the patients that satisfy the stratification and are in the cohort,
+    for every year of inclusion, from the subject-index arrays of the columnar backend
+    (database.columnar.ColumnarDemographics).
+    """
+    cursor.execute("DROP TABLE IF EXISTS temp.t_eval_population")
+    cursor.execute("CREATE TEMPORARY TABLE t_eval_population (YEAR INTEGER, ID_SUBJECT INTEGER, PRIMARY KEY (YEAR, ID_SUBJECT)) WITHOUT ROWID")
+    for year in years_of_inclusion:
+        indices_ = columnar.stratify(
+            year_of_inclusion=year,
+            age=age_intervals_list,
+            gender=kwargs["gender"],
+            civil_status=kwargs["civil_status"],
+            job_condition=kwargs["job_condition"],
+            educational_level=kwargs["educational_level"],
+            disease_db_code=disease_db_code,
+            cohort_code=cohort_code
+        )
+        cursor.executemany(
+            "INSERT INTO t_eval_population (YEAR, ID_SUBJECT) VALUES (?, ?)",
+            ((year, id_) for id_ in columnar.subject_ids[indices_].tolist())
+        )
+
+
+def evaluate_indicator_all_years(indicator_code: str, **kwargs) -> dict[str: list]:
+    """ Evaluate the evaluation indicator indicator_code (one of EVALUATION_INDICATORS_EVENTS keys)
+    for all the years of inclusion at once.
+
+    kwargs: see logic_utilities.clean_indicator_getter_input,
+    the years to evaluate are passed with years_of_inclusion (list[int]).
+    Optionally, columnar (database.columnar.ColumnarDemographics) can be passed to
+    stratify the patients in memory instead of querying the age_stratification table.
+
+    output dict:
+    - percentage (list[float]): for each year of inclusion, the indicator, range [0; 1];
+    - histogram (list[list[list[int]]]): for each year of inclusion, the histogram of the
+    number of events per patient if the patient has at least one event in the year,
+    as [number of events, number of patients] pairs sorted by number of events (see indicator.histogram).
+    When no patient has an event in the year, the histogram is [[0, 2]] (the distribution [0, 0]).
+    """
+    # inputs
+    if indicator_code not in EVALUATION_INDICATORS_EVENTS:
+        raise ValueError(f"indicator_code must be in {list(EVALUATION_INDICATORS_EVENTS.keys())}, got {indicator_code} instead")
+    event = EVALUATION_INDICATORS_EVENTS[indicator_code]
+    columnar = kwargs.pop("columnar", None)
+    kwargs = clean_indicator_getter_input(**kwargs)
+    connection: sqlite3.Connection = kwargs["connection"]
+    disease_db_code = event["disease_db_code"] if event["disease_db_code"] is not None else kwargs["disease_db_code"]
+    cohort_code = kwargs["cohort_code"]
+    years_of_inclusion = kwargs["years_of_inclusion"]
+    age_intervals_list = kwargs["age"]
+    if not isinstance(age_intervals_list, list) or len(age_intervals_list) == 0:
+        raise ValueError(f"age must be a non-empty list. Found {age_intervals_list}")
+    for age_interval in age_intervals_list:
+        if age_interval not in AGE_WIDGET_INTERVALS.values():
+            raise ValueError(f"age must be a list of tuples[int, int] (inclusive) choosing from {AGE_WIDGET_INTERVALS.values()}. Found {age_interval}")
+    # logic
+    cursor = connection.cursor()
+    # - patients that satisfy the stratification and are in the cohort, for every year of inclusion
+    population_kwargs = dict(
+        disease_db_code=disease_db_code,
+        cohort_code=cohort_code,
+        years_of_inclusion=years_of_inclusion,
+        age_intervals_list=age_intervals_list,
+        gender=kwargs["gender"],
+        civil_status=kwargs["civil_status"],
+        job_condition=kwargs["job_condition"],
+        educational_level=kwargs["educational_level"]
+    )
+    if columnar is None:
+        _fill_population_table_sql(cursor, **population_kwargs)
+    else:
+        _fill_population_table_columnar(cursor, columnar, **population_kwargs)
+    totals_ = {
+        int(row[0]): int(row[1])
+        for row in cursor.execute("SELECT YEAR, COUNT(*) FROM t_eval_population GROUP BY YEAR").fetchall()
+    }
+    # - histogram of the number of events per patient of the population, in every year
+    #   (patients without events in the year do not appear)
+    cursor.execute(f"""
+        SELECT YEAR, N_EVENTS, COUNT(*)
+        FROM (
+            SELECT p.YEAR AS YEAR, COUNT(*) AS N_EVENTS
+            FROM t_eval_population p
+            JOIN {event["table"]} e ON e.ID_SUBJECT = p.ID_SUBJECT
+            WHERE
+                e.{event["year_column"]} = p.YEAR
+                AND
+                {event["condition"]}
+            GROUP BY p.YEAR, p.ID_SUBJECT
+        )
+        GROUP BY YEAR, N_EVENTS
+        ORDER BY YEAR, N_EVENTS
+    """)
+    histograms_ = {y: [] for y in years_of_inclusion}
+    for year_, n_events_, n_patients_ in cursor.fetchall():
+        histograms_[int(year_)].append([int(n_events_), int(n_patients_)])
+    # clean up
+    cursor.execute("DROP TABLE IF EXISTS temp.t_eval_population")
+    cursor.close()
+    # output
+    output = {"percentage": [], "histogram": []}
+    for year in years_of_inclusion:
+        total_ = totals_.get(year, 0)
+        numerator_ = sum([n for _, n in histograms_[year]])
+        percentage_ = numerator_ / total_ if total_ > 0 else 0.0
+        output["percentage"].append(percentage_)
+        output["histogram"].append(histograms_[year] if percentage_ > 0.0 else [[0, 2]])
+    return output
+
+
+def evaluate_indicator(indicator_code: str, **kwargs) -> dict:
+    """ Evaluate the evaluation indicator indicator_code for a single year of inclusion
+    (kwargs year_of_inclusion). This is a view over evaluate_indicator_all_years.
+
+    output dict:
+    - percentage (float): the indicator, range [0; 1];
+    - distribution (list): the distribution of number of events per patient
+    if the patient has at least one event, sorted;
+    - histogram (list[list[int]]): the same distribution as a histogram
+    """
+    columnar = kwargs.pop("columnar", None)
+    kwargs = clean_indicator_getter_input(**kwargs)
+    kwargs["years_of_inclusion"] = [kwargs["year_of_inclusion"]]
+    output = evaluate_indicator_all_years(indicator_code, columnar=columnar, **kwargs)
+    return {
+        "percentage": output["percentage"][0],
+        "distribution": histogram_to_values(output["histogram"][0]),
+        "histogram": output["histogram"][0]
+    }
+
+
+def get_years_of_inclusion(connection: sqlite3.Connection, disease_db_code: str) -> list[int]:
+    """ The years of inclusion shown in the evaluation tabs: all years from the first
+    occurrence of the disease for any patient up to the current year
+    (the last three years if the disease does not occur in the database).
+    """
+    cursor = connection.cursor()
+    try:
+        min_year_ = int(
+            cursor.execute(f"""
+                SELECT MIN(YEAR_OF_ONSET) FROM cohorts
+                WHERE ID_DISORDER = '{disease_db_code}'
+            """).fetchone()[0]
+        )
+    except:
+        min_year_ = time.localtime().tm_year - 2
+    cursor.close()
+    return [y for y in range(min_year_, time.localtime().tm_year+1)]
+
+
+def evaluate_indicator_json(indicator_code: str, connection: sqlite3.Connection, disease_code: str, cohort_code: str, age: list[tuple[int, int]], gender: str, civil_status: str, job_condition: str, educational_level: str, max_workers: int|None=None) -> tuple[str, str]:
+    """ Evaluate the evaluation indicator for all the years of inclusion of the
+    disease, as cached in the indicators cache by the evaluation tabs
+    (and by caching.precompute).
+    disease_code: str
+        The dashboard disease code (e.g. '_depression_'), see DISEASE_CODE_TO_DB_CODE.
+    max_workers: int|None
+        The years of inclusion are split in contiguous chunks evaluated in parallel
+        over read-only connections to the database (see database.parallel),
+        by default one chunk per core. With 1, all years are evaluated on connection.
+    Returns x_json (the years of inclusion) and y_json (the output of evaluate_indicator_all_years).
+    """
+    years_to_evaluate = get_years_of_inclusion(connection, DISEASE_CODE_TO_DB_CODE[disease_code])
+    max_workers = get_max_workers() if max_workers is None else max_workers
+    def evaluate_chunk_(connection_: sqlite3.Connection, years_: list[int]) -> dict:
+        return evaluate_indicator_all_years(
+            indicator_code=indicator_code,
+            connection=connection_,
+            disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
+            cohort_code=cohort_code,
+            years_of_inclusion=years_,
+            age=age,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level
+        )
+    outputs = map_years(connection, evaluate_chunk_, split_years(years_to_evaluate, max_workers), max_workers=max_workers)
+    # chunks are returned in order: concatenate them
+    y = {"percentage": [], "histogram": []}
+    for output in outputs:
+        y["percentage"].extend(output["percentage"])
+        y["histogram"].extend(output["histogram"])
+    return json.dumps(years_to_evaluate), json.dumps(y)
+
+if __name__ == "__main__":
+    print("This script is not intended to be run as the main script.")
@@ -0,0 +1,133 @@
+# HISTOGRAMS OF PER-PATIENT COUNTS
+#
+# The distributions of the evaluation indicators (number of interventions or
+# prescriptions per patient in a year) are small integers, repeated for many
+# patients. They are stored as histograms, lists of [value, frequency] pairs
+# sorted by value, e.g. the distribution [1, 3, 1, 1, 2] is [[1, 3], [2, 1], [3, 1]],
+# so that their size depends on the number of distinct counts, not on the number of patients.
+# The statistics are computed from the histograms, and so are the plots (see histogram_plots).
+
+import numpy
+
+
+def histogram_from_values(values: list[int]) -> list[list[int]]:
+    """ Histogram of a list of integer values.
+    """
+    frequencies = {}
+    for v in values:
+        frequencies[int(v)] = frequencies.get(int(v), 0) + 1
+    return [[v, frequencies[v]] for v in sorted(frequencies)]
+
+def histogram_to_values(histogram: list[list[int]]) -> list[int]:
+    """ Expand a histogram in the sorted list of its values.
+    """
+    values = []
+    for v, n in histogram:
+        values.extend([int(v)] * int(n))
+    return values
+
+def _histogram_arrays(histogram: list[list[int]]) -> tuple[numpy.ndarray, numpy.ndarray]:
+    if len(histogram) == 0:
+        raise ValueError("The histogram is empty.")
+    histogram = sorted(histogram)
+    values = numpy.array([v for v, _ in histogram], dtype=float)
+    frequencies = numpy.array([n for _, n in histogram], dtype=float)
+    return values, frequencies
+
+def histogram_percentile(histogram: list[list[int]], q: float) -> float:
+    """ Percentile q (in [0; 100]) of the values of the histogram,
+    with the linear interpolation of numpy.percentile.
+    """
+    values, frequencies = _histogram_arrays(histogram)
+    cumulative = numpy.cumsum(frequencies)
+    position = q / 100 * (cumulative[-1] - 1)
+    lower = numpy.floor(position)
+    # value of the k-th (0-based) element of the sorted expanded values
+    value_lower = values[numpy.searchsorted(cumulative, lower, side="right")]
+    value_upper = values[numpy.searchsorted(cumulative, numpy.ceil(position), side="right")]
+    return float(value_lower + (value_upper - value_lower) * (position - lower))
+
+def histogram_statistics(histogram: list[list[int]]) -> dict:
+    """ Statistics of the values of the histogram.
+
+    output dict: count, mean, stdev (population standard deviation, as numpy.std),
+    median, q1, q3, iqr.
+    """
+    values, frequencies = _histogram_arrays(histogram)
+    count = frequencies.sum()
+    mean = (values * frequencies).sum() / count
+    q1 = histogram_percentile(histogram, 25)
+    q3 = histogram_percentile(histogram, 75)
+    return {
+        "count": int(count),
+        "mean": float(mean),
+        "stdev": float(numpy.sqrt(((values - mean)**2 * frequencies).sum() / count)),
+        "median": histogram_percentile(histogram, 50),
+        "q1": q1,
+        "q3": q3,
+        "iqr": q3 - q1,
+    }
+
+def histogram_box_statistics(histogram: list[list[int]]) -> dict:
+    """ Box and whiskers of a boxplot of the values of the histogram:
+    whiskers at the most extreme values within 1.5 IQR from the box,
+    outliers are the (distinct) values beyond the whiskers.
+    """
+    values, _ = _histogram_arrays(histogram)
+    q1 = histogram_percentile(histogram, 25)
+    q2 = histogram_percentile(histogram, 50)
+    q3 = histogram_percentile(histogram, 75)
+    iqr = q3 - q1
+    upper = max(values[values <= q3 + 1.5 * iqr].max(), q3)
+    lower = min(values[values >= q1 - 1.5 * iqr].min(), q1)
+    return {
+        "q1": q1,
+        "q2": q2,
+        "q3": q3,
+        "lower": float(lower),
+        "upper": float(upper),
+        "outliers": [float(v) for v in values if v > upper or v < lower],
+    }
+
+def histogram_kde(histogram: list[list[int]], bandwidth: float=0.5, cut: float=5, n_samples: int=100) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """ Gaussian kernel density estimate of the values of the histogram, weighted
+    by the frequencies, equivalent to scipy.stats.gaussian_kde of the expanded values
+    with bw_method=bandwidth (and support as in holoviews.operation.stats.univariate_kde).
+    Returns the values and the (not normalized) density, both empty if the
+    estimate cannot be computed (less than two distinct values).
+    """
+    values, frequencies = _histogram_arrays(histogram)
+    count = frequencies.sum()
+    if len(values) < 2:
+        return numpy.array([]), numpy.array([])
+    mean = (values * frequencies).sum() / count
+    std = numpy.sqrt(((values - mean)**2 * frequencies).sum() / (count - 1))
+    support_bandwidth = count ** (-1 / 5) * std
+    xs = numpy.linspace(values[0] - cut * support_bandwidth, values[-1] + cut * support_bandwidth, n_samples)
+    sigma = bandwidth * std
+    density = (frequencies[None, :] * numpy.exp(-0.5 * ((xs[:, None] - values[None, :]) / sigma)**2)).sum(axis=1)
+    mask = numpy.isfinite(density) & (density > 0)
+    return xs[mask], density[mask]
+
+
+if __name__ == "__main__":
+    # check the statistics against numpy on random counts
+    rng = numpy.random.default_rng(0)
+    for _ in range(200):
+        values_ = rng.poisson(rng.uniform(0.5, 20), size=rng.integers(1, 5000)).tolist()
+        histogram_ = histogram_from_values(values_)
+        statistics_ = histogram_statistics(histogram_)
+        expected_ = {
+            "count": len(values_),
+            "mean": numpy.mean(values_),
+            "stdev": numpy.std(values_),
+            "median": numpy.median(values_),
+            "q1": numpy.percentile(values_, 25),
+            "q3": numpy.percentile(values_, 75),
+        }
+        for k, v in expected_.items():
+            if abs(statistics_[k] - v) > 1e-9 * max(1, abs(v)):
+                raise ValueError(f"{k}: {statistics_[k]} from the histogram, {v} from the values {values_}")
+        if histogram_to_values(histogram_) != sorted(values_):
+            raise ValueError("The histogram does not expand to the values.")
+    print(f"OK, e.g. {len(values_):,d} values -> {len(histogram_)} histogram bins")
@@ -0,0 +1,78 @@
+# PLOTS OF HISTOGRAMS OF PER-PATIENT COUNTS
+#
+# Boxplot and violin plot of the distributions stored as histograms (see histogram),
+# with the same layout as the holoviews BoxWhisker and Violin plots previously used.
+
+import numpy
+import bokeh.models
+import bokeh.plotting
+
+from .histogram import histogram_box_statistics, histogram_kde, histogram_percentile
+
+
+def _categorical_figure(categories: list[str], title: str, x_axis_label: str, y_axis_label: str) -> bokeh.plotting.figure:
+    plot = bokeh.plotting.figure(
+        x_range=bokeh.models.FactorRange(*categories),
+        title=title,
+        x_axis_label=x_axis_label,
+        y_axis_label=y_axis_label,
+        tools="pan,wheel_zoom,box_zoom,reset,save",
+        toolbar_location="right",
+    )
+    plot.xgrid.grid_line_color = None
+    return plot
+
+def histograms_boxplot(categories: list[str], histograms: list[list[list[int]]], title: str, x_axis_label: str, y_axis_label: str, box_fill_color: str="#d3e3fd", box_width: float=0.7, whisker_width: float=0.4) -> bokeh.plotting.figure:
+    """ Bokeh boxplot with one box for each category (e.g. the years), computed from its histogram.
+    """
+    if len(categories) != len(histograms):
+        raise ValueError(f"categories and histograms must have the same length, got {len(categories)} and {len(histograms)}")
+    plot = _categorical_figure(categories, title, x_axis_label, y_axis_label)
+    statistics = [histogram_box_statistics(h) for h in histograms]
+    source = bokeh.models.ColumnDataSource({
+        "x": categories,
+        "q1": [s["q1"] for s in statistics],
+        "q2": [s["q2"] for s in statistics],
+        "q3": [s["q3"] for s in statistics],
+        "lower": [s["lower"] for s in statistics],
+        "upper": [s["upper"] for s in statistics],
+        "whisker_left": [(c, -whisker_width / 2) for c in categories],
+        "whisker_right": [(c, whisker_width / 2) for c in categories],
+    })
+    plot.segment(x0="x", y0="upper", x1="x", y1="q3", source=source, line_color="black")
+    plot.segment(x0="x", y0="lower", x1="x", y1="q1", source=source, line_color="black")
+    plot.segment(x0="whisker_left", y0="upper", x1="whisker_right", y1="upper", source=source, line_color="black")
+    plot.segment(x0="whisker_left", y0="lower", x1="whisker_right", y1="lower", source=source, line_color="black")
+    plot.vbar(x="x", width=box_width, top="q2", bottom="q3", source=source, fill_color=box_fill_color, line_color="black")
+    plot.vbar(x="x", width=box_width, top="q1", bottom="q2", source=source, fill_color=box_fill_color, line_color="black")
+    outliers_x = [c for c, s in zip(categories, statistics) for _ in s["outliers"]]
+    outliers_y = [v for s in statistics for v in s["outliers"]]
+    if len(outliers_x) > 0:
+        plot.scatter(x=outliers_x, y=outliers_y, size=6, fill_color=box_fill_color, line_color="black")
+    return plot
+
+def histograms_violin(categories: list[str], histograms: list[list[list[int]]], title: str, x_axis_label: str, y_axis_label: str, violin_color: str="#d3e3fd", bandwidth: float=0.5, violin_width: float=0.8) -> bokeh.plotting.figure:
+    """ Bokeh violin plot with one violin for each category (e.g. the years),
+    with the quartiles, computed from its histogram.
+    """
+    if len(categories) != len(histograms):
+        raise ValueError(f"categories and histograms must have the same length, got {len(categories)} and {len(histograms)}")
+    plot = _categorical_figure(categories, title, x_axis_label, y_axis_label)
+    patches_xs, patches_ys = [], []
+    quartiles_x0, quartiles_x1, quartiles_y = [], [], []
+    for category, histogram in zip(categories, histograms):
+        ys, density = histogram_kde(histogram, bandwidth=bandwidth)
+        if len(ys) == 0:
+            continue
+        half_widths = density / density.max() * violin_width / 2
+        # left side going up, right side going down
+        patches_xs.append([(category, -w) for w in half_widths] + [(category, w) for w in half_widths[::-1]])
+        patches_ys.append(numpy.concatenate([ys, ys[::-1]]).tolist())
+        for q in [25, 50, 75]:
+            i = int(numpy.argmin(numpy.abs(ys - histogram_percentile(histogram, q))))
+            quartiles_x0.append((category, -half_widths[i]))
+            quartiles_x1.append((category, half_widths[i]))
+            quartiles_y.append(float(ys[i]))
+    plot.patches(xs=patches_xs, ys=patches_ys, fill_color=violin_color, line_color="black")
+    plot.segment(x0=quartiles_x0, y0=quartiles_y, x1=quartiles_x1, y1=quartiles_y, line_color="black")
+    return plot
@@ -224,8 +224,11 @@ class IndicatorPanel(object):
             self.tabs_pane[:] = obj_list
             self._pane[:] = [title_row, self.tabs_pane]
         else:
+            # dynamic: only the active tab is rendered, and its plot computed
+            # (the tabs bind their plots with async_plot.lazy_bind)
             self.tabs_pane = panel.Tabs(
                 *obj_list,
+                dynamic=True,
                 tabs_location="above",
                 active=self._tabs_active_tab_index,
                 design=Material,
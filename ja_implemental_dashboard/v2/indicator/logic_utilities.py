@@ -17,7 +17,10 @@ def clean_indicator_getter_input(**kwargs):
         in ["_a_", "_b_", "_c_"] corresponding to ["PREVALENT", "INCIDENT", "INCIDENT_1825"]
         default: "_a_"
     - year_of_inclusion: int
-        required
+        required, unless years_of_inclusion is provided
+    - years_of_inclusion: list[int]
+        the years of inclusion to evaluate all at once (see evaluation.engine)
+        default: [year_of_inclusion]
     - age: list[tuple[int, int]]
     - gender: str
         in ["A", "A-U", "M", "F", "U"]
@@ -48,8 +51,16 @@ def clean_indicator_getter_input(**kwargs):
     if cohort_code not in ["_a_", "_b_", "_c_"]:
         raise ValueError("cohort_code must be in ['_a_', '_b_', '_c_'] corresponding to ['PREVALENT', 'INCIDENT', 'INCIDENT_1825']")
     year_of_inclusion = kwargs.get("year_of_inclusion", None)
+    years_of_inclusion = kwargs.get("years_of_inclusion", None)
+    if year_of_inclusion is None and years_of_inclusion is None:
+        raise ValueError("year_of_inclusion or years_of_inclusion must be provided")
+    if years_of_inclusion is None:
+        years_of_inclusion = [year_of_inclusion]
+    if not isinstance(years_of_inclusion, (list, tuple)) or len(years_of_inclusion) == 0:
+        raise ValueError(f"years_of_inclusion must be a non-empty list of int, got {years_of_inclusion} instead")
+    years_of_inclusion = [int(y) for y in years_of_inclusion]
     if year_of_inclusion is None:
-        raise ValueError("year_of_inclusion must be provided")
+        year_of_inclusion = years_of_inclusion[0]
     year_of_inclusion = int(year_of_inclusion)
     age = kwargs.get("age", [(1,150)])
     gender = kwargs.get("gender", "A")
@@ -71,6 +82,7 @@ def clean_indicator_getter_input(**kwargs):
         "disease_db_code": disease_db_code,
         "cohort_code": cohort_code,
         "year_of_inclusion": year_of_inclusion,
+        "years_of_inclusion": years_of_inclusion,
         "age": age,
         "gender": gender,
         "civil_status": civil_status,
@@ -14,96 +14,21 @@ import bokeh.plotting
 
 from ...database.database import DISEASE_CODE_TO_DB_CODE
 from ...database.database import stratify_demographics, check_database_has_tables
+from ...database.database import get_age_stratification_condition, INCIDENT_18_25_AGE_INTERVAL
 from ..logic_utilities import clean_indicator_getter_input
+from .engine import ma3
 from ..widget import indicator_widget, AGE_WIDGET_INTERVALS
 from ...main_selectors.disease_text import DS_TITLE as DISEASES_LANGDICT
-from ...caching.indicators import is_call_in_cache, retrieve_cached_json, cache_json
+from ...caching.indicators import get_indicators_cache_client
+from ...database.parallel import map_years
+from ..async_plot import AsyncPlot, lazy_bind
 from ...loading.loading import increase_loading_counter, decrease_loading_counter
 
 
 
 
 
-# indicator computation logic
-def ma3(**kwargs):
-    """
-    """
-    # inputs
-    kwargs = clean_indicator_getter_input(**kwargs)
-    connection: sqlite3.Connection = kwargs.get("connection", None)
-    disease_db_code = kwargs.get("disease_db_code", None)
-    year_of_inclusion = kwargs.get("year_of_inclusion", None)
-    age = kwargs.get("age", None)
-    gender = kwargs.get("gender", None)
-    civil_status = kwargs.get("civil_status", None)
-    job_condition = kwargs.get("job_condition", None)
-    educational_level = kwargs.get("educational_level", None)
-    # output
-    ma3 = {
-        "all": None,     # patients with any disease
-        "selected": None # patients with the selected disease
-    }
-    # logic
-    # - first find stratified demographics (delete the table before return)
-    stratified_demographics_table_name = stratify_demographics(
-        connection=connection,
-        year_of_inclusion=year_of_inclusion,
-        age=age,
-        gender=gender,
-        civil_status=civil_status,
-        job_condition=job_condition,
-        educational_level=educational_level
-    )
-    # open a cursor (close it before return)
-    cursor = connection.cursor()
-    # check if table is empty
-    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
-    if cursor.fetchone()[0] == 0:
-        # return
-        ma3["all"] = 0
-        ma3["selected"] = 0
-        return ma3
-    # get the indicator values
-    # all patients
-    incident_18_25_column_name = f"incident_18_25_{year_of_inclusion}"
-    all_ = int(
-        cursor.execute(f"""
-            SELECT COUNT(ID_SUBJECT) from COHORTS
-            WHERE 
-                ID_SUBJECT IN (
-                    SELECT {incident_18_25_column_name} AS ID_SUBJECT FROM age_stratification WHERE {incident_18_25_column_name} IS NOT NULL
-                    INTERSECT /*AND*/
-                    SELECT ID_SUBJECT FROM {stratified_demographics_table_name}
-                )
-                AND
-                YEAR_OF_ONSET = {int(year_of_inclusion)}
-                /* No check on the disease here */                   
-        """).fetchone()[0]
-    )
-    # selected patients (with the disease)
-    selected_ = int(
-        cursor.execute(f"""
-            SELECT COUNT(ID_SUBJECT) from COHORTS
-            WHERE 
-                ID_SUBJECT IN (
-                    SELECT {incident_18_25_column_name} AS ID_SUBJECT FROM age_stratification WHERE {incident_18_25_column_name} IS NOT NULL
-                    INTERSECT /*AND*/
-                    SELECT ID_SUBJECT FROM {stratified_demographics_table_name}
-                )
-                AND
-                YEAR_OF_ONSET = {int(year_of_inclusion)}
-                AND
-                ID_DISORDER = '{disease_db_code}'
-        """).fetchone()[0]
-    )
-    ma3["all"] = all_
-    ma3["selected"] = selected_
-    # delete the table of stratified demograpohics
-    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
-    # close the cursor
-    cursor.close()
-    # return
-    return ma3
+# indicator computation logic: see engine
 
 
 # Indicator display
@@ -196,6 +121,7 @@ class ma3_tab0(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         age_interval = self.widgets_instance.value["age"]
@@ -206,32 +132,8 @@ class ma3_tab0(object):
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
         # - cache check
-        is_in_cache = is_call_in_cache(
-            indicator_name=ma3_code,
-            disease_code=disease_code,
-            age_interval=age_interval_list,
-            gender=gender,
-            civil_status=civil_status,
-            job_condition=job_condition,
-            educational_level=educational_level
-        )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=ma3_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            ma3_all = [int(v) for v in y["all"]]
-            ma3_selected = [int(v) for v in y["selected"]]
-            del y
-        else:
-            cursor = self._db_conn.cursor()
+        def compute_() -> tuple[str,str]:
+            cursor = connection.cursor()
             # get the years of inclusion as all years from the first occurrence of the disease
             # for any patient up to the current year
             try:
@@ -249,9 +151,9 @@ class ma3_tab0(object):
             # get the indicator values (y-axis) for the years of inclusion (x-axis on the plot)
             ma3_all = []
             ma3_selected = []
-            for year in years_to_evaluate:
-                ma3_ = ma3(
-                    connection=self._db_conn,
+            def evaluate_year_(connection: sqlite3.Connection, year: int) -> dict:
+                return ma3(
+                    connection=connection,
                     cohorts_required=True,
                     disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
                     year_of_inclusion=year,
@@ -261,11 +163,11 @@ class ma3_tab0(object):
                     job_condition=job_condition,
                     educational_level=educational_level
                 )
+            for ma3_ in map_years(connection, evaluate_year_, years_to_evaluate):
                 ma3_all.append(ma3_["all"])
                 ma3_selected.append(ma3_["selected"])
             # close cursor
             cursor.close()
-            # cache the result
             x_json = json.dumps(years_to_evaluate)
             y_json = json.dumps(
                 {
@@ -273,17 +175,21 @@ class ma3_tab0(object):
                     "selected": ma3_selected
                 }
             )
-            cache_json(
-                indicator_name=ma3_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
+            return x_json, y_json
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
+            indicator_name=ma3_code,
+            compute=compute_,
+            disease_code=disease_code,
+            age_interval=age_interval_list,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level
+        )
+        years_to_evaluate = [int(v) for v in x]
+        ma3_all = [int(v) for v in y["all"]]
+        ma3_selected = [int(v) for v in y["selected"]]
+        del y
         # plot - use bokeh because it allows independent zooming
         _y_max_plot = max(max(ma3_all), max(ma3_selected))
         _y_max_plot *= 1.15
@@ -347,8 +253,8 @@ class ma3_tab0(object):
         language_code = kwargs.get("language_code", "en")
         disease_code = kwargs.get("disease_code", "_depression_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 indicator_widget_value=self.widgets_instance.param.value,
@@ -26,117 +26,20 @@ import bokeh.plotting
 from ...database.database import DISEASE_CODE_TO_DB_CODE
 from ...database.database import stratify_demographics, check_database_has_tables
 from ..logic_utilities import clean_indicator_getter_input
+from .engine import mb2
 from ..widget import indicator_widget, AGE_WIDGET_INTERVALS
 from ...main_selectors.disease_text import DS_TITLE as DISEASES_LANGDICT
-from ...caching.indicators import is_call_in_cache, retrieve_cached_json, cache_json
+from ...caching.indicators import get_indicators_cache_client
+from ...database.parallel import map_years
+from ..async_plot import AsyncPlot, lazy_bind
 from ...loading.loading import increase_loading_counter, decrease_loading_counter
 
 
 
 
 
-# indicator computation logic
-def mb2(**kwargs):
-    """
-    output:
-    dict[str: list[int]]
-    keys level 0: ["01", "02", "03", "04", "05", "06", "07", "Other"] # TYPE_INT levels
-    """
-    # inputs
-    kwargs = clean_indicator_getter_input(**kwargs)
-    connection: sqlite3.Connection = kwargs.get("connection", None)
-    disease_db_code = kwargs.get("disease_db_code", None)
-    year_of_inclusion = kwargs.get("year_of_inclusion", None)
-    age = kwargs.get("age", None)
-    gender = kwargs.get("gender", None)
-    civil_status = kwargs.get("civil_status", None)
-    job_condition = kwargs.get("job_condition", None)
-    educational_level = kwargs.get("educational_level", None)
-    # output
-    type_int_list = [1, 2, 3, 4, 5, 6, 7, 9]
-    out_dict_key_list = type_int_list+["any_type"]
-    mb2 = {k: [0] for k in out_dict_key_list}
-    # logic
-    # - first find stratified demographics (delete the table before return)
-    stratified_demographics_table_name = stratify_demographics(
-        connection=connection,
-        year_of_inclusion=year_of_inclusion,
-        age=age,
-        gender=gender,
-        civil_status=civil_status,
-        job_condition=job_condition,
-        educational_level=educational_level
-    )
-    # open a cursor (close it before return)
-    cursor = connection.cursor()
-    # check if table is empty
-    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
-    if cursor.fetchone()[0] == 0:
-        return mb2
-    # get the indicator values
-    # first, get the value for any TYPE_INT in the 'interventions' table
-    cursor.execute(f"""
-        SELECT COUNT(*)
-        FROM interventions
-        WHERE 
-            ID_SUBJECT IN (
-                /* Must be in the right stratification */
-                SELECT DISTINCT ID_SUBJECT FROM {stratified_demographics_table_name}
-                INTERSECT
-                /* Must have the disease at the year of inclusion (prevalent patient) */
-                SELECT DISTINCT ID_SUBJECT FROM cohorts WHERE 
-                    YEAR_OF_ONSET <= {year_of_inclusion}
-                    AND 
-                    ID_DISORDER = '{disease_db_code}'
-            )
-            /* Here, TYPE_INT can be any but NULL */
-            AND
-            TYPE_INT IS NOT NULL
-            /* DT_INT year must be in the year of inclusion */
-            AND
-            CAST(strftime('%Y', DT_INT) AS INTEGER) = {year_of_inclusion}
-        GROUP BY ID_SUBJECT
-    """)
-    mb2["any_type"] = [int(c[0]) for c in cursor.fetchall()]
-    if sum(mb2["any_type"]) == 0:
-        mb2["any_type"] = [0]
-        return mb2
-    # first version: outer while loop
-    for type_int_code in type_int_list:
-        cursor.execute(f"""
-            SELECT COUNT(*)
-            FROM interventions
-            WHERE 
-                ID_SUBJECT IN (
-                    /* Must be in the right stratification */
-                    SELECT DISTINCT ID_SUBJECT FROM {stratified_demographics_table_name}
-                    INTERSECT
-                    /* Must have the disease at the year of inclusion (prevalent patient) */
-                    SELECT DISTINCT ID_SUBJECT FROM cohorts WHERE 
-                        YEAR_OF_ONSET <= {year_of_inclusion}
-                        AND 
-                        ID_DISORDER = '{disease_db_code}'
-                )
-                AND
-                /* Here, TYPE_INT must be equal to type_int_code */
-                TYPE_INT = {int(type_int_code)}
-                AND
-                /* DT_INT year must be in the year of inclusion */
-                CAST(strftime('%Y', DT_INT) AS INTEGER) = {year_of_inclusion}
-            GROUP BY ID_SUBJECT
-        """)
-        mb2[type_int_code] = [int(c[0]) for c in cursor.fetchall()]
-    # delete the table of stratified demograpohics
-    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
-    # close the cursor
-    cursor.close()
-    # check output
-    for k in mb2:
-        if len(mb2[k]) == 0:
-            mb2[k] = [0]
-    # return
-    return mb2
-    
+# indicator computation logic: see engine
+
 
 # Indicator display
 mb2_code = "MB2"
@@ -330,6 +233,7 @@ class mb2_tab0(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         age_interval = self.widgets_instance.value["age"]
@@ -339,43 +243,9 @@ class mb2_tab0(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        # - cache check
-        is_in_cache = is_call_in_cache(
-            indicator_name=mb2_code,
-            disease_code=disease_code,
-            age_interval=age_interval_list,
-            gender=gender,
-            civil_status=civil_status,
-            job_condition=job_condition,
-            educational_level=educational_level
-        )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            y = {int(k) if k != "any_type" else k: y[k] for k in y}
-            # get the values specific for this tab,
-            # which are the sum of the interventions for each year
-            # from list[list[int]] to list[int] spanning along the years of inclusion
-            mb2_all = [sum(y["any_type"][i]) for i in range(len(y["any_type"]))]
-            mb2_01 = [sum(y[1][i]) for i in range(len(y[1]))]
-            mb2_02 = [sum(y[2][i]) for i in range(len(y[2]))]
-            mb2_03 = [sum(y[3][i]) for i in range(len(y[3]))]
-            mb2_04 = [sum(y[4][i]) for i in range(len(y[4]))]
-            mb2_05 = [sum(y[5][i]) for i in range(len(y[5]))]
-            mb2_06 = [sum(y[6][i]) for i in range(len(y[6]))]
-            mb2_07 = [sum(y[7][i]) for i in range(len(y[7]))]
-            mb2_other = [sum(y[9][i]) for i in range(len(y[9]))]
-        else:
-            cursor = self._db_conn.cursor()
+        # - cache lookup, computed on a miss
+        def compute_() -> tuple[str,str]:
+            cursor = connection.cursor()
             # get the years of inclusion as all years from the first occurrence of the disease
             # for any patient up to the current year
             try:
@@ -393,9 +263,9 @@ class mb2_tab0(object):
             years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
             # get the indicator distribution of values (y-axis) for the years of inclusion (x-axis on the plot) for caching
             mb2_all, mb2_01, mb2_02, mb2_03, mb2_04, mb2_05, mb2_06, mb2_07, mb2_09 = [], [], [], [], [], [], [], [], [] # these will be list of lists of integers
-            for year in years_to_evaluate:
-                mb2_ = mb2(
-                    connection=self._db_conn,
+            def evaluate_year_(connection: sqlite3.Connection, year: int) -> dict:
+                return mb2(
+                    connection=connection,
                     cohorts_required=True,
                     disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
                     year_of_inclusion=year,
@@ -405,6 +275,7 @@ class mb2_tab0(object):
                     job_condition=job_condition,
                     educational_level=educational_level
                 )
+            for mb2_ in map_years(connection, evaluate_year_, years_to_evaluate):
                 mb2_all.append(mb2_["any_type"])
                 mb2_01.append(mb2_[1])
                 mb2_02.append(mb2_[2])
@@ -430,29 +301,31 @@ class mb2_tab0(object):
                     "any_type": mb2_all
                 }
             )
-            cache_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # now, get the values specific for this tab,
-            # which are the sum of the interventions for each year
-            # from list[list[int]] to list[int] spanning along the years of inclusion
-            mb2_all = [sum(mb2_all[i]) for i in range(len(mb2_all))]
-            mb2_01 = [sum(mb2_01[i]) for i in range(len(mb2_01))]
-            mb2_02 = [sum(mb2_02[i]) for i in range(len(mb2_02))]
-            mb2_03 = [sum(mb2_03[i]) for i in range(len(mb2_03))]
-            mb2_04 = [sum(mb2_04[i]) for i in range(len(mb2_04))]
-            mb2_05 = [sum(mb2_05[i]) for i in range(len(mb2_05))]
-            mb2_06 = [sum(mb2_06[i]) for i in range(len(mb2_06))]
-            mb2_07 = [sum(mb2_07[i]) for i in range(len(mb2_07))]
-            mb2_other = [sum(mb2_09[i]) for i in range(len(mb2_09))]
+            return x_json, y_json
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
+            indicator_name=mb2_code,
+            compute=compute_,
+            disease_code=disease_code,
+            age_interval=age_interval_list,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level
+        )
+        years_to_evaluate = [int(v) for v in x]
+        y = {int(k) if k != "any_type" else k: y[k] for k in y}
+        # get the values specific for this tab,
+        # which are the sum of the interventions for each year
+        # from list[list[int]] to list[int] spanning along the years of inclusion
+        mb2_all = [sum(y["any_type"][i]) for i in range(len(y["any_type"]))]
+        mb2_01 = [sum(y[1][i]) for i in range(len(y[1]))]
+        mb2_02 = [sum(y[2][i]) for i in range(len(y[2]))]
+        mb2_03 = [sum(y[3][i]) for i in range(len(y[3]))]
+        mb2_04 = [sum(y[4][i]) for i in range(len(y[4]))]
+        mb2_05 = [sum(y[5][i]) for i in range(len(y[5]))]
+        mb2_06 = [sum(y[6][i]) for i in range(len(y[6]))]
+        mb2_07 = [sum(y[7][i]) for i in range(len(y[7]))]
+        mb2_other = [sum(y[9][i]) for i in range(len(y[9]))]
         # plot - use bokeh because it allows independent zooming
         _y_max_plot = max([max(mb2_all), 1/1.15])
         _y_max_plot *= 1.15
@@ -520,8 +393,8 @@ class mb2_tab0(object):
         language_code = kwargs.get("language_code", "en")
         disease_code = kwargs.get("disease_code", "_depression_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 indicator_widget_value=self.widgets_instance.param.value,
@@ -553,6 +426,7 @@ class mb2_tab1(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         age_interval = self.widgets_instance.value["age"]
@@ -562,41 +436,9 @@ class mb2_tab1(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        # - cache check
-        is_in_cache = is_call_in_cache(
-            indicator_name=mb2_code,
-            disease_code=disease_code,
-            age_interval=age_interval_list,
-            gender=gender,
-            civil_status=civil_status,
-            job_condition=job_condition,
-            educational_level=educational_level
-        )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            y = {int(k) if k != "any_type" else k: y[k] for k in y}
-            # get the values specific for this tab,
-            mb2_all = y["any_type"]
-            mb2_01 = y[1]
-            mb2_02 = y[2]
-            mb2_03 = y[3]
-            mb2_04 = y[4]
-            mb2_05 = y[5]
-            mb2_06 = y[6]
-            mb2_07 = y[7]
-            mb2_other = y[9]
-        else:
-            cursor = self._db_conn.cursor()
+        # - cache lookup, computed on a miss
+        def compute_() -> tuple[str,str]:
+            cursor = connection.cursor()
             # get the years of inclusion as all years from the first occurrence of the disease
             # for any patient up to the current year
             try:
@@ -614,9 +456,9 @@ class mb2_tab1(object):
             years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
             # get the indicator distribution of values (y-axis) for the years of inclusion (x-axis on the plot) for caching
             mb2_all, mb2_01, mb2_02, mb2_03, mb2_04, mb2_05, mb2_06, mb2_07, mb2_09 = [], [], [], [], [], [], [], [], [] # these will be list of lists of integers
-            for year in years_to_evaluate:
-                mb2_ = mb2(
-                    connection=self._db_conn,
+            def evaluate_year_(connection: sqlite3.Connection, year: int) -> dict:
+                return mb2(
+                    connection=connection,
                     cohorts_required=True,
                     disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
                     year_of_inclusion=year,
@@ -626,6 +468,7 @@ class mb2_tab1(object):
                     job_condition=job_condition,
                     educational_level=educational_level
                 )
+            for mb2_ in map_years(connection, evaluate_year_, years_to_evaluate):
                 mb2_all.append(mb2_["any_type"])
                 mb2_01.append(mb2_[1])
                 mb2_02.append(mb2_[2])
@@ -651,20 +494,29 @@ class mb2_tab1(object):
                     "any_type": mb2_all
                 }
             )
-            cache_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # now, get the values specific for this tab,
-            # already fine, just 09 -> other
-            mb2_other = mb2_09
+            return x_json, y_json
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
+            indicator_name=mb2_code,
+            compute=compute_,
+            disease_code=disease_code,
+            age_interval=age_interval_list,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level
+        )
+        years_to_evaluate = [int(v) for v in x]
+        y = {int(k) if k != "any_type" else k: y[k] for k in y}
+        # get the values specific for this tab,
+        mb2_all = y["any_type"]
+        mb2_01 = y[1]
+        mb2_02 = y[2]
+        mb2_03 = y[3]
+        mb2_04 = y[4]
+        mb2_05 = y[5]
+        mb2_06 = y[6]
+        mb2_07 = y[7]
+        mb2_other = y[9]
         # plot: BoxWhisker (not available in Bokeh)
         # make a BoxWhisker plot
         # groups (the years)
@@ -796,8 +648,8 @@ class mb2_tab1(object):
         language_code = kwargs.get("language_code", "en")
         disease_code = kwargs.get("disease_code", "_depression_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 indicator_widget_value=self.widgets_instance.param.value,
@@ -832,6 +684,7 @@ class mb2_tab2(object):
 
     def get_plot(self, **kwargs):
         # inputs
+        connection = kwargs.get("connection", self._db_conn)
         language_code = kwargs.get("language_code", self._language_code)
         disease_code = kwargs.get("disease_code", None)
         age_interval = self.widgets_instance.value["age"]
@@ -841,41 +694,9 @@ class mb2_tab2(object):
         job_condition = self.widgets_instance.value["job_condition"]
         educational_level = self.widgets_instance.value["educational_level"]
         # logic
-        # - cache check
-        is_in_cache = is_call_in_cache(
-            indicator_name=mb2_code,
-            disease_code=disease_code,
-            age_interval=age_interval_list,
-            gender=gender,
-            civil_status=civil_status,
-            job_condition=job_condition,
-            educational_level=educational_level
-        )
-        if is_in_cache:
-            x_json, y_json = retrieve_cached_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level
-            )
-            years_to_evaluate = [int(v) for v in json.loads(x_json)]
-            y = json.loads(y_json)
-            y = {int(k) if k != "any_type" else k: y[k] for k in y}
-            # get the values specific for this tab,
-            mb2_all = y["any_type"]
-            mb2_01 = y[1]
-            mb2_02 = y[2]
-            mb2_03 = y[3]
-            mb2_04 = y[4]
-            mb2_05 = y[5]
-            mb2_06 = y[6]
-            mb2_07 = y[7]
-            mb2_other = y[9]
-        else:
-            cursor = self._db_conn.cursor()
+        # - cache lookup, computed on a miss
+        def compute_() -> tuple[str,str]:
+            cursor = connection.cursor()
             # get the years of inclusion as all years from the first occurrence of the disease
             # for any patient up to the current year
             try:
@@ -893,9 +714,9 @@ class mb2_tab2(object):
             years_to_evaluate = [y for y in range(min_year_, time.localtime().tm_year+1)]
             # get the indicator distribution of values (y-axis) for the years of inclusion (x-axis on the plot) for caching
             mb2_all, mb2_01, mb2_02, mb2_03, mb2_04, mb2_05, mb2_06, mb2_07, mb2_09 = [], [], [], [], [], [], [], [], [] # these will be list of lists of integers
-            for year in years_to_evaluate:
-                mb2_ = mb2(
-                    connection=self._db_conn,
+            def evaluate_year_(connection: sqlite3.Connection, year: int) -> dict:
+                return mb2(
+                    connection=connection,
                     cohorts_required=True,
                     disease_db_code=DISEASE_CODE_TO_DB_CODE[disease_code],
                     year_of_inclusion=year,
@@ -905,6 +726,7 @@ class mb2_tab2(object):
                     job_condition=job_condition,
                     educational_level=educational_level
                 )
+            for mb2_ in map_years(connection, evaluate_year_, years_to_evaluate):
                 mb2_all.append(mb2_["any_type"])
                 mb2_01.append(mb2_[1])
                 mb2_02.append(mb2_[2])
@@ -930,20 +752,29 @@ class mb2_tab2(object):
                     "any_type": mb2_all
                 }
             )
-            cache_json(
-                indicator_name=mb2_code,
-                disease_code=disease_code,
-                age_interval=age_interval_list,
-                gender=gender,
-                civil_status=civil_status,
-                job_condition=job_condition,
-                educational_level=educational_level,
-                x_json=x_json,
-                y_json=y_json
-            )
-            # now, get the values specific for this tab,
-            # already fine, just 09 -> other
-            mb2_other = mb2_09
+            return x_json, y_json
+        x, y = get_indicators_cache_client().get_or_compute_decoded(
+            indicator_name=mb2_code,
+            compute=compute_,
+            disease_code=disease_code,
+            age_interval=age_interval_list,
+            gender=gender,
+            civil_status=civil_status,
+            job_condition=job_condition,
+            educational_level=educational_level
+        )
+        years_to_evaluate = [int(v) for v in x]
+        y = {int(k) if k != "any_type" else k: y[k] for k in y}
+        # get the values specific for this tab,
+        mb2_all = y["any_type"]
+        mb2_01 = y[1]
+        mb2_02 = y[2]
+        mb2_03 = y[3]
+        mb2_04 = y[4]
+        mb2_05 = y[5]
+        mb2_06 = y[6]
+        mb2_07 = y[7]
+        mb2_other = y[9]
         # plot: BoxWhisker
         # make a BoxWhisker plot
         # groups (the years)
@@ -1079,8 +910,8 @@ class mb2_tab2(object):
         language_code = kwargs.get("language_code", "en")
         disease_code = kwargs.get("disease_code", "_depression_")
         pane = panel.Row(
-            panel.bind(
-                self.get_plot, 
+            lazy_bind(
+                AsyncPlot(self.get_plot, self._db_conn).get_plot, 
                 language_code=language_code, 
                 disease_code=disease_code,
                 indicator_widget_value=self.widgets_instance.param.value,
@@ -0,0 +1,354 @@
+import sqlite3
+
+from ...database.database import stratify_demographics
+from ...database.database import get_age_stratification_condition, INCIDENT_18_25_AGE_INTERVAL
+from ..logic_utilities import clean_indicator_getter_input
+
+# This module contains the computation logic of the monitoring indicators
+# (MA1, MA2, MA3, MB2), for one year of inclusion at a time.
+# It does not import panel nor any plotting library, so that the indicators can
+# also be computed without the dashboard (see export).
+# The tabs that display these indicators are in the a1, a2, a3 and b2 modules.
+
+
+def ma1(**kwargs):
+    """
+    """
+    # inputs
+    kwargs = clean_indicator_getter_input(**kwargs)
+    connection: sqlite3.Connection = kwargs.get("connection", None)
+    disease_db_code = kwargs.get("disease_db_code", None)
+    year_of_inclusion = kwargs.get("year_of_inclusion", None)
+    age = kwargs.get("age", None)
+    gender = kwargs.get("gender", None)
+    civil_status = kwargs.get("civil_status", None)
+    job_condition = kwargs.get("job_condition", None)
+    educational_level = kwargs.get("educational_level", None)
+    # output
+    ma1 = {
+        "all": None,     # patients with any disease
+        "selected": None # patients with the selected disease
+    }
+    # logic
+    # - first find stratified demographics (delete the table before return)
+    stratified_demographics_table_name = stratify_demographics(
+        connection=connection,
+        year_of_inclusion=year_of_inclusion,
+        age=age,
+        gender=gender,
+        civil_status=civil_status,
+        job_condition=job_condition,
+        educational_level=educational_level
+    )
+    # open a cursor (close it before return)
+    cursor = connection.cursor()
+    # check if table is empty
+    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
+    if cursor.fetchone()[0] == 0:
+        # return
+        ma1["all"] = 0
+        ma1["selected"] = 0
+        return ma1
+    # get the indicator values
+    # all patients
+    all_ = int(
+            cursor.execute(f"""
+                SELECT COUNT(ID_SUBJECT) from COHORTS
+                WHERE 
+                    ID_SUBJECT IN (SELECT ID_SUBJECT FROM {stratified_demographics_table_name})
+                    AND
+                    YEAR_OF_ONSET <= {int(year_of_inclusion)}
+                    /* No check on the disease here */                   
+            """).fetchone()[0]
+    )
+    # selected patients (with the disease)
+    selected_ = int(
+            cursor.execute(f"""
+                SELECT COUNT(ID_SUBJECT) from COHORTS
+                WHERE
+                    ID_SUBJECT IN (SELECT ID_SUBJECT FROM {stratified_demographics_table_name})
+                    AND
+                    YEAR_OF_ONSET <= {int(year_of_inclusion)}
+                    AND
+                    ID_DISORDER = '{disease_db_code}'
+            """).fetchone()[0]
+    )
+    ma1["all"] = all_
+    ma1["selected"] = selected_
+    # delete the table of stratified demograpohics
+    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
+    # close the cursor
+    cursor.close()
+    # return
+    return ma1
+
+def ma2(**kwargs):
+    """
+    """
+    # inputs
+    kwargs = clean_indicator_getter_input(**kwargs)
+    connection: sqlite3.Connection = kwargs.get("connection", None)
+    disease_db_code = kwargs.get("disease_db_code", None)
+    year_of_inclusion = kwargs.get("year_of_inclusion", None)
+    age = kwargs.get("age", None)
+    gender = kwargs.get("gender", None)
+    civil_status = kwargs.get("civil_status", None)
+    job_condition = kwargs.get("job_condition", None)
+    educational_level = kwargs.get("educational_level", None)
+    # output
+    ma2 = {
+        "all": None,     # patients with any disease
+        "selected": None # patients with the selected disease
+    }
+    # logic
+    # - first find stratified demographics (delete the table before return)
+    stratified_demographics_table_name = stratify_demographics(
+        connection=connection,
+        year_of_inclusion=year_of_inclusion,
+        age=age,
+        gender=gender,
+        civil_status=civil_status,
+        job_condition=job_condition,
+        educational_level=educational_level
+    )
+    # open a cursor (close it before return)
+    cursor = connection.cursor()
+    # check if table is empty
+    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
+    if cursor.fetchone()[0] == 0:
+        # return
+        ma2["all"] = 0
+        ma2["selected"] = 0
+        return ma2
+    # get the indicator values
+    # all patients
+    all_ = int(
+            cursor.execute(f"""
+                SELECT COUNT(ID_SUBJECT) from COHORTS
+                WHERE 
+                    ID_SUBJECT IN (SELECT ID_SUBJECT FROM {stratified_demographics_table_name})
+                    AND
+                    YEAR_OF_ONSET = {int(year_of_inclusion)}
+                    /* No check on the disease here */                   
+            """).fetchone()[0]
+    )
+    # selected patients (with the disease)
+    selected_ = int(
+            cursor.execute(f"""
+                SELECT COUNT(ID_SUBJECT) from COHORTS
+                WHERE
+                    ID_SUBJECT IN (SELECT ID_SUBJECT FROM {stratified_demographics_table_name})
+                    AND
+                    YEAR_OF_ONSET = {int(year_of_inclusion)}
+                    AND
+                    ID_DISORDER = '{disease_db_code}'
+            """).fetchone()[0]
+    )
+    ma2["all"] = all_
+    ma2["selected"] = selected_
+    # delete the table of stratified demograpohics
+    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
+    # close the cursor
+    cursor.close()
+    # return
+    return ma2
+
+def ma3(**kwargs):
+    """
+    """
+    # inputs
+    kwargs = clean_indicator_getter_input(**kwargs)
+    connection: sqlite3.Connection = kwargs.get("connection", None)
+    disease_db_code = kwargs.get("disease_db_code", None)
+    year_of_inclusion = kwargs.get("year_of_inclusion", None)
+    age = kwargs.get("age", None)
+    gender = kwargs.get("gender", None)
+    civil_status = kwargs.get("civil_status", None)
+    job_condition = kwargs.get("job_condition", None)
+    educational_level = kwargs.get("educational_level", None)
+    # output
+    ma3 = {
+        "all": None,     # patients with any disease
+        "selected": None # patients with the selected disease
+    }
+    # logic
+    # - first find stratified demographics (delete the table before return)
+    stratified_demographics_table_name = stratify_demographics(
+        connection=connection,
+        year_of_inclusion=year_of_inclusion,
+        age=age,
+        gender=gender,
+        civil_status=civil_status,
+        job_condition=job_condition,
+        educational_level=educational_level
+    )
+    # open a cursor (close it before return)
+    cursor = connection.cursor()
+    # check if table is empty
+    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
+    if cursor.fetchone()[0] == 0:
+        # return
+        ma3["all"] = 0
+        ma3["selected"] = 0
+        return ma3
+    # get the indicator values
+    # all patients
+    incident_18_25_selection_string = f"""
+        SELECT ID_SUBJECT FROM age_stratification
+        WHERE
+            YEAR_OF_INCLUSION = {int(year_of_inclusion)}
+            AND
+            {get_age_stratification_condition([INCIDENT_18_25_AGE_INTERVAL])}
+    """
+    all_ = int(
+        cursor.execute(f"""
+            SELECT COUNT(ID_SUBJECT) from COHORTS
+            WHERE 
+                ID_SUBJECT IN (
+                    {incident_18_25_selection_string}
+                    INTERSECT /*AND*/
+                    SELECT ID_SUBJECT FROM {stratified_demographics_table_name}
+                )
+                AND
+                YEAR_OF_ONSET = {int(year_of_inclusion)}
+                /* No check on the disease here */                   
+        """).fetchone()[0]
+    )
+    # selected patients (with the disease)
+    selected_ = int(
+        cursor.execute(f"""
+            SELECT COUNT(ID_SUBJECT) from COHORTS
+            WHERE 
+                ID_SUBJECT IN (
+                    {incident_18_25_selection_string}
+                    INTERSECT /*AND*/
+                    SELECT ID_SUBJECT FROM {stratified_demographics_table_name}
+                )
+                AND
+                YEAR_OF_ONSET = {int(year_of_inclusion)}
+                AND
+                ID_DISORDER = '{disease_db_code}'
+        """).fetchone()[0]
+    )
+    ma3["all"] = all_
+    ma3["selected"] = selected_
+    # delete the table of stratified demograpohics
+    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
+    # close the cursor
+    cursor.close()
+    # return
+    return ma3
+
+def mb2(**kwargs):
+    """
+    output:
+    dict[str: list[int]]
+    keys level 0: ["01", "02", "03", "04", "05", "06", "07", "Other"] # TYPE_INT levels
+    """
+    # inputs
+    kwargs = clean_indicator_getter_input(**kwargs)
+    connection: sqlite3.Connection = kwargs.get("connection", None)
+    disease_db_code = kwargs.get("disease_db_code", None)
+    year_of_inclusion = kwargs.get("year_of_inclusion", None)
+    age = kwargs.get("age", None)
+    gender = kwargs.get("gender", None)
+    civil_status = kwargs.get("civil_status", None)
+    job_condition = kwargs.get("job_condition", None)
+    educational_level = kwargs.get("educational_level", None)
+    # output
+    type_int_list = [1, 2, 3, 4, 5, 6, 7, 9]
+    out_dict_key_list = type_int_list+["any_type"]
+    mb2 = {k: [0] for k in out_dict_key_list}
+    # logic
+    # - first find stratified demographics (delete the table before return)
+    stratified_demographics_table_name = stratify_demographics(
+        connection=connection,
+        year_of_inclusion=year_of_inclusion,
+        age=age,
+        gender=gender,
+        civil_status=civil_status,
+        job_condition=job_condition,
+        educational_level=educational_level
+    )
+    # open a cursor (close it before return)
+    cursor = connection.cursor()
+    # check if table is empty
+    cursor.execute(f"SELECT COUNT(*) FROM {stratified_demographics_table_name}")
+    if cursor.fetchone()[0] == 0:
+        return mb2
+    # get the indicator values
+    # first, get the value for any TYPE_INT in the 'interventions' table
+    cursor.execute(f"""
+        SELECT COUNT(*)
+        FROM interventions
+        WHERE 
+            ID_SUBJECT IN (
+                /* Must be in the right stratification */
+                SELECT DISTINCT ID_SUBJECT FROM {stratified_demographics_table_name}
+                INTERSECT
+                /* Must have the disease at the year of inclusion (prevalent patient) */
+                SELECT DISTINCT ID_SUBJECT FROM cohorts WHERE 
+                    YEAR_OF_ONSET <= {year_of_inclusion}
+                    AND 
+                    ID_DISORDER = '{disease_db_code}'
+            )
+            /* Here, TYPE_INT can be any but NULL */
+            AND
+            TYPE_INT IS NOT NULL
+            /* DT_INT year must be in the year of inclusion */
+            AND
+            DT_INT_YEAR = {year_of_inclusion}
+        GROUP BY ID_SUBJECT
+    """)
+    mb2["any_type"] = [int(c[0]) for c in cursor.fetchall()]
+    if sum(mb2["any_type"]) == 0:
+        mb2["any_type"] = [0]
+        return mb2
+    # first version: outer while loop
+    for type_int_code in type_int_list:
+        cursor.execute(f"""
+            SELECT COUNT(*)
+            FROM interventions
+            WHERE 
+                ID_SUBJECT IN (
+                    /* Must be in the right stratification */
+                    SELECT DISTINCT ID_SUBJECT FROM {stratified_demographics_table_name}
+                    INTERSECT
+                    /* Must have the disease at the year of inclusion (prevalent patient) */
+                    SELECT DISTINCT ID_SUBJECT FROM cohorts WHERE 
+                        YEAR_OF_ONSET <= {year_of_inclusion}
+                        AND 
+                        ID_DISORDER = '{disease_db_code}'
+                )
+                AND
+                /* Here, TYPE_INT must be equal to type_int_code */
+                TYPE_INT = {int(type_int_code)}
+                AND
+                /* DT_INT year must be in the year of inclusion */
+                DT_INT_YEAR = {year_of_inclusion}
+            GROUP BY ID_SUBJECT
+        """)
+        mb2[type_int_code] = [int(c[0]) for c in cursor.fetchall()]
+    # delete the table of stratified demograpohics
+    cursor.execute(f"DROP TABLE IF EXISTS {stratified_demographics_table_name}")
+    # close the cursor
+    cursor.close()
+    # check output
+    for k in mb2:
+        if len(mb2[k]) == 0:
+            mb2[k] = [0]
+    # return
+    return mb2
+    
+
+
+MONITORING_INDICATORS_FUNCTIONS = {
+    "MA1": ma1,
+    "MA2": ma2,
+    "MA3": ma3,
+    "MB2": mb2,
+}
+
+
+if __name__ == "__main__":
+    print("This script is not intended to be run as the main script.")
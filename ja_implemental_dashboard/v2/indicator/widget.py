@@ -13,19 +13,11 @@ from .widget_texts import (
     WIDGET_GENDER_NAME_LANGDICT, WIDGET_GENDER_OPTIONS_LANGDICT,
     WIDGET_CIVIL_STATUS_NAME_LANGDICT, WIDGET_CIVIL_STATUS_OPTIONS_LANGDICT,
     WIDGET_EDUCATIONAL_LEVEL_NAME_LANGDICT, WIDGET_EDUCATIONAL_LEVEL_OPTIONS_LANGDICT,
-    WIDGET_JOB_CONDITION_NAME_LANGDICT, WIDGET_JOB_CONDITION_OPTIONS_LANGDICT
+    WIDGET_JOB_CONDITION_NAME_LANGDICT, WIDGET_JOB_CONDITION_OPTIONS_LANGDICT,
+    AGE_WIDGET_INTERVALS
 )
 
 
-AGE_WIDGET_INTERVALS = {
-    "All": (1,150),
-    "14-": (1,14), 
-    "15-25": (15,25), 
-    "26-40": (26,40), 
-    "41-64": (41,64), 
-    "65+": (65,150)
-}
-
 
 class age_widget(param.Parameterized):
     # By using param.Parameterized, the widget can be used as a parameter in other widgets
@@ -2,6 +2,18 @@
 # AGE
 ######
 
+# the age intervals of the widget, (min, max) inclusive, also used to build the
+# age_stratification table (this module does not import panel, so that it can be
+# imported by the database and headless modules)
+AGE_WIDGET_INTERVALS = {
+    "All": (1,150),
+    "14-": (1,14), 
+    "15-25": (15,25), 
+    "26-40": (26,40), 
+    "41-64": (41,64), 
+    "65+": (65,150)
+}
+
 WIDGET_AGE_NAME_LANGDICT = {
     "en": "Age",
     "it": "Età",
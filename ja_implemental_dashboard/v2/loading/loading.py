@@ -1,6 +1,9 @@
 import os, time, random
+import threading
+import contextlib
 import panel
 import param
+from panel.io.document import unlocked
 from .._panel_settings import PANEL_EXTENSION, PANEL_TEMPLATE, PANEL_SIZING_MODE
 panel.extension(
     PANEL_EXTENSION,
@@ -8,32 +11,146 @@ panel.extension(
     sizing_mode=PANEL_SIZING_MODE
 )
 
-# This module uses javascript and cookies to keep track of a counter
-# that will be increased or decreased by the elements when they change,
-# so that the loading animation can be shown or hidden accordingly.
-# Check out loading.js for more information.
+# This module keeps track, on the server, of the computations that are running
+# (the busy state of the dashboard), so that the loading animation can be shown
+# or hidden accordingly.
+#
+# The computations register themselves as tasks of loading_state (see LoadingState.task):
+# - blocking tasks (e.g. the update of the indicators by the dispatcher) show the
+#   loading animation over the whole dashboard;
+# - the other tasks (e.g. the plots being computed, see indicator.async_plot) show
+#   a progress bar on top of the page, with the percent progress of the tasks that
+#   report it (e.g. the years of inclusion already evaluated).
+# The state is a param.Parameterized, whose changes panel pushes to the browser over
+# the websocket of the session: there is no polling and nothing to wait for.
+
+LOADING_GIFS_URLS = [
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/04de2e31234507.564a1d23645bf.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/09b24e31234507.564a1d23c07b4.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/35771931234507.564a1d2403b3a.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/3f3a3831234507.564a1d2338123.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/585d0331234507.564a1d239ac5e.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/ab79a231234507.564a1d23814ef.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/c3c4d331234507.564a1d23db8f9.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/cd514331234507.564a1d2324e4e.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/dae67631234507.564a1d230a290.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/f1055231234507.564a1d234bfb6.gif",
+    "https://raw.githubusercontent.com/AAMIASoftwares-research/JA_ImpleMENTAL/main/assets/loading_gifs/loading_lightbulb.gif",
+]
+LOADING_TEXT_OPTIONS = [
+    "Loading...", "Caricamento...", "Cargando...", "Chargement...", "Laden...", "Carregando...",
+    "Please wait...", "Per favore, attendi...", "Por favor, espere...", "Bitte warten...", "Por favor, aguarde...", "Veuillez patienter...",
+    "Just a moment...", "Un attimo...", "Un momento...", "Einen Moment...", "Um momento...", "Un instant...",
+    "Almost there...", "Ci siamo quasi...", "Casi estamos...", "Presque là...", "Fast da...", "Quase lá...",
+    "Hold on...", "Resisti...", "Aguanta...", "Halte durch...", "Aguente...", "Tiens bon...",
+    "A little patience...", "Un attimo di pazienza...", "Un poco de paciencia...", "Ein wenig Geduld...", "Um pouco de paciência...", "Un peu de patience...",
+]
+
+
+def _pushed():
+    """ Send the changes made in the context to the browser right away,
+    also while a callback of the session is still running.
+    """
+    if panel.state.curdoc is None or getattr(panel.state, "_current_thread", None) != getattr(panel.state, "_thread_id", None):
+        # not in a session, or in another thread: panel schedules the changes on the event loop
+        return contextlib.nullcontext()
+    return unlocked()
+
+
+class LoadingState(param.Parameterized):
+    """ The tasks running on the server, see LoadingState.task. """
+    counter = param.Integer(default=0, bounds=(0, None), doc="Number of running blocking tasks.")
+    n_tasks = param.Integer(default=0, bounds=(0, None), doc="Number of running tasks.")
+    progress = param.Integer(default=None, allow_None=True, bounds=(0, 100), doc="Mean percent progress of the running tasks that report it.")
+    message = param.String(default="", doc="Description of the last task started.")
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._tasks = {}
+        self._next_task_id = 0
+        self._lock = threading.Lock()
+        self._update_lock = threading.RLock()
+
+    def _update(self) -> None:
+        with self._update_lock:
+            with self._lock:
+                tasks = list(self._tasks.values())
+            progresses = [t["progress"] for t in tasks if t["progress"] is not None]
+            values = {
+                "counter": sum([1 for t in tasks if t["blocking"]]),
+                "n_tasks": len(tasks),
+                "progress": None if len(progresses) == 0 else int(sum(progresses) / len(progresses)),
+                "message": tasks[-1]["description"] if len(tasks) > 0 else "",
+            }
+            changed = {k: v for k, v in values.items() if getattr(self, k) != v}
+            if len(changed) > 0:
+                with _pushed():
+                    self.param.update(**changed)
+
+    def start_task(self, description: str="", blocking: bool=False) -> int:
+        with self._lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._tasks[task_id] = {"description": description, "blocking": blocking, "progress": None}
+        self._update()
+        return task_id
+
+    def set_task_progress(self, task_id: int, n_done: int, n_total: int) -> None:
+        """ Can be called from any thread. """
+        progress = int(100 * n_done / n_total) if n_total > 0 else None
+        with self._lock:
+            if task_id not in self._tasks or self._tasks[task_id]["progress"] == progress:
+                return
+            self._tasks[task_id]["progress"] = progress
+        self._update()
+
+    def end_task(self, task_id: int) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+        self._update()
+
+    @contextlib.contextmanager
+    def task(self, description: str="", blocking: bool=False):
+        """ Register the code in the context as a running task.
+        Yields the progress callback of the task, progress(n_done, n_total).
+        """
+        task_id = self.start_task(description, blocking)
+        try:
+            yield lambda n_done, n_total: self.set_task_progress(task_id, n_done, n_total)
+        finally:
+            self.end_task(task_id)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tasks = {}
+        self._update()
 
+loading_state = LoadingState()
 
-with open(os.path.join(os.path.dirname(__file__), "loading.js"), "r") as f:
-    _js = f.read()
-loading_js = f"""
-<script type="text/javascript">
-{_js}
-</script>
-"""
 
 class Loading(object):
-    def __init__(self):       
+    def __init__(self, state: LoadingState|None=None):
         self.do_nothing = False # set false to see loading animation
+        self._state = loading_state if state is None else state
+        self._gif_url = None
+        self._text = None
         self._panel_stylesheet = """
             width: 100vw;
             margin: 0;
             padding: 0;
             background-color: #00ff3090;
         """
-        
-    def get_panel(self, **kwargs) -> panel.viewable.Viewable:
-        html = f"""
+
+    def _get_html(self, counter: int, progress: int|None) -> str:
+        if counter == 0:
+            # new gif and text for next time
+            self._gif_url = None
+            return "<div style='display: none;'></div>"
+        if self._gif_url is None:
+            self._gif_url = random.choice(LOADING_GIFS_URLS)
+            self._text = random.choice(LOADING_TEXT_OPTIONS)
+        progress_text = "" if progress is None else f" {progress}%"
+        return f"""
         <div id="my_loading_html_element" style="
             /*make the div element take the whole screen*/
             margin: 0; 
@@ -53,67 +170,65 @@ class Loading(object):
             justify-content: center;
             align-items: center;
             display: flex;
-            display: none; /* initially hidden */
             flex-direction: column;
         ">
-            <img id="loading_gif" src="" style="width: 100%; max-width: 7.0em; margin: 0; padding: 0;" ondblclick="reset_loading_counter()">
-            <p style="color: #686868ff; font-size: 1.0em; font-weight: 600; margin: 0; padding: 0;">Loading...</p>
+            <img id="loading_gif" src="{self._gif_url}" style="width: 100%; max-width: 7.0em; margin: 0; padding: 0;">
+            <p style="color: #686868ff; font-size: 1.0em; font-weight: 600; margin: 0; padding: 0;">{self._text}{progress_text}</p>
         </div>
-        """ + loading_js
+        """
+
+    def get_panel(self, **kwargs) -> panel.viewable.Viewable:
         if self.do_nothing:
-            html = "<div style='display: none;'>No loading gifs.</div>"
-        return panel.pane.HTML(html, css_classes=['loading-div'], stylesheets=[self._panel_stylesheet])
-    
-# Since communication between all components is messy,
-# we will use a hidden text field that will contain a number greater equal to 0
-# so that, when a component changes, it will increment this number, and when it finishes
-# changing, it will decrement this number.
-# if the number is greater than zero, the loading animation will be visible.
-# if the number is equal to zero, the loading animation will be invisible.
-# this through periodic checks every 0.3 seconds.
-#
-# The idea behind these two widgest it to import them into the dashboard
-# and make them invisible, so that users cannot interact with them.
-# One increases the counter, the other decreases it.
-# You can import the two functions in any other module of the dashboard
-# to increase or decrease the counter (usually, at the beginning and end of get_panel).
-# You can import them as many times as you want, since each new instance
-# will be connected to the same counter through the javascript functions.
-widg_increase = panel.widgets.Toggle(name="Loading Counter Increase", value=False, visible=False)
-widg_increase.jscallback(
-    args={"widg": widg_increase},
-    value="""
-        increase_loading_counter();
-    """
-)
-widg_decrease = panel.widgets.Toggle(name="Loading Counter Decrease", value=False, visible=False)
-widg_decrease.jscallback(
-    args={"widg": widg_decrease},
-    value="""
-        decrease_loading_counter(); 
-    """
-)
+            return panel.pane.HTML("<div style='display: none;'>No loading gifs.</div>")
+        animation = panel.pane.HTML(
+            panel.bind(self._get_html, self._state.param.counter, self._state.param.progress),
+            css_classes=['loading-div'],
+            stylesheets=[self._panel_stylesheet]
+        )
+        progress_bar = panel.indicators.Progress(
+            value=self._state.param.progress,
+            max=100,
+            visible=panel.bind(lambda n_tasks: n_tasks > 0, self._state.param.n_tasks),
+            height=4,
+            sizing_mode="stretch_width",
+            styles={"position": "fixed", "top": "0", "left": "0", "z-index": "9991"},
+        )
+        return panel.Column(animation, progress_bar)
+
+
+# Kept for the modules that mark the beginning and the end of an update with
+# increase_loading_counter() and decrease_loading_counter(): a blocking task
+# is started by the first and ended by the second.
+# Prefer "with loading_state.task(..., blocking=True):", which always ends the task.
+_counter_task_ids = []
+
 def increase_loading_counter():
-    time.sleep(random.random()*0.4)
-    widg_increase.value = not widg_increase.value
+    _counter_task_ids.append(loading_state.start_task(blocking=True))
 
 def decrease_loading_counter():
-    time.sleep(random.random()*0.4)
-    widg_decrease.value = not widg_decrease.value
+    if len(_counter_task_ids) > 0:
+        loading_state.end_task(_counter_task_ids.pop())
 
 if __name__ == "__main__":
-    # TEST    
+    # TEST
     def get_html(text):
         # This pipeline, in this case, is completely general
-        # first thing, tell the dashboard you are starting to change something
-        increase_loading_counter()
-        # do your stuff here
-        import time
-        time.sleep(4)
-        # last thing, tell the dashboard you are finished changing something
-        decrease_loading_counter()
+        # tell the dashboard you are changing something while you do your stuff
+        with loading_state.task(f"Test {text}", blocking=True) as progress:
+            for i in range(4):
+                time.sleep(1)
+                progress(i + 1, 4)
         # return
         return panel.pane.HTML(f"<h1>Test: {text}</h1>")
+    async def get_html_async(text):
+        # a non blocking task: only the progress bar is shown,
+        # and the browser gets each step of the progress
+        import asyncio
+        with loading_state.task(f"Test async {text}") as progress:
+            for i in range(10):
+                await asyncio.sleep(0.4)
+                progress(i + 1, 10)
+        return panel.pane.HTML(f"<h1>Test async: {text}</h1>")
     widget=panel.widgets.RadioButtonGroup(
         options=["Left", "Right"],
         value="Left",
@@ -121,20 +236,9 @@ if __name__ == "__main__":
     )
     header = Loading()
     app = panel.Column(
-        #global_loading_js_pane,
         header.get_panel(),
-        panel.Row(
-            panel.pane.HTML(
-                "<button onclick='loading_visible()'>Show Loading</button>",
-            ),
-            panel.pane.HTML(
-                "<button onclick='loading_invisible()'>Hide Loading</button>",
-            ),
-        ),
         panel.bind(get_html, widget),
+        panel.bind(get_html_async, widget),
         widget,
-        widg_increase,
-        widg_decrease,
     )
     app.show()
-